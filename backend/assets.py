@@ -0,0 +1,159 @@
+"""
+Манифест статики с хэшами содержимого.
+
+Каждый файл фронтенда (app.js, style.css, баннер, фото товаров) получает адрес
+вида /assets/<хэш>/<путь>. Адрес меняется только вместе с содержимым, поэтому
+такие ответы кэшируются навсегда (Cache-Control: immutable), а повторный визит
+не скачивает ничего, что не изменилось.
+
+Сборка манифеста заранее: python assets.py  (пишет frontend/asset-manifest.json).
+Файлы, которых нет в манифесте (например, только что загруженные фото), хэшируются
+при первом обращении.
+"""
+import os
+import json
+import hashlib
+import threading
+
+from logger import get_logger
+
+log = get_logger("assets")
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+ASSET_EXTENSIONS = {".js", ".css", ".webp", ".avif", ".png", ".jpg", ".jpeg", ".svg", ".ico"}
+HASH_LENGTH = 12
+MANIFEST_NAME = "asset-manifest.json"
+
+
+def file_hash(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+class AssetManifest:
+    """
+    Соответствие «путь во frontend/ → хэш содержимого».
+    Запись в манифесте проверяется по (size, mtime_ns): изменённый на диске файл
+    перехэшируется, и его адрес меняется сам собой.
+    """
+
+    def __init__(self, root, manifest_path=None):
+        self.root = os.path.abspath(root)
+        self.manifest_path = manifest_path or os.path.join(self.root, MANIFEST_NAME)
+        self.version = 0            # растёт при каждом изменении адресов
+        self._entries = {}          # rel -> {"hash", "size", "mtime_ns"}
+        self._lock = threading.Lock()
+        self.load()
+
+    # ======== Манифест на диске ========
+
+    def load(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                entries = json.load(f).get("files", {})
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log.warning("Asset manifest unreadable, hashing on demand", extra={"error": str(e)})
+            return
+        with self._lock:
+            self._entries = entries
+            self.version += 1
+
+    def build(self):
+        """Хэширует все файлы статики и сохраняет манифест."""
+        entries = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if os.path.splitext(filename)[1].lower() not in ASSET_EXTENSIONS:
+                    continue
+                path = os.path.join(dirpath, filename)
+                rel = os.path.relpath(path, self.root).replace(os.sep, "/")
+                entries[rel] = self._describe(path)
+        with self._lock:
+            self._entries = entries
+            self.version += 1
+        self.save()
+        return entries
+
+    def save(self):
+        with self._lock:
+            data = {"files": dict(sorted(self._entries.items()))}
+        # Своё имя у каждого процесса: воркеры при старте пишут манифест одновременно
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    # ======== Адреса ========
+
+    def _path(self, rel):
+        """Абсолютный путь к файлу статики; None, если путь выходит за пределы frontend/."""
+        rel = rel.lstrip("/")
+        path = os.path.normpath(os.path.join(self.root, rel))
+        if not path.startswith(self.root + os.sep):
+            return None
+        return path
+
+    @staticmethod
+    def _describe(path):
+        st = os.stat(path)
+        return {"hash": file_hash(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def entry(self, rel, verify=False):
+        """Запись манифеста для файла; verify=True сверяет её с файлом на диске."""
+        entry = self._entries.get(rel)
+        if entry is not None and not verify:
+            return entry
+        path = self._path(rel)
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if entry is not None and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            return entry
+        entry = self._describe(path)
+        with self._lock:
+            self._entries[rel] = entry
+            self.version += 1
+        return entry
+
+    def url(self, rel, verify=False):
+        """Адрес с хэшем для файла из frontend/ (например, "app.js"); None, если файла нет."""
+        rel = rel.lstrip("/")
+        entry = self.entry(rel, verify)
+        if entry is None:
+            return None
+        return f"/assets/{entry['hash']}/{rel}"
+
+    def static_url(self, url):
+        """Переводит /static/<путь> в адрес с хэшем; остальные адреса не меняет."""
+        if not isinstance(url, str) or not url.startswith("/static/"):
+            return url
+        return self.url(url[len("/static/"):]) or url
+
+    def refresh(self, rel):
+        """Перечитывает файл после перезаписи (например, нового баннера) и возвращает новый адрес."""
+        return self.url(rel, verify=True)
+
+    def resolve(self, digest, rel):
+        """
+        Файл для /assets/<хэш>/<путь>: (path, fresh).
+        fresh=False — файл уже изменился, и его нельзя кэшировать навсегда под этим адресом.
+        """
+        entry = self.entry(rel, verify=True)
+        if entry is None:
+            return None, False
+        return self._path(rel), entry["hash"] == digest
+
+
+if __name__ == "__main__":
+    frontend_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "frontend")
+    manifest = AssetManifest(frontend_dir)
+    files = manifest.build()
+    print(f"✅ {len(files)} файлов → {manifest.manifest_path}")
@@ -0,0 +1,611 @@
+"""
+Бенчмарк бэкенда на синтетических каталогах: пропускная способность и задержки
+(p50/p99) основных эндпоинтов и время обработки одного фото в ImageProcessor.
+
+Запуск: python bench_backend.py [--sizes 10,1000,10000,100000] [--requests 300]
+        [--concurrency 8] [--json results.json] [--compare baseline.json]
+
+Для каждого размера каталога в отдельной временной папке генерируются
+products.json и promos.json (та же схема, что у настоящих файлов), база заказов
+заполняется синтетическими продажами, и поднимается отдельный uvicorn — файлы
+репозитория не трогаются. Telegram Bot API заменён локальной заглушкой
+(TELEGRAM_API_URL), поэтому заказы проходят весь путь до отправки уведомления.
+
+Отдельно меряется холодный импорт main: он должен укладываться в бюджет
+(--import-budget-ms), не грузить PIL/httpx и не создавать файлов, — и поисковый
+индекс в том же процессе: построение, запрос и правка по одному товару.
+
+Результаты — JSON с хэшем коммита; --compare сравнивает их с прошлым прогоном.
+Код выхода 1, если p50/p99 или RPS ухудшились больше --threshold или импорт
+вышел за бюджет.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import socket
+import platform
+import argparse
+import datetime
+import tempfile
+import threading
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+ADMIN_TOKEN = "bench-admin"
+PROMO_CODE = "BENCH10"
+
+COLORS = ["белый", "черный", "серый", "бежевый", "синий", "зеленый", "красный", "розовый"]
+KINDS = ["Футболка", "Толстовка", "Худи", "Лонгслив", "Свитшот", "Брюки", "Шорты", "Кепка"]
+FITS = ["box-fit", "oversize", "slim", "basic", "cropped"]
+SIZE_SETS = [["one size"], ["S", "M", "L"], ["XS", "S", "M", "L", "XL"], ["40", "42", "44", "46"]]
+# Запросы поиска: одно слово, начало слова (ввод), несколько слов
+SEARCH_QUERIES = ["футболка", "толст", "худи черный", "oversize", "брюки slim серые", "хлопок 100", "ке"]
+
+
+# ======== Синтетические данные ========
+
+def make_product(product_id, rng):
+    """Товар в схеме products.json (как после create_product)."""
+    sizes = rng.choice(SIZE_SETS)
+    image = f"/static/images/products/bench_{product_id}-small.webp"
+    image_large = f"/static/images/products/bench_{product_id}-large.webp"
+    return {
+        "id": product_id,
+        "name": f"{rng.choice(KINDS)} {rng.choice(FITS)} #{product_id}",
+        "price": rng.randrange(1500, 15000, 100),
+        "color": rng.choice(COLORS),
+        # Запас большой: заказы в бенчмарке не должны упираться в остатки
+        "available_sizes": {size: rng.randint(1000, 5000) for size in sizes},
+        "composition": f"{rng.randint(80, 100)}% хлопок",
+        "description": "Синтетический товар для нагрузочного теста. " * rng.randint(1, 4),
+        "image": image,
+        "image_large": image_large,
+        "images": [image],
+        "images_large": [image_large],
+    }
+
+
+def write_catalog(directory, count, seed=42):
+    rng = random.Random(seed)
+    products = [make_product(i, rng) for i in range(1, count + 1)]
+    with open(os.path.join(directory, "products.json"), "w", encoding="utf-8") as f:
+        json.dump(products, f, ensure_ascii=False)
+    with open(os.path.join(directory, "promos.json"), "w", encoding="utf-8") as f:
+        json.dump({PROMO_CODE.lower(): {"discount": 10, "description": "bench"}}, f, ensure_ascii=False)
+    return products
+
+
+def seed_orders(db_path, products, count, seed=42):
+    """Заказы за последние 30 дней — чтобы статистике было что агрегировать."""
+    from order_analytics import OrderLog
+
+    rng = random.Random(seed)
+    order_log = OrderLog(db_path)
+    now = time.time()
+    for _ in range(count):
+        items = []
+        for product in rng.sample(products, min(len(products), rng.randint(1, 3))):
+            items.append({"product_id": product["id"], "name": product["name"],
+                          "size": rng.choice(list(product["available_sizes"])),
+                          "qty": rng.randint(1, 2), "price": product["price"]})
+        total = sum(item["qty"] * item["price"] for item in items)
+        promo = PROMO_CODE if rng.random() < 0.2 else None
+        order_log.record(items, total, user_id=rng.randint(1, 500), promo=promo,
+                         created_at=now - rng.uniform(0, 30 * 86400))
+
+
+def make_jpeg(size=(1600, 1200)):
+    from bench_images import make_photo
+
+    with tempfile.NamedTemporaryFile(suffix=".jpg") as tmp:
+        make_photo(tmp.name, size)
+        return open(tmp.name, "rb").read()
+
+
+# ======== Заглушка Telegram ========
+
+class TelegramStub:
+    """Локальный Bot API: на любой метод отвечает ok, считает вызовы."""
+
+    def __init__(self):
+        stub = self
+        self.calls = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with stub._lock:
+                    stub.calls += 1
+                    message_id = stub.calls
+                body = json.dumps({"ok": True, "result": {"message_id": message_id}}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ======== Сервер ========
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, telegram_url, log_path, workers=1):
+    """uvicorn с main:app; рабочая папка — временная, пути данных указывают в неё."""
+    port = free_port()
+    env = {
+        **os.environ,
+        "ADMIN_SECRET": ADMIN_TOKEN,
+        "BOT_TOKEN": "bench",
+        "MANAGER_CHAT_ID": "1",
+        "TELEGRAM_API_URL": telegram_url,
+        "STORAGE_BACKEND": "json",
+        "PROMOS_FILE": os.path.join(workdir, "promos.json"),
+        "ORDERS_DB_PATH": os.path.join(workdir, "orders.db"),
+        "NOTIFY_QUEUE_PATH": os.path.join(workdir, "notifications.db"),
+        "IMAGE_CACHE_DIR": os.path.join(workdir, "image_cache"),
+        "LOG_LEVEL": "WARNING",
+        "WEB_CONCURRENCY": str(workers),
+        # Индекс строится на прогревочных запросах сценария search, а не в фоне во время других
+        "SEARCH_WARMUP": "0",
+    }
+    log_file = open(log_path, "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR,
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--no-access-log",
+         "--workers", str(workers)],
+        cwd=workdir, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    return process, base_url, log_file
+
+
+def wait_ready(client, process, log_path, timeout=300):
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            with open(log_path, encoding="utf-8", errors="replace") as f:
+                raise RuntimeError(f"Сервер завершился с кодом {process.returncode}:\n{f.read()[-2000:]}")
+        try:
+            if client.get("/api/test").status_code == 200:
+                return time.perf_counter() - started
+        except Exception:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("Сервер не поднялся")
+
+
+def stop_server(process, log_file):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    log_file.close()
+
+
+# ======== Нагрузка ========
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_load(request, count, concurrency, warmup):
+    """Выполняет request(i) count раз в concurrency потоков; возвращает RPS и задержки в мс."""
+    for i in range(warmup):
+        request(-1 - i)
+
+    latencies = []
+    errors = 0
+    statuses = {}
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            status = request(i).status_code
+        except Exception as e:
+            status = type(e).__name__
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if not isinstance(status, int) or status >= 400:
+                errors += 1
+
+    wall = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(count)))
+    wall = time.perf_counter() - wall
+
+    latencies.sort()
+    return {
+        "requests": count,
+        "concurrency": concurrency,
+        "errors": errors,
+        "statuses": statuses,
+        "rps": round(count / wall, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "mean_ms": round(statistics.fmean(latencies), 2),
+        "max_ms": round(latencies[-1], 2),
+    }
+
+
+def scenarios(client, products, photo, args):
+    """Имя → (запрос, число запросов, параллельность)."""
+    rng = random.Random(7)
+
+    def products_all(i):
+        return client.get("/api/products", headers={"Accept-Encoding": "gzip"})
+
+    def products_page(i):
+        return client.get("/api/products", params={"limit": 20, "color": rng.choice(COLORS), "sort": "price"})
+
+    def promo(i):
+        return client.post("/api/promo", json={"code": PROMO_CODE, "user_id": i})
+
+    def search(i):
+        return client.get("/api/search", params={"q": rng.choice(SEARCH_QUERIES)})
+
+    def admin_statistics(i):
+        return client.get("/api/admin/statistics", params={"token": ADMIN_TOKEN})
+
+    def order(i):
+        product = products[abs(i) % len(products)]
+        size = next(iter(product["available_sizes"]))
+        return client.post("/api/order", json={
+            "products": [{"productId": product["id"], "name": product["name"], "size": size,
+                          "quantity": 1, "price": product["price"]}],
+            "user": {"id": 10_000 + abs(i), "first_name": "Bench"},
+            "total_price": product["price"],
+        })
+
+    def create_product(i):
+        return client.post("/api/admin/products", data={
+            "token": ADMIN_TOKEN, "name": f"Бенч товар {i}", "price": "5000", "color": "черный",
+            "composition": "100% хлопок", "description": "Создан бенчмарком",
+            "available_sizes": json.dumps({"S": 5, "M": 5}),
+        }, files=[("images", ("photo.jpg", io.BytesIO(photo), "image/jpeg"))])
+
+    return {
+        "products": (products_all, args.requests, args.concurrency),
+        "products_page": (products_page, args.requests, args.concurrency),
+        "promo": (promo, args.requests, args.concurrency),
+        "search": (search, args.requests, args.concurrency),
+        "admin_statistics": (admin_statistics, args.requests, args.concurrency),
+        "order": (order, args.order_requests, args.concurrency),
+        # Фото обрабатываются в пуле процессов — много параллельных загрузок упрутся в 503
+        "create_product": (create_product, args.create_requests, min(args.concurrency, 2)),
+    }
+
+
+def bench_catalog(size, photo, args):
+    import httpx
+
+    with tempfile.TemporaryDirectory(prefix=f"bench-{size}-") as root:
+        # Та же раскладка, что в репозитории: картинки пишутся в ../frontend/images от рабочей папки
+        workdir = os.path.join(root, "backend")
+        os.makedirs(workdir)
+        generated = time.perf_counter()
+        products = write_catalog(workdir, size)
+        seed_orders(os.path.join(workdir, "orders.db"), products, args.orders)
+        generated = time.perf_counter() - generated
+
+        stub = TelegramStub()
+        log_path = os.path.join(workdir, "server.log")
+        process, base_url, log_file = start_server(workdir, stub.url, log_path, args.workers)
+        try:
+            limits = httpx.Limits(max_connections=args.concurrency * 2)
+            with httpx.Client(base_url=base_url, timeout=120, limits=limits) as client:
+                startup = wait_ready(client, process, log_path)
+                result = {
+                    "products": size,
+                    "generate_s": round(generated, 3),
+                    "startup_s": round(startup, 3),
+                    "endpoints": {},
+                }
+                for name, (request, count, concurrency) in scenarios(client, products, photo, args).items():
+                    if count <= 0 or (args.only and name not in args.only):
+                        continue
+                    warmup = min(args.warmup, count) if name != "create_product" else 0
+                    stats = run_load(request, count, concurrency, warmup)
+                    result["endpoints"][name] = stats
+                    print(f"   {name:<17} {stats['rps']:>8.1f} rps   p50 {stats['p50_ms']:>8.2f} мс   "
+                          f"p99 {stats['p99_ms']:>8.2f} мс   ошибок {stats['errors']}")
+                result["telegram_calls"] = stub.calls
+                return result
+        finally:
+            stop_server(process, log_file)
+            stub.close()
+
+
+# ======== Импорт ========
+
+# Модули, которые не должны грузиться при импорте main — только при первом использовании
+HEAVY_MODULES = ("PIL", "httpx", "requests")
+IMPORT_CHILD = """
+import os, sys, json, time
+started = time.perf_counter()
+import fastapi
+framework = time.perf_counter()
+import main
+done = time.perf_counter()
+print(json.dumps({
+    "framework_ms": (framework - started) * 1000,
+    "app_ms": (done - framework) * 1000,
+    "heavy_modules": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def bench_import(repeat, budget_ms):
+    """
+    Холодный импорт main в новом процессе: время собственных модулей приложения
+    (без FastAPI), загруженные тяжёлые библиотеки и файлы, созданные при импорте.
+    """
+    runs = []
+    created = set()
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix="bench-import-") as tmp:
+            out = subprocess.run([sys.executable, "-c", IMPORT_CHILD], cwd=tmp, capture_output=True, text=True,
+                                 check=True, env={**os.environ, "PYTHONPATH": BACKEND_DIR})
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            created.update(os.listdir(tmp))
+    result = {
+        "app_ms": round(statistics.median(r["app_ms"] for r in runs), 1),
+        "framework_ms": round(statistics.median(r["framework_ms"] for r in runs), 1),
+        "budget_ms": budget_ms,
+        "heavy_modules": sorted({m for r in runs for m in r["heavy_modules"]}),
+        "created_files": sorted(created),
+    }
+    print(f"⏱ Импорт main: {result['app_ms']:.0f} мс (+ FastAPI {result['framework_ms']:.0f} мс), "
+          f"бюджет {budget_ms} мс")
+    if result["heavy_modules"]:
+        print(f"   ⚠️ при импорте загружены: {', '.join(result['heavy_modules'])}")
+    if result["created_files"]:
+        print(f"   ⚠️ при импорте созданы файлы: {', '.join(result['created_files'])}")
+    return result
+
+
+def import_violations(startup):
+    violations = []
+    if startup["app_ms"] > startup["budget_ms"]:
+        violations.append(f"import {startup['app_ms']} мс > {startup['budget_ms']} мс")
+    violations += [f"import loads {m}" for m in startup["heavy_modules"]]
+    violations += [f"import creates {f}" for f in startup["created_files"]]
+    return violations
+
+
+# ======== Обработка фото ========
+
+def bench_images(photo_sizes, repeat):
+    """Время render_sizes на одно фото: целиком и по этапам (медиана из repeat прогонов)."""
+    from bench_images import make_photo
+
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench-images-") as tmp:
+        # Модуль при импорте создаёт папки по умолчанию (и ../frontend) относительно текущей
+        os.makedirs(os.path.join(tmp, "backend"))
+        os.chdir(os.path.join(tmp, "backend"))
+        try:
+            from image_processor import ImageProcessor
+        finally:
+            os.chdir(cwd)
+        processor = ImageProcessor(source_folder=tmp, output_folder=tmp, originals_folder=tmp)
+        for label, size in photo_sizes.items():
+            path = os.path.join(tmp, f"{label}.jpg")
+            make_photo(path, size)
+            walls = []
+            stages = {}
+            for _ in range(repeat):
+                started = time.perf_counter()
+                rendered = processor.render_sizes(path, f"bench-{label}")
+                walls.append(time.perf_counter() - started)
+                for size_name, timings in rendered["timings"].items():
+                    for stage, seconds in timings.items():
+                        stages.setdefault(f"{size_name}.{stage}", []).append(seconds)
+            results[label] = {
+                "per_image_ms": round(statistics.median(walls) * 1000, 1),
+                "stages_ms": {name: round(statistics.median(values) * 1000, 1) for name, values in stages.items()},
+            }
+            print(f"📷 {label}: {results[label]['per_image_ms']:.0f} мс на фото")
+    return results
+
+
+# ======== Поиск ========
+
+def bench_search(sizes, repeat):
+    """Поисковый индекс в процессе: построение, запросы из SEARCH_QUERIES, добавление и удаление товара."""
+    from search_index import SearchIndex
+
+    results = {}
+    for size in sizes:
+        rng = random.Random(42)
+        products = [make_product(i, rng) for i in range(1, size + 1)]
+        started = time.perf_counter()
+        index = SearchIndex()
+        index.sync(products)
+        build = time.perf_counter() - started
+
+        latencies = []
+        for _ in range(repeat):
+            for query in SEARCH_QUERIES:
+                started = time.perf_counter()
+                index.query(query)
+                latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+
+        started = time.perf_counter()
+        index.add(make_product(size + 1, rng))
+        index.remove(size + 1)
+        update = time.perf_counter() - started
+
+        results[str(size)] = {
+            "build_ms": round(build * 1000, 1),
+            "query_p50_ms": round(percentile(latencies, 0.50), 3),
+            "query_p99_ms": round(percentile(latencies, 0.99), 3),
+            "add_remove_ms": round(update * 1000, 3),
+        }
+        stats = results[str(size)]
+        print(f"🔎 Поиск, {size} товаров: индекс {stats['build_ms']:.0f} мс, запрос p50 {stats['query_p50_ms']} мс "
+              f"p99 {stats['query_p99_ms']} мс, товар +/- {stats['add_remove_ms']} мс")
+    return results
+
+
+# ======== Сравнение ========
+
+def compare(baseline, current, threshold):
+    """Печатает изменения p50/p99/RPS; возвращает список регрессий."""
+    regressions = []
+    for size, catalog in current.get("catalogs", {}).items():
+        old_catalog = baseline.get("catalogs", {}).get(size)
+        if not old_catalog:
+            continue
+        for name, stats in catalog["endpoints"].items():
+            old = old_catalog["endpoints"].get(name)
+            if not old:
+                continue
+            parts = []
+            for key, higher_is_better in (("p50_ms", False), ("p99_ms", False), ("rps", True)):
+                before, after = old[key], stats[key]
+                if not before:
+                    continue
+                change = (after - before) / before
+                worse = -change if higher_is_better else change
+                mark = " ⚠️" if worse > threshold else ""
+                parts.append(f"{key} {before} → {after} ({change:+.0%}){mark}")
+                if worse > threshold:
+                    regressions.append(f"{size}/{name}/{key}")
+            print(f"   {size:>6} {name:<17} " + ", ".join(parts))
+    old_import, new_import = baseline.get("import"), current.get("import")
+    if old_import and new_import and old_import["app_ms"]:
+        change = (new_import["app_ms"] - old_import["app_ms"]) / old_import["app_ms"]
+        print(f"   ⏱ импорт main: {old_import['app_ms']} → {new_import['app_ms']} мс ({change:+.0%})")
+        if change > threshold:
+            regressions.append("import")
+    for size, search in current.get("search", {}).items():
+        old = baseline.get("search", {}).get(size)
+        if old and old["query_p50_ms"]:
+            change = (search["query_p50_ms"] - old["query_p50_ms"]) / old["query_p50_ms"]
+            print(f"   🔎 {size}: запрос {old['query_p50_ms']} → {search['query_p50_ms']} мс ({change:+.0%})")
+            if change > threshold:
+                regressions.append(f"search/{size}")
+    for label, image in current.get("images", {}).items():
+        old = baseline.get("images", {}).get(label)
+        if old and old["per_image_ms"]:
+            change = (image["per_image_ms"] - old["per_image_ms"]) / old["per_image_ms"]
+            print(f"   📷 {label}: {old['per_image_ms']} → {image['per_image_ms']} мс ({change:+.0%})")
+            if change > threshold:
+                regressions.append(f"images/{label}")
+    return regressions
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BACKEND_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,1000,10000,100000", help="размеры каталогов через запятую")
+    parser.add_argument("--requests", type=int, default=300, help="запросов на эндпоинт чтения")
+    parser.add_argument("--order-requests", type=int, default=100)
+    parser.add_argument("--create-requests", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=1, help="воркеров uvicorn")
+    parser.add_argument("--orders", type=int, default=2000, help="синтетических заказов в журнале")
+    parser.add_argument("--only", type=lambda s: set(s.split(",")), help="только эти сценарии")
+    parser.add_argument("--image-repeat", type=int, default=3)
+    parser.add_argument("--skip-images", action="store_true")
+    parser.add_argument("--search-repeat", type=int, default=50)
+    parser.add_argument("--skip-search", action="store_true")
+    parser.add_argument("--import-repeat", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=150,
+                        help="бюджет на импорт модулей приложения (без FastAPI)")
+    parser.add_argument("--json", help="куда сохранить результаты")
+    parser.add_argument("--compare", help="прошлый JSON для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.15, help="допустимое ухудшение (доля)")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    commit, dirty = git_revision()
+    results = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: sorted(v) if isinstance(v, set) else v for k, v in vars(args).items()},
+        },
+        "catalogs": {},
+    }
+
+    results["import"] = bench_import(args.import_repeat, args.import_budget_ms)
+
+    photo = make_jpeg()
+    for size in sizes:
+        print(f"📦 Каталог {size} товаров")
+        results["catalogs"][str(size)] = bench_catalog(size, photo, args)
+
+    if not args.skip_search:
+        results["search"] = bench_search(sizes, args.search_repeat)
+
+    if not args.skip_images:
+        results["images"] = bench_images({"2MP": (1600, 1200), "12MP": (4000, 3000)}, args.image_repeat)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✅ Результаты сохранены в {args.json}")
+
+    regressions = import_violations(results["import"])
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"🔍 Сравнение с {baseline.get('meta', {}).get('commit') or args.compare}")
+        regressions += compare(baseline, results, args.threshold)
+    if regressions:
+        print(f"❌ Регрессии: {', '.join(regressions)}")
+        sys.exit(1)
+    if args.compare:
+        print("✅ Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
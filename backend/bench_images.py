@@ -0,0 +1,143 @@
+"""
+Бенчмарк обработки фото товаров: старый пайплайн (полное декодирование,
+каждый размер из оригинала, method=6) против ImageProcessor.render_sizes.
+
+Запуск: python bench_images.py [--repeat 3] [--json results.json] [фото.jpg ...]
+Без аргументов генерирует синтетические снимки 12 и 24 Мп, как с телефона.
+Каждый замер идёт в отдельном процессе, чтобы пиковая память (ru_maxrss) была честной.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import resource
+import subprocess
+
+PHONE_SIZES = {"12MP": (4000, 3000), "24MP": (6000, 4000)}
+
+
+def make_photo(path, size):
+    """Синтетическое «фото»: градиент + шум, чтобы JPEG не сжимался до нуля."""
+    from PIL import Image
+
+    width, height = size
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 40)
+    img = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    img.save(path, "JPEG", quality=92)
+
+
+def legacy_pipeline(processor, path, base_name):
+    """Пайплайн до оптимизации, повторён здесь для сравнения."""
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img = processor._ensure_rgb(img)
+        for size_name, (tw, th) in processor.sizes.items():
+            ratio = max(tw / img.width, th / img.height)
+            resized = img.resize((int(img.width * ratio), int(img.height * ratio)), Image.Resampling.LANCZOS)
+            left = int((resized.width - tw) / 2)
+            top = int((resized.height - th) / 2)
+            cropped = resized.crop((left, top, left + tw, top + th))
+            cropped.save(os.path.join(processor.output_folder, f"{base_name}-{size_name}.webp"),
+                         format="WEBP", quality=85, method=6)
+
+
+def measure(mode, path, out_dir):
+    """Выполняется в дочернем процессе: один прогон, печатает JSON с метриками."""
+    import contextlib
+    import io
+    from image_processor import ImageProcessor
+
+    processor = ImageProcessor(source_folder=out_dir, output_folder=out_dir, originals_folder=out_dir)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == "legacy":
+            legacy_pipeline(processor, path, "bench")
+        elif mode == "optimized":
+            # Те же выходные размеры и форматы, что и у legacy — честное сравнение пайплайнов
+            processor.ladder = []
+            processor.extra_formats = []
+            processor.render_sizes(path, "bench")
+        else:
+            # Полный конвейер: лестница ширин для srcset и копии AVIF/JPEG
+            processor.render_sizes(path, "bench")
+    result = {
+        "cpu_s": round(time.process_time() - cpu, 4),
+        "wall_s": round(time.perf_counter() - wall, 4),
+        # ru_maxrss в Linux — в килобайтах
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_rss_delta_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024, 1),
+        "output_bytes": {
+            name: os.path.getsize(os.path.join(out_dir, f"bench-{name}.webp")) for name in processor.sizes
+        },
+    }
+    print(json.dumps(result))
+
+
+def run_case(mode, path, out_dir, repeat):
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", mode, path, out_dir],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    best = min(runs, key=lambda r: r["cpu_s"])
+    best["peak_rss_mb"] = max(r["peak_rss_mb"] for r in runs)
+    best["peak_rss_delta_mb"] = max(r["peak_rss_delta_mb"] for r in runs)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("photos", nargs="*", help="исходные фото (по умолчанию — синтетические 12/24 Мп)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="куда сохранить результаты")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    parser.add_argument("--make", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure(*args.child)
+        return
+    if args.make:
+        make_photo(args.make[0], (int(args.make[1]), int(args.make[2])))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        photos = {os.path.basename(p): p for p in args.photos}
+        if not photos:
+            for label, (width, height) in PHONE_SIZES.items():
+                path = os.path.join(tmp, f"{label}.jpg")
+                # Генерируем в отдельном процессе: ru_maxrss наследуется через exec,
+                # и большой родитель испортил бы замеры памяти дочерних процессов
+                subprocess.run([sys.executable, os.path.abspath(__file__), "--make", path, str(width), str(height)],
+                               check=True)
+                photos[label] = path
+
+        results = {}
+        for label, path in photos.items():
+            results[label] = {
+                mode: run_case(mode, path, tmp, args.repeat) for mode in ("legacy", "optimized", "ladder")
+            }
+            legacy, optimized = results[label]["legacy"], results[label]["optimized"]
+            print(f"📷 {label}: CPU {legacy['cpu_s']:.2f}s → {optimized['cpu_s']:.2f}s "
+                  f"(x{legacy['cpu_s'] / max(optimized['cpu_s'], 1e-6):.1f}), "
+                  f"пик памяти {legacy['peak_rss_mb']:.0f} → {optimized['peak_rss_mb']:.0f} МБ, "
+                  f"вес {legacy['output_bytes']} → {optimized['output_bytes']}; "
+                  f"с лестницей ширин и AVIF/JPEG: CPU {results[label]['ladder']['cpu_s']:.2f}s")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✅ Результаты сохранены в {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+Массовый импорт товаров: манифест CSV/JSON + фото (ZIP-архив или папка).
+
+Фото обрабатываются параллельно в пуле процессов, прогресс отдаётся событиями,
+а вся пачка товаров попадает в каталог одной транзакцией хранилища: либо все
+товары, либо ни одного (файлы картинок неудачного импорта удаляются).
+
+Манифест — колонки (CSV, разделитель «,» или «;») или ключи (JSON):
+    name, price, color, composition, description,
+    available_sizes — {"S": 5, "M": 3} или «S:5; M:3»,
+    images — список имён файлов или «front.jpg; back.jpg».
+
+CLI (из папки backend): python bulk_import.py manifest.csv photos.zip|photos/ [--dry-run]
+"""
+import os
+import io
+import csv
+import json
+import time
+import asyncio
+import zipfile
+import threading
+
+from catalog import new_product_record
+from logger import get_logger
+
+log = get_logger("bulk_import")
+
+MAX_ROWS = 5000
+MAX_PHOTO_BYTES = 25 * 1024 * 1024
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".avif")
+
+
+class BulkImportError(Exception):
+    """Манифест или архив с фото не подходят для импорта."""
+
+
+# ======== Манифест ========
+
+def parse_manifest(data: bytes, filename="manifest.csv"):
+    """Строки манифеста как список словарей (CSV или JSON — по расширению/содержимому)."""
+    text = data.decode("utf-8-sig")
+    if filename.lower().endswith(".json") or text.lstrip().startswith(("[", "{")):
+        try:
+            rows = json.loads(text)
+        except ValueError as e:
+            raise BulkImportError(f"Некорректный JSON: {e}")
+        if isinstance(rows, dict):
+            rows = rows.get("products", [])
+        if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+            raise BulkImportError("JSON-манифест должен быть списком товаров")
+    else:
+        # Разделитель — по заголовку: Excel в русской локали сохраняет CSV через «;»
+        header = text.split("\n", 1)[0]
+        delimiter = max(",;\t", key=header.count)
+        rows = [{(k or "").strip().lower(): v for k, v in row.items()}
+                for row in csv.DictReader(io.StringIO(text), delimiter=delimiter)]
+    if not rows:
+        raise BulkImportError("Манифест пуст")
+    if len(rows) > MAX_ROWS:
+        raise BulkImportError(f"Слишком много товаров: {len(rows)} (лимит {MAX_ROWS})")
+    return rows
+
+
+def _split_list(value):
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if str(v).strip()]
+    for separator in (";", "|", ","):
+        if separator in (value or ""):
+            return [v.strip() for v in value.split(separator) if v.strip()]
+    return [value.strip()] if value and value.strip() else []
+
+
+def _parse_sizes(value):
+    if isinstance(value, dict):
+        sizes = value
+    elif isinstance(value, str) and value.strip().startswith("{"):
+        sizes = json.loads(value)
+    else:
+        sizes = {}
+        for item in _split_list(value or ""):
+            size, _, qty = item.replace("=", ":").partition(":")
+            sizes[size.strip()] = qty.strip() or 0
+    return {str(size): int(qty) for size, qty in sizes.items()}
+
+
+def normalize_row(row):
+    """Поля товара и список фото из строки манифеста; ValueError с понятным текстом, если строка плохая."""
+    name = str(row.get("name") or "").strip()
+    if not name:
+        raise ValueError("не указано название (name)")
+    try:
+        price = int(float(str(row.get("price", "")).replace(" ", "").replace(",", ".")))
+    except ValueError:
+        raise ValueError(f"некорректная цена: {row.get('price')!r}")
+    if price < 0:
+        raise ValueError("цена не может быть отрицательной")
+    try:
+        sizes = _parse_sizes(row.get("available_sizes", row.get("sizes")))
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError(f"некорректные размеры: {row.get('available_sizes', row.get('sizes'))!r}")
+    if any(qty < 0 for qty in sizes.values()):
+        raise ValueError("остаток размера не может быть отрицательным")
+    images = _split_list(row.get("images") or row.get("image") or "")
+    if not images:
+        raise ValueError("нет фото (images)")
+    fields = {
+        "name": name,
+        "price": price,
+        "color": str(row.get("color") or "").strip(),
+        "available_sizes": sizes,
+        "composition": str(row.get("composition") or "").strip(),
+        "description": str(row.get("description") or "").strip(),
+    }
+    return fields, images
+
+
+# ======== Фото ========
+
+class PhotoSource:
+    """
+    Фото из ZIP-архива (путь или файловый объект) или из папки.
+    В манифесте можно указывать как путь внутри архива, так и просто имя файла.
+    """
+
+    def __init__(self, source):
+        self._lock = threading.Lock()
+        self._zip = None
+        self._folder = None
+        self._index = {}
+        if isinstance(source, str) and os.path.isdir(source):
+            self._folder = os.path.abspath(source)
+            for dirpath, _, filenames in os.walk(self._folder):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    self._add(os.path.relpath(path, self._folder).replace(os.sep, "/"), path)
+        else:
+            try:
+                self._zip = zipfile.ZipFile(source)
+            except (zipfile.BadZipFile, OSError) as e:
+                raise BulkImportError(f"Не удалось открыть архив с фото: {e}")
+            for info in self._zip.infolist():
+                if not info.is_dir() and not info.filename.startswith("__MACOSX/"):
+                    self._add(info.filename, info)
+
+    def _add(self, name, ref):
+        if not name.lower().endswith(PHOTO_EXTENSIONS):
+            return
+        self._index.setdefault(name.lower(), ref)
+        self._index.setdefault(os.path.basename(name).lower(), ref)
+
+    def __contains__(self, name):
+        return name.lower() in self._index
+
+    def read(self, name) -> bytes:
+        ref = self._index[name.lower()]
+        if self._zip is not None:
+            if ref.file_size > MAX_PHOTO_BYTES:
+                raise BulkImportError(f"{name}: файл больше {MAX_PHOTO_BYTES // (1024 * 1024)} МБ")
+            with self._lock:
+                return self._zip.read(ref)
+        if os.path.getsize(ref) > MAX_PHOTO_BYTES:
+            raise BulkImportError(f"{name}: файл больше {MAX_PHOTO_BYTES // (1024 * 1024)} МБ")
+        with open(ref, "rb") as f:
+            return f.read()
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+
+# ======== Импорт ========
+
+class BulkImporter:
+    """
+    Проверяет манифест целиком, затем параллельно обрабатывает все фото и одной
+    транзакцией добавляет товары в каталог. run() — асинхронный генератор событий:
+    start → progress (на каждое фото) → done, либо error.
+    """
+
+    def __init__(self, catalog, processor, pool, concurrency=None):
+        self.catalog = catalog
+        self.processor = processor
+        self.pool = pool
+        # Не больше, чем воркеров в пуле: импорт не должен забивать очередь загрузкам из админки
+        self.concurrency = concurrency or pool.max_workers
+
+    def plan(self, rows, photos):
+        """Проверяет все строки до начала обработки. Возвращает (товары, ошибки)."""
+        items, errors = [], []
+        for line, row in enumerate(rows, start=1):
+            try:
+                fields, images = normalize_row(row)
+            except ValueError as e:
+                errors.append({"row": line, "error": str(e)})
+                continue
+            missing = [name for name in images if name not in photos]
+            if missing:
+                errors.append({"row": line, "error": f"нет фото в архиве: {', '.join(missing)}"})
+                continue
+            items.append((fields, images))
+        return items, errors
+
+    async def run(self, rows, photos):
+        started = time.perf_counter()
+        items, errors = self.plan(rows, photos)
+        if errors:
+            yield {"event": "error", "message": "Манифест содержит ошибки, ничего не импортировано",
+                   "errors": errors}
+            return
+
+        total = sum(len(images) for _, images in items)
+        yield {"event": "start", "products": len(items), "images": total}
+
+        ids = await asyncio.to_thread(self.catalog.allocate_ids, len(items))
+        slots = asyncio.Semaphore(self.concurrency)
+        base_names = []
+
+        async def render(index, position, name, base_name):
+            async with slots:
+                try:
+                    data = await asyncio.to_thread(photos.read, name)
+                    rendered = await self.processor.render_bytes_async(data, base_name, self.pool)
+                except BulkImportError:
+                    raise
+                except Exception as e:
+                    raise BulkImportError(f"{name}: {e}") from e
+                return index, position, name, rendered
+
+        tasks = []
+        for index, (product_id, (_, images)) in enumerate(zip(ids, items)):
+            for position, name in enumerate(images):
+                base_name = f"product-{product_id}-{position + 1}"
+                base_names.append(base_name)
+                tasks.append(asyncio.ensure_future(render(index, position, name, base_name)))
+
+        results = [[None] * len(images) for _, images in items]
+        committed = False
+        try:
+            for done, future in enumerate(asyncio.as_completed(tasks), start=1):
+                try:
+                    index, position, name, rendered = await future
+                except Exception as e:
+                    yield {"event": "error", "message": f"Ошибка обработки фото: {e}"}
+                    return
+                results[index][position] = rendered
+                yield {"event": "progress", "done": done, "total": total,
+                       "product": items[index][0]["name"], "image": name}
+
+            products = [
+                new_product_record(product_id, rendered=rendered, **fields)
+                for product_id, (fields, _), rendered in zip(ids, items, results)
+            ]
+            await asyncio.to_thread(self.catalog.add_many, products)
+            committed = True
+            yield {"event": "done", "created": ids, "seconds": round(time.perf_counter() - started, 2)}
+        finally:
+            if not committed:
+                # Откат: отменяем оставшуюся обработку и удаляем уже созданные файлы
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await asyncio.to_thread(self._cleanup, base_names)
+
+    def _cleanup(self, base_names):
+        for base_name in base_names:
+            try:
+                self.processor.remove_outputs(base_name)
+            except OSError as e:
+                log.warning("Bulk import cleanup failed", extra={"base_name": base_name, "error": str(e)})
+
+
+async def _cli(manifest_path, photos_path, dry_run):
+    from storage import create_storage
+    from catalog import ProductCatalog
+    from image_pool import ImagePool
+    from image_processor import image_processor
+
+    with open(manifest_path, "rb") as f:
+        rows = parse_manifest(f.read(), manifest_path)
+    photos = PhotoSource(photos_path)
+    storage = create_storage("products.json", os.path.join(os.path.dirname(os.path.abspath(__file__)), "promos.json"))
+    catalog = ProductCatalog(storage)
+    # В CLI не нужно оставлять ядра под витрину — занимаем все
+    pool = ImagePool(max_workers=os.cpu_count())
+    importer = BulkImporter(catalog, image_processor, pool)
+    try:
+        if dry_run:
+            items, errors = importer.plan(rows, photos)
+            for error in errors:
+                print(f"❌ Строка {error['row']}: {error['error']}")
+            print(f"{'✅' if not errors else '⚠️'} Проверено: {len(items)} товаров готовы к импорту, ошибок: {len(errors)}")
+            return not errors
+        async for event in importer.run(rows, photos):
+            if event["event"] == "start":
+                print(f"🔄 Импорт {event['products']} товаров, {event['images']} фото...")
+            elif event["event"] == "progress":
+                print(f"   [{event['done']}/{event['total']}] {event['product']}: {event['image']}")
+            elif event["event"] == "done":
+                print(f"🎉 Добавлено {len(event['created'])} товаров за {event['seconds']} с")
+                return True
+            else:
+                print(f"❌ {event['message']}")
+                for error in event.get("errors", []):
+                    print(f"   Строка {error['row']}: {error['error']}")
+        return False
+    finally:
+        photos.close()
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest", help="CSV или JSON с товарами")
+    parser.add_argument("photos", help="ZIP-архив или папка с фото")
+    parser.add_argument("--dry-run", action="store_true", help="только проверить манифест и наличие фото")
+    args = parser.parse_args()
+    try:
+        ok = asyncio.run(_cli(args.manifest, args.photos, args.dry_run))
+    except BulkImportError as e:
+        print(f"❌ {e}")
+        ok = False
+    sys.exit(0 if ok else 1)
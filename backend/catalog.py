@@ -0,0 +1,464 @@
+import json
+import time
+import threading
+from contextlib import nullcontext
+
+from http_cache import PrecompressedBody
+from catalog_index import CatalogIndex
+from search_index import SearchIndex
+from storage import StorageError
+from metrics import CATALOG_SECONDS
+from logger import get_logger
+
+log = get_logger("catalog")
+
+
+IMAGE_FIELDS = ("image", "image_large")
+IMAGE_LIST_FIELDS = ("images", "images_large")
+
+
+PLACEHOLDER_IMAGE = "/static/images/placeholder.webp"
+
+
+def new_product_record(product_id, name, price, color, available_sizes, composition, description, rendered):
+    """
+    Запись нового товара; rendered — результаты ImageProcessor.render_sizes по каждому фото.
+    Общая для создания из админки и массового импорта.
+    """
+    small = [img['small'] for img in rendered]
+    large = [img['large'] for img in rendered]
+    return {
+        "id": product_id,
+        "name": name,
+        "price": price,
+        "color": color,
+        "available_sizes": available_sizes,
+        "composition": composition,
+        "description": description,
+        "images": small,
+        "images_large": large,
+        "image": small[0] if small else PLACEHOLDER_IMAGE,
+        "image_large": large[0] if large else PLACEHOLDER_IMAGE,
+        # Лестница размеров каждого фото для srcset на фронтенде
+        "image_variants": [img.get('variants', []) for img in rendered],
+        # LQIP и доминирующий цвет каждого фото — сетка рисуется до загрузки картинок
+        "image_placeholders": [img.get('placeholder') for img in rendered],
+    }
+
+
+def _client_product(product, asset_url=None):
+    client = {**product, "sizes": list(product.get("available_sizes", {}).keys())}
+    if asset_url is None:
+        return client
+    # Фото отдаются по адресам с хэшем содержимого — их можно кэшировать навсегда
+    for field in IMAGE_FIELDS:
+        if field in client:
+            client[field] = asset_url(client[field])
+    for field in IMAGE_LIST_FIELDS:
+        if isinstance(client.get(field), list):
+            client[field] = [asset_url(url) for url in client[field]]
+    if isinstance(client.get("image_variants"), list):
+        client["image_variants"] = [
+            [{**v, "url": asset_url(v.get("url"))} for v in variants]
+            for variants in client["image_variants"]
+        ]
+    return client
+
+
+class StockStats:
+    """
+    Сводка остатков для админки: всего штук, штук по размерам и по товарам.
+    Считается один раз на снимок; при изменении остатков пересчитываются только
+    затронутые товары (см. CatalogSnapshot.with_stock).
+    """
+
+    __slots__ = ("total_items", "size_breakdown", "products_stats")
+
+    def __init__(self, total_items, size_breakdown, products_stats):
+        self.total_items = total_items
+        self.size_breakdown = size_breakdown
+        self.products_stats = products_stats
+
+    @staticmethod
+    def _entry(product):
+        sizes = product.get("available_sizes", {})
+        return {"id": product["id"], "name": product["name"], "total": sum(sizes.values()), "sizes": sizes}
+
+    @classmethod
+    def build(cls, products):
+        stats = cls(0, {}, [])
+        for product in products:
+            stats._add(product.get("available_sizes", {}))
+            stats.products_stats.append(cls._entry(product))
+        return stats
+
+    def _add(self, sizes, sign=1):
+        for size, qty in sizes.items():
+            self.total_items += sign * qty
+            self.size_breakdown[size] = self.size_breakdown.get(size, 0) + sign * qty
+
+    def with_changes(self, changes):
+        """
+        Новая сводка; changes — [(позиция, старый товар или None, новый или None)]:
+        None вместо старого — товар добавлен в конец, вместо нового — удалён.
+        """
+        stats = StockStats(self.total_items, dict(self.size_breakdown), list(self.products_stats))
+        dropped = []
+        for i, old, new in changes:
+            if old is not None:
+                stats._add(old.get("available_sizes", {}), -1)
+            if new is None:
+                dropped.append(i)
+                continue
+            stats._add(new.get("available_sizes", {}))
+            if old is None:
+                stats.products_stats.append(self._entry(new))
+            else:
+                stats.products_stats[i] = self._entry(new)
+        for i in sorted(dropped, reverse=True):
+            del stats.products_stats[i]
+        return stats
+
+    def as_dict(self):
+        return {
+            "total_products": len(self.products_stats),
+            "total_items": self.total_items,
+            "size_breakdown": self.size_breakdown,
+            "products_stats": self.products_stats,
+        }
+
+
+class CatalogSnapshot:
+    """
+    Неизменяемый снимок каталога.
+    Словари внутри снимка никто не модифицирует: любая запись строит новый снимок.
+    """
+
+    __slots__ = ("version", "digest", "products", "client_products", "by_id", "_positions",
+                 "_encoded", "_index", "_stats", "_lazy_lock", "_asset_url", "_fast_encode")
+
+    def __init__(self, products, digest, version, client_products=None, asset_url=None, stats=None,
+                 index=None, fast_encode=False):
+        self.version = version
+        self.digest = digest
+        self.products = tuple(products)
+        self._asset_url = asset_url
+        # Для клиента заранее добавляем список размеров, чтобы не копировать товары на каждый запрос
+        if client_products is None:
+            client_products = (_client_product(p, asset_url) for p in self.products)
+        self.client_products = tuple(client_products)
+        self.by_id = {p["id"]: p for p in self.client_products}
+        self._positions = {p["id"]: i for i, p in enumerate(self.products)}
+        self._encoded = None
+        self._index = index
+        self._stats = stats
+        self._lazy_lock = threading.Lock()
+        # Снимки после точечных правок живут недолго — тело сжимаем быстро (см. encoded)
+        self._fast_encode = fast_encode
+
+    def with_stock(self, stock, digest, version):
+        """Новый снимок с изменёнными остатками нескольких товаров (см. with_products)."""
+        changed = [{**self.products[self._positions[product_id]], "available_sizes": sizes}
+                   for product_id, sizes in stock.items() if product_id in self._positions]
+        return self.with_products(changed, digest=digest, version=version)
+
+    def with_products(self, changed=(), removed=(), digest=None, version=0):
+        """
+        Новый снимок, где товары changed заменены (новые id — добавлены в конец),
+        а товары с id из removed удалены. Неизменённые товары, индекс фильтров и
+        сводка остатков переносятся из этого снимка с правкой только затронутых
+        товаров — без перечитывания хранилища и пересборки индекса.
+        """
+        products = list(self.products)
+        client_products = list(self.client_products)
+        changes = []            # (позиция, старый товар или None, новый или None) — для сводки
+        client_changes = []     # (старый клиентский товар или None, новый или None) — для индекса
+        for product in changed:
+            client = _client_product(product, self._asset_url)
+            i = self._positions.get(product["id"])
+            if i is None:
+                changes.append((len(products), None, product))
+                client_changes.append((None, client))
+                products.append(product)
+                client_products.append(client)
+            else:
+                changes.append((i, products[i], product))
+                client_changes.append((client_products[i], client))
+                products[i] = product
+                client_products[i] = client
+        dropped = sorted((self._positions[pid] for pid in set(removed) if pid in self._positions), reverse=True)
+        for i in dropped:
+            changes.append((i, products[i], None))
+            client_changes.append((client_products[i], None))
+        for i in dropped:
+            del products[i], client_products[i]
+
+        # Сводку и индекс не пересчитываем целиком — только изменённые товары
+        stats = self._stats.with_changes(changes) if self._stats is not None else None
+        index = self._index.with_changes(client_changes) if self._index is not None else None
+        return CatalogSnapshot(products, digest, version, client_products, self._asset_url, stats,
+                               index=index, fast_encode=True)
+
+    def stock(self, product_id, size) -> int:
+        i = self._positions.get(product_id)
+        if i is None:
+            return 0
+        return self.products[i].get("available_sizes", {}).get(size, 0)
+
+    def encoded(self) -> PrecompressedBody:
+        """
+        JSON для /api/products: сериализуется и сжимается один раз на версию каталога.
+        Версии после точечных правок (заказ, правка товара) сжимаются быстрым уровнем:
+        при распродаже они сменяются на каждый заказ.
+        """
+        if self._encoded is None:
+            with self._lazy_lock:
+                if self._encoded is None:
+                    with CATALOG_SECONDS.labels("serialize").time():
+                        body = json.dumps(self.client_products, ensure_ascii=False, separators=(",", ":"))
+                        self._encoded = PrecompressedBody(body.encode("utf-8"), fast=self._fast_encode)
+        return self._encoded
+
+    def index(self) -> CatalogIndex:
+        """Вторичные индексы для фильтров и пагинации, строятся один раз на версию каталога."""
+        if self._index is None:
+            with self._lazy_lock:
+                if self._index is None:
+                    with CATALOG_SECONDS.labels("index").time():
+                        self._index = CatalogIndex(self.client_products)
+        return self._index
+
+    def stats(self) -> StockStats:
+        """Сводка остатков; строится один раз, дальше переносится в новые снимки инкрементально."""
+        if self._stats is None:
+            with self._lazy_lock:
+                if self._stats is None:
+                    self._stats = StockStats.build(self.products)
+        return self._stats
+
+    def __len__(self):
+        return len(self.products)
+
+
+class ProductCatalog:
+    """
+    Каталог товаров в памяти поверх хранилища (см. storage.py).
+    Данные перечитываются только если изменилась сигнатура хранилища
+    (mtime/size файла или счётчик поколений базы) и дайджест содержимого,
+    либо сразу после записи через методы каталога.
+    Запись из другого процесса (воркера uvicorn, CLI) видна по счётчику
+    storage.generation() — он проверяется на каждом снимке; check_interval
+    остаётся запасным опросом для правок в обход хранилища и других хостов.
+    asset_url — необязательное отображение адресов фото (см. assets.AssetManifest.static_url).
+
+    Поисковый индекс (search_index.py) один на каталог и переживает снимки:
+    создание, изменение и удаление товара через методы каталога правят его
+    по одному товару, остальные изменения (другой воркер, полная замена)
+    переносятся сверкой со снимком при следующем поиске.
+    """
+
+    def __init__(self, storage, check_interval=0.5, asset_url=None):
+        self.storage = storage
+        self.asset_url = asset_url
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._signature = None      # сигнатура хранилища на момент последнего чтения
+        self._generation = None     # storage.generation() на момент последней проверки
+        self._last_check = 0.0
+        self._version = 0
+        self._snapshot = CatalogSnapshot([], None, 0)
+        self._search = None         # строится при первом поиске
+        self._search_version = 0    # версия снимка, с которой сверен индекс
+        self._search_lock = threading.Lock()
+        self.reload(force=True)
+
+    # ======== Чтение ========
+
+    def snapshot(self) -> CatalogSnapshot:
+        """Текущий снимок каталога; при необходимости подхватывает изменения хранилища."""
+        now = time.monotonic()
+        if self.storage.generation() != self._generation or now - self._last_check >= self.check_interval:
+            self._last_check = now
+            self.reload()
+        return self._snapshot
+
+    def reload(self, force=False):
+        """Перечитывает хранилище, если оно изменилось. Возвращает True, если снимок обновлён."""
+        signature = self.storage.signature()
+        if not force and signature == self._signature:
+            self._generation = signature[0]
+            return False
+
+        with self._lock:
+            signature = self.storage.signature()
+            # Даже если чтение не удастся, повтор будет по check_interval, а не на каждом запросе
+            self._generation = signature[0]
+            if not force and signature == self._signature:
+                return False
+
+            try:
+                with CATALOG_SECONDS.labels("load").time():
+                    products, digest = self.storage.read_products()
+            except StorageError as e:
+                # Оставляем предыдущий снимок, пока хранилище не станет читаемым
+                log.error("Catalog load failed", extra={"error": str(e)})
+                return False
+
+            self._signature = signature
+            if digest is not None and digest == self._snapshot.digest:
+                # Хранилище "тронули", но содержимое прежнее — новый снимок не нужен
+                return False
+
+            self._version += 1
+            with CATALOG_SECONDS.labels("build").time():
+                self._snapshot = CatalogSnapshot(products, digest, self._version, asset_url=self.asset_url)
+            log.info("Catalog loaded", extra={"count": len(products), "storage": self.storage.name,
+                                              "version": self._version})
+            return True
+
+    # ======== Запись ========
+
+    def allocate_id(self) -> int:
+        return self.storage.allocate_product_id()
+
+    def allocate_ids(self, count: int) -> list:
+        return self.storage.allocate_product_ids(count)
+
+    def add(self, product: dict):
+        with self.storage.lock():
+            stale, synced = self._write_started()
+            self.storage.insert_product(product)
+            self._publish(stale, changed=[product])
+            self._search_apply(synced, added=[product])
+
+    def add_many(self, products):
+        """Добавляет пачку товаров одной транзакцией хранилища и публикует один новый снимок."""
+        with self.storage.lock():
+            stale, synced = self._write_started()
+            self.storage.insert_products(products)
+            self._publish(stale, changed=products)
+            self._search_apply(synced, added=products)
+
+    def update(self, product: dict) -> bool:
+        with self.storage.lock():
+            stale, synced = self._write_started()
+            updated = self.storage.update_product(product)
+            self._publish(stale, changed=[product] if updated else [])
+            self._search_apply(synced, added=[product] if updated else [])
+        return updated
+
+    def delete(self, product_id: int) -> bool:
+        with self.storage.lock():
+            stale, synced = self._write_started()
+            deleted = self.storage.delete_product(product_id)
+            self._publish(stale, removed=[product_id] if deleted else [])
+            self._search_apply(synced, removed=[product_id])
+        return deleted
+
+    def adjust_stock(self, changes, publishing=None):
+        """
+        Атомарно списывает/возвращает остатки в хранилище и сразу публикует снимок
+        с новыми значениями (без полной перезагрузки каталога).
+        publishing — контекстный менеджер, под которым публикуется снимок
+        (InventoryEngine.commit снимает под ним удержание резерва).
+        """
+        with self.storage.lock():
+            stale, synced = self._write_started()
+            stock, digest = self.storage.adjust_stock(changes)
+            with publishing or nullcontext():
+                if stale:
+                    self.reload(force=True)
+                    return stock
+                with self._lock:
+                    self._advance()
+                    self._snapshot = self._snapshot.with_stock(stock, digest, self._version)
+            # Остатки в поиске не участвуют — индекс остаётся сверенным
+            self._search_apply(synced)
+        return stock
+
+    def save(self, products):
+        """Полная замена каталога и публикация нового снимка."""
+        # Под замком: списание остатков не вклинится между заменой и перечитыванием
+        with self.storage.lock():
+            self.storage.replace_products(products)
+            self.reload(force=True)
+        log.info("Catalog saved", extra={"count": len(products), "storage": self.storage.name})
+
+    def _write_started(self):
+        """
+        Перед собственной записью (под storage.lock()): (снимок отстал от хранилища,
+        версия для правки поискового индекса — см. _search_synced).
+        Если хранилище успели изменить в обход каталога — после записи перечитываем целиком.
+        """
+        return self.storage.signature() != self._signature, self._search_synced()
+
+    def _advance(self):
+        """
+        Новая версия снимка после собственной записи (под self._lock и storage.lock():
+        между записью и чтением новой сигнатуры никто другой не запишет).
+        """
+        self._signature = self.storage.signature()
+        self._generation = self._signature[0]
+        self._version += 1
+
+    def _publish(self, stale, changed=(), removed=()):
+        """
+        Публикует собственную запись каталога правкой текущего снимка — цена
+        пропорциональна изменённым товарам, а не размеру каталога.
+        """
+        if stale:
+            self.reload(force=True)
+            return
+        with self._lock:
+            self._advance()
+            # Дайджест содержимого после точечной записи неизвестен: при следующей
+            # перезагрузке снимок просто соберётся заново
+            self._snapshot = self._snapshot.with_products(changed, removed, None, self._version)
+
+    # ======== Поиск ========
+
+    def search(self, query, limit=20, prefix=True):
+        """
+        Полнотекстовый поиск: (товары для клиента по убыванию релевантности,
+        сколько всего найдено, подсказки для последнего слова).
+        """
+        snapshot = self.snapshot()
+        with self._search_lock:
+            if self._search is None or self._search_version < snapshot.version:
+                with CATALOG_SECONDS.labels("search_sync").time():
+                    if self._search is None:
+                        self._search = SearchIndex()
+                    self._search.sync(snapshot.products)
+                self._search_version = snapshot.version
+            ids, total = self._search.query(query, limit, prefix)
+            suggestions = self._search.suggest(query) if prefix else []
+        # Индекс может быть чуть новее снимка этого запроса — таких товаров в ответе нет
+        items = [snapshot.by_id[pid] for pid in ids if pid in snapshot.by_id]
+        return items, total, suggestions
+
+    def _search_synced(self):
+        """
+        Версия снимка, если индекс сверен с ним и хранилище с тех пор не менялось
+        (вызывать под storage.lock()); иначе None — тогда правка по одному товару
+        невозможна и индекс сверится целиком при следующем поиске.
+        """
+        version = self._snapshot.version
+        if self._search is None or self._search_version != version:
+            return None
+        if self.storage.signature() != self._signature:
+            return None
+        return version
+
+    def _search_apply(self, synced, added=(), removed=()):
+        """Переносит в индекс собственную запись каталога, сделанную после _search_synced()."""
+        if synced is None:
+            return
+        with self._search_lock:
+            if self._search_version != synced:
+                # Поиск уже успел сверить индекс с новым снимком
+                return
+            for product_id in removed:
+                self._search.remove(product_id)
+            for product in added:
+                self._search.add(product)
+            self._search_version = self._snapshot.version
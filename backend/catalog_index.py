@@ -0,0 +1,226 @@
+import json
+import base64
+from bisect import bisect_left, bisect_right
+
+# Поддерживаемые сортировки: имя -> функция ключа (ключ всегда заканчивается id, чтобы быть уникальным)
+SORT_KEYS = {
+    "id": lambda p: (p["id"],),
+    "price": lambda p: (p.get("price", 0), p["id"]),
+}
+# Типы элементов ключа для каждой сортировки — по ним проверяется курсор от клиента
+SORT_KEY_TYPES = {
+    "id": ((int,),),
+    "price": ((int, float), (int,)),
+}
+
+
+def normalize_value(value):
+    """Цвет/размер сравниваем без учёта регистра и лишних пробелов."""
+    return str(value).strip().lower()
+
+
+def in_stock_sizes(product):
+    return {normalize_value(size) for size, qty in product.get("available_sizes", {}).items() if qty > 0}
+
+
+def encode_cursor(sort, descending, key):
+    raw = json.dumps([sort, descending, list(key)], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, sort, descending):
+    """Разбирает курсор; курсор от другой сортировки считается некорректным."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        c_sort, c_desc, key = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError("Некорректный курсор")
+    if c_sort != sort or c_desc != descending or not isinstance(key, list):
+        raise ValueError("Курсор не соответствует параметрам сортировки")
+    types = SORT_KEY_TYPES[sort]
+    # bool — подкласс int, но в ключах его не бывает
+    if len(key) != len(types) or any(isinstance(value, bool) or not isinstance(value, allowed)
+                                     for value, allowed in zip(key, types)):
+        raise ValueError("Некорректный курсор")
+    return tuple(key)
+
+
+class _Bucket:
+    """Отсортированный по ключу список товаров одной группы индекса."""
+
+    __slots__ = ("keys", "items")
+
+    def __init__(self, products, key_func):
+        pairs = sorted(((key_func(p), p) for p in products), key=lambda kp: kp[0])
+        self.keys = [k for k, _ in pairs]
+        self.items = [p for _, p in pairs]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def copy(self):
+        bucket = _Bucket.__new__(_Bucket)
+        bucket.keys = list(self.keys)
+        bucket.items = list(self.items)
+        return bucket
+
+    def remove(self, key):
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i], self.items[i]
+
+    def insert(self, key, product):
+        i = bisect_left(self.keys, key)
+        self.keys.insert(i, key)
+        self.items.insert(i, product)
+
+
+def _bucket_names(product):
+    """Группы индекса, в которые попадает товар."""
+    names = [None, ("color", normalize_value(product.get("color", "")))]
+    names.extend(("size", size) for size in in_stock_sizes(product))
+    return names
+
+
+class CatalogIndex:
+    """
+    Вторичные индексы снимка каталога: по цвету, по размерам в наличии и по цене.
+    Каждая группа хранится уже отсортированной для каждой поддерживаемой сортировки,
+    поэтому страница выдаётся бинарным поиском по курсору без прохода по всему каталогу.
+    """
+
+    def __init__(self, products):
+        by_color = {}
+        by_size = {}
+        for p in products:
+            by_color.setdefault(normalize_value(p.get("color", "")), []).append(p)
+            for size in in_stock_sizes(p):
+                by_size.setdefault(size, []).append(p)
+
+        self._buckets = {}
+        for sort, key_func in SORT_KEYS.items():
+            buckets = {None: _Bucket(products, key_func)}
+            for color, items in by_color.items():
+                buckets[("color", color)] = _Bucket(items, key_func)
+            for size, items in by_size.items():
+                buckets[("size", size)] = _Bucket(items, key_func)
+            self._buckets[sort] = buckets
+
+        self.colors = sorted(c for c in by_color if c)
+        self.sizes = sorted(by_size)
+
+    def with_changes(self, changes):
+        """
+        Новый индекс после замены товаров: changes — [(старый товар или None, новый или None)].
+        Копируются только затронутые группы, остальные общие со старым индексом.
+        """
+        index = CatalogIndex.__new__(CatalogIndex)
+        index._buckets = {sort: dict(buckets) for sort, buckets in self._buckets.items()}
+        copied = set()
+
+        def own(sort, name):
+            buckets = index._buckets[sort]
+            if (sort, name) not in copied:
+                copied.add((sort, name))
+                bucket = buckets.get(name)
+                buckets[name] = bucket.copy() if bucket is not None else _Bucket([], SORT_KEYS[sort])
+            return buckets[name]
+
+        for old, new in changes:
+            for sort, key_func in SORT_KEYS.items():
+                if old is not None:
+                    for name in _bucket_names(old):
+                        own(sort, name).remove(key_func(old))
+                if new is not None:
+                    for name in _bucket_names(new):
+                        own(sort, name).insert(key_func(new), new)
+
+        # Опустевшие группы убираем — как если бы индекс строился заново
+        for sort, name in copied:
+            if name is not None and not index._buckets[sort][name]:
+                del index._buckets[sort][name]
+        names = index._buckets["id"]
+        index.colors = sorted(name[1] for name in names if name and name[0] == "color" and name[1])
+        index.sizes = sorted(name[1] for name in names if name and name[0] == "size")
+        return index
+
+    def _price_range(self, bucket, min_price, max_price):
+        """Границы диапазона цен внутри группы, отсортированной по цене."""
+        lo = 0 if min_price is None else bisect_left(bucket.keys, (min_price,))
+        hi = len(bucket) if max_price is None else bisect_right(bucket.keys, (max_price, float("inf")))
+        return lo, max(lo, hi)
+
+    def query(self, color=None, size=None, min_price=None, max_price=None,
+              sort="id", descending=False, cursor=None, limit=20):
+        """
+        Возвращает (товары страницы, курсор следующей страницы или None).
+        Источником кандидатов берётся самая маленькая подходящая группа индекса,
+        остальные фильтры проверяются по товару за O(1).
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Неизвестная сортировка: {sort}")
+        key_func = SORT_KEYS[sort]
+        after = decode_cursor(cursor, sort, descending) if cursor else None
+
+        color = normalize_value(color) if color else None
+        size = normalize_value(size) if size else None
+        buckets = self._buckets[sort]
+
+        candidates = [buckets.get(None)]
+        if color is not None:
+            candidates.append(buckets.get(("color", color)))
+        if size is not None:
+            candidates.append(buckets.get(("size", size)))
+        if any(b is None for b in candidates):
+            return [], None
+        source = min(candidates, key=len)
+        lo, hi = 0, len(source)
+
+        if sort == "price":
+            lo, hi = self._price_range(source, min_price, max_price)
+        elif min_price is not None or max_price is not None:
+            # Сортировка по id, но узкий диапазон цен может оказаться самым селективным
+            by_price = self._buckets["price"][None]
+            p_lo, p_hi = self._price_range(by_price, min_price, max_price)
+            if p_hi - p_lo < len(source):
+                source = _Bucket(by_price.items[p_lo:p_hi], key_func)
+                lo, hi = 0, len(source)
+
+        if after is not None:
+            if descending:
+                hi = min(hi, bisect_left(source.keys, after, lo, hi))
+            else:
+                lo = max(lo, bisect_right(source.keys, after, lo, hi))
+
+        def matches(p):
+            if color is not None and normalize_value(p.get("color", "")) != color:
+                return False
+            if size is not None and p.get("available_sizes", {}).get(_original_size(p, size), 0) <= 0:
+                return False
+            price = p.get("price", 0)
+            if min_price is not None and price < min_price:
+                return False
+            if max_price is not None and price > max_price:
+                return False
+            return True
+
+        positions = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+        page = []
+        last_key = None
+        for i in positions:
+            p = source.items[i]
+            if not matches(p):
+                continue
+            if len(page) == limit:
+                return page, encode_cursor(sort, descending, last_key)
+            page.append(p)
+            last_key = source.keys[i]
+        return page, None
+
+
+def _original_size(product, normalized):
+    """Находит ключ размера в available_sizes по нормализованному имени."""
+    for size in product.get("available_sizes", {}):
+        if normalize_value(size) == normalized:
+            return size
+    return None
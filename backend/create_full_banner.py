@@ -1,6 +1,7 @@
 from PIL import Image
 import os
 import glob
+from image_variants import extra_formats_from_env, save_siblings
 
 def create_full_banner():
     """Создает баннер для полной ширины"""
@@ -67,10 +68,14 @@ def create_full_banner():
             os.makedirs("../frontend/images", exist_ok=True)
             output_path = "../frontend/images/banner.webp"
             banner.save(output_path, "WEBP", quality=85, optimize=True)
+            # Копии для клиентов: AVIF (легче WebP) и JPEG (если WebP не поддерживается)
+            siblings = save_siblings(banner, output_path, extra_formats_from_env())
             
             file_size = os.path.getsize(output_path) / 1024
             print(f"✅ Баннер создан: {output_path}")
             print(f"📊 Размер: {banner.width}x{banner.height} px, Вес: {file_size:.1f} KB")
+            for fmt, path in siblings.items():
+                print(f"   + {fmt.upper()}: {os.path.getsize(path) / 1024:.1f} KB")
             
     except Exception as e:
         print(f"❌ Ошибка: {e}")
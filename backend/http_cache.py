@@ -0,0 +1,121 @@
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:  # brotli опционален: без него отдаём gzip
+    brotli = None
+
+# Уровни сжатия: максимальные — для редко меняющихся тел, быстрые — для версий,
+# которые сменяются на каждый заказ (остатки во время распродажи)
+BROTLI_QUALITY, GZIP_LEVEL = 11, 9
+FAST_BROTLI_QUALITY, FAST_GZIP_LEVEL = 4, 5
+
+
+def _parse_qvalues(header):
+    """Разбирает заголовок вида 'gzip;q=0.8, br' в словарь {значение: q}."""
+    result = {}
+    for part in (header or "").split(","):
+        item, _, params = part.strip().partition(";")
+        item = item.strip().lower()
+        if not item:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        result[item] = q
+    return result
+
+
+def choose_encoding(accept_encoding, available):
+    """Выбирает лучшее сжатие из доступных с учётом Accept-Encoding клиента."""
+    accepted = _parse_qvalues(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    for encoding in available:
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+# Форматы, которые понимает любой клиент: отдаются и по маске 'image/*', '*/*', и без Accept
+UNIVERSAL_IMAGE_FORMATS = ("jpeg", "png")
+
+
+def choose_image_format(accept, candidates):
+    """
+    Самый лёгкий формат изображения, который допускает Accept клиента.
+    candidates — {формат: вес} (размер файла в байтах или относительная оценка),
+    первым идёт формат по умолчанию. AVIF и WebP отдаются только тем, кто назвал
+    их явно; если не подходит ничего, возвращается формат по умолчанию.
+    """
+    accepted = _parse_qvalues(accept)
+    if accept:
+        wildcard = max(accepted.get("image/*", 0.0), accepted.get("*/*", 0.0))
+    else:
+        wildcard = 1.0
+    allowed = []
+    for fmt, weight in candidates.items():
+        q = accepted.get(f"image/{fmt}")
+        if q is None:
+            q = wildcard if fmt in UNIVERSAL_IMAGE_FORMATS else 0.0
+        if q > 0:
+            allowed.append((weight, fmt))
+    if not allowed:
+        return next(iter(candidates))
+    return min(allowed)[1]
+
+
+def matched_etag(if_none_match, etags):
+    """Первый из etags, совпавший с If-None-Match ('*' совпадает с первым), или None."""
+    if not if_none_match or not etags:
+        return None
+    candidates = {tag.strip() for tag in if_none_match.split(",")}
+    if "*" in candidates:
+        return etags[0]
+    # Слабое сравнение допустимо для If-None-Match
+    candidates |= {tag[2:] for tag in candidates if tag.startswith("W/")}
+    return next((tag for tag in etags if tag in candidates), None)
+
+
+def etag_matches(if_none_match, etags):
+    """Проверяет If-None-Match против набора ETag (включая '*')."""
+    return matched_etag(if_none_match, list(etags)) is not None
+
+
+class PrecompressedBody:
+    """
+    Тело ответа, сериализованное один раз, с готовыми gzip/brotli вариантами
+    и сильными ETag для каждого представления.
+    """
+
+    __slots__ = ("body", "etag", "variants")
+
+    def __init__(self, body: bytes, min_size=512, fast=False):
+        self.body = body
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        quality, level = (FAST_BROTLI_QUALITY, FAST_GZIP_LEVEL) if fast else (BROTLI_QUALITY, GZIP_LEVEL)
+        # Другой уровень — другие байты сжатого тела, значит и другой сильный ETag
+        suffix = "-fast" if fast else ""
+        # encoding -> (сжатое тело, etag)
+        self.variants = {}
+        if len(body) >= min_size:
+            if brotli is not None:
+                self.variants["br"] = (brotli.compress(body, quality=quality), f'"{digest}-br{suffix}"')
+            self.variants["gzip"] = (gzip.compress(body, compresslevel=level, mtime=0), f'"{digest}-gz{suffix}"')
+
+    def all_etags(self):
+        return [self.etag] + [etag for _, etag in self.variants.values()]
+
+    def select(self, accept_encoding):
+        """Возвращает (тело, etag, content-encoding или None) под клиента."""
+        encoding = choose_encoding(accept_encoding, self.variants)
+        if encoding is None:
+            return self.body, self.etag, None
+        body, etag = self.variants[encoding]
+        return body, etag, encoding
@@ -0,0 +1,78 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class ImagePoolBusy(Exception):
+    """Пул обработки изображений перегружен — запрос стоит повторить позже."""
+
+
+class ImagePool:
+    """
+    Ограниченный пул процессов для тяжёлой обработки изображений (resize + WebP).
+    Работа уходит из цикла событий в отдельные процессы, поэтому витрина продолжает
+    отвечать, пока админка загружает фото.
+
+    Backpressure: одновременно в пуле не больше max_inflight задач, остальные ждут;
+    если ожидающих больше max_waiting, новая задача сразу получает ImagePoolBusy.
+    """
+
+    def __init__(self, max_workers=None, max_inflight=None, max_waiting=64):
+        self.max_workers = max_workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.max_inflight = max_inflight or self.max_workers * 2
+        self.max_waiting = max_waiting
+        self._executor = None
+        self._slots = None
+        self._loop = None
+        self._waiting = 0
+        self._inflight = 0
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            # spawn: безопасно для многопоточного процесса uvicorn
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        if self._slots is None or self._loop is not loop:
+            self._slots = asyncio.Semaphore(self.max_inflight)
+            self._loop = loop
+
+    async def submit(self, fn, *args):
+        """Выполняет fn(*args) в пуле процессов и возвращает результат."""
+        self._ensure_started()
+        if self._slots.locked() and self._waiting >= self.max_waiting:
+            raise ImagePoolBusy(f"Очередь обработки изображений переполнена ({self._waiting} задач)")
+
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._inflight += 1
+        try:
+            return await self._loop.run_in_executor(self._executor, fn, *args)
+        except BrokenProcessPool:
+            # Упавший воркер ломает весь пул — следующая задача создаст новый
+            self.shutdown()
+            raise
+        finally:
+            self._inflight -= 1
+            self._slots.release()
+
+    def stats(self):
+        return {"workers": self.max_workers, "inflight": self._inflight, "waiting": self._waiting}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Глобальный экземпляр
+image_pool = ImagePool(
+    max_workers=int(os.getenv("IMAGE_WORKERS", "0")) or None,
+)
@@ -1,19 +1,68 @@
 import os
 import re
+import json
+import math
+import time
+import hashlib
+import base64
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
 from PIL import Image
 import glob
+from assets import file_hash
+from metrics import observe_image_timings
+from image_pool import ImagePoolBusy
+from image_variants import extra_formats_from_env, save_siblings, SIBLING_EXTENSIONS
+from logger import get_logger
+
+log = get_logger("image_processor")
+
+# Меняется вместе с алгоритмом render_sizes — тогда auto_process_folder переделает всё
+PIPELINE_VERSION = 1
+MANIFEST_NAME = ".process-manifest.json"
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+# Настройки, от которых зависят выходные файлы (см. settings_fingerprint)
+SETTINGS_FIELDS = ('sizes', 'ladder', 'default_encode', 'encode', 'fast_encode_width', 'reducing_gap',
+                   'draft_oversample', 'extra_formats', 'placeholder_size', 'placeholder_quality')
 
 class ImageProcessor:
-    def __init__(self, source_folder="original_images", output_folder="../frontend/images/products"):
+    def __init__(self, source_folder="original_images", output_folder="../frontend/images/products",
+                 originals_folder="product_originals"):
         self.source_folder = os.path.abspath(source_folder)
         self.output_folder = os.path.abspath(output_folder)
+        # Исходники загруженных фото — из них строятся варианты по запросу (см. image_variants.py).
+        # Папка вне frontend/, чтобы оригиналы не раздавались как статика
+        self.originals_folder = os.path.abspath(originals_folder)
+        # Готовый файл → исходник в source_folder по манифесту (см. original_for)
+        self._sources_by_output = None
+        self._sources_mtime = None
         self.sizes = {
             'small': (300, 300),   # для карточек товаров
             'large': (600, 600)    # для детальной страницы
         }
+        # Лестница ширин для srcset (квадратные кадры). Ширины small/large переиспользуют их файлы,
+        # крупнее исходника не увеличиваем
+        self.ladder = [150, 300, 450, 600, 900, 1200]
+        # Усилие кодировщика по размерам: превью маленькие, method=6 для них почти не уменьшает вес
+        self.default_encode = {'quality': 85, 'method': 6}
+        self.encode = {
+            'small': {'method': 4},
+        }
+        self.fast_encode_width = 480  # ступени лестницы не шире этого кодируем с method=4
+        # Копии каждого размера рядом с .webp (включаются IMAGE_EXTRA_FORMATS=avif,jpeg): AVIF, если
+        # Pillow умеет, и JPEG для клиентов без WebP. Сервер выбирает копию по заголовку Accept (см. image_variants.negotiate_image)
+        self.extra_formats = extra_formats_from_env()
+        # Заглушка для сетки: крошечная копия в data URI (~150 байт) и доминирующий цвет
+        self.placeholder_size = 16
+        self.placeholder_quality = 40
+        self.reducing_gap = 3.0       # см. Image.resize(reducing_gap=...)
+        self.draft_oversample = 2.0   # JPEG декодируем минимум в 2 раза крупнее нужного — запас для LANCZOS
 
         os.makedirs(self.source_folder, exist_ok=True)
         os.makedirs(self.output_folder, exist_ok=True)
+        os.makedirs(self.originals_folder, exist_ok=True)
 
     def resize_and_crop(self, image: Image.Image, target_size):
         """Обрезает и изменяет размер изображения с сохранением пропорций (cover)."""
@@ -22,10 +71,12 @@ class ImageProcessor:
             target_width, target_height = target_size
 
             ratio = max(target_width / original_width, target_height / original_height)
-            new_width = int(original_width * ratio)
-            new_height = int(original_height * ratio)
+            new_width = max(target_width, round(original_width * ratio))
+            new_height = max(target_height, round(original_height * ratio))
 
-            resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            # reducing_gap: сначала быстрое целочисленное уменьшение (reduce), затем LANCZOS
+            resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS,
+                                         reducing_gap=self.reducing_gap)
 
             left = int((new_width - target_width) / 2)
             top = int((new_height - target_height) / 2)
@@ -36,9 +87,170 @@ class ImageProcessor:
             return cropped_image
 
         except Exception as e:
-            print(f"[ImageProcessor] Ошибка при изменении размера: {e}")
+            log.error("Resize failed", extra={"error": str(e)})
             return image.resize(target_size, Image.Resampling.LANCZOS)
 
+    def targets(self, source_size):
+        """
+        Все размеры, которые нужно сделать из исходника: именованные (small/large)
+        и ступени лестницы ширин ('w150', 'w900', ...), не крупнее самого исходника.
+        """
+        width, height = source_size
+        targets = dict(self.sizes)
+        named_widths = {w for w, h in self.sizes.values() if w == h}
+        for w in self.ladder:
+            if w in named_widths or w > min(width, height):
+                continue
+            targets[f"w{w}"] = (w, w)
+        return targets
+
+    def open_for_sizes(self, source):
+        """
+        Открывает исходник один раз и декодирует его в минимально нужном разрешении:
+        для JPEG draft() уменьшает картинку прямо при декодировании (1/2, 1/4, 1/8),
+        но не меньше, чем нужно для самого большого размера.
+        Возвращает (RGB-изображение, размеры для генерации).
+        """
+        img = Image.open(source)
+        targets = self.targets(img.size)
+        if img.format == 'JPEG':
+            width, height = img.size
+            need = [max(tw / width, th / height) for tw, th in targets.values()]
+            scale = max(need) * self.draft_oversample
+            if scale < 1:
+                img.draft('RGB', (math.ceil(width * scale), math.ceil(height * scale)))
+        converted = self._ensure_rgb(img)
+        if converted is not img:
+            img.close()
+        return converted, targets
+
+    def render_sizes(self, source, base_name):
+        """
+        Делает все размеры одного изображения за одно декодирование.
+        Размеры идут от большего к меньшему; меньший строится из уже готового большего,
+        если тот его полностью покрывает (тот же формат кадра), а не из полного оригинала.
+        Возвращает пути именованных размеров, 'variants' — лестницу для srcset
+        (url, width, height, bytes по возрастанию ширины) и 'placeholder' (см. placeholder).
+        """
+        result_paths = {}
+        variants = []
+        # Время этапов по размерам — для метрик (render_sizes обычно идёт в воркере пула)
+        started = time.perf_counter()
+        img, targets = self.open_for_sizes(source)
+        timings = {"source": {"decode": time.perf_counter() - started}}
+        with img:
+            ordered = sorted(targets.items(), key=lambda item: item[1][0] * item[1][1], reverse=True)
+            previous = None
+            for size_name, dimensions in ordered:
+                base = img
+                if previous is not None:
+                    pw, ph = previous.size
+                    tw, th = dimensions
+                    if pw >= tw and ph >= th and pw * th == ph * tw:
+                        base = previous
+                started = time.perf_counter()
+                processed_img = self.resize_and_crop(base, dimensions)
+                resized = time.perf_counter()
+
+                output_filename = f"{base_name}-{size_name}.webp"
+                output_path = os.path.join(self.output_folder, output_filename)
+                processed_img.save(output_path, format='WEBP', **self.encode_options(size_name, dimensions[0]))
+                encoded = time.perf_counter()
+                save_siblings(processed_img, output_path, self.extra_formats)
+                timings[size_name] = {
+                    "resize": resized - started,
+                    "encode": encoded - resized,
+                    "siblings": time.perf_counter() - encoded,
+                }
+                url = f"/static/images/products/{output_filename}"
+                result_paths[size_name] = url
+                variants.append({
+                    "url": url,
+                    "width": dimensions[0],
+                    "height": dimensions[1],
+                    "bytes": os.path.getsize(output_path),
+                })
+                previous = processed_img
+
+                log.debug("Image size rendered", extra={"file": output_filename})
+
+            # Заглушку строим из самого маленького размера — без лишнего декодирования
+            placeholder = self.placeholder(previous)
+
+        # Порядок ключей как в self.sizes
+        result = {size_name: result_paths[size_name] for size_name in self.sizes}
+        result['variants'] = sorted(variants, key=lambda v: v["width"])
+        result['placeholder'] = placeholder
+        result['timings'] = timings
+        return result
+
+    def placeholder(self, img: Image.Image):
+        """
+        LQIP для мгновенной отрисовки сетки: {'lqip': data URI крошечной WebP-копии,
+        'color': доминирующий цвет '#rrggbb'}. Встраивается прямо в карточку товара.
+        """
+        img = self._ensure_rgb(img)
+        thumb = img.copy()
+        thumb.thumbnail((self.placeholder_size, self.placeholder_size), Image.Resampling.BOX)
+        buffer = BytesIO()
+        thumb.save(buffer, format='WEBP', quality=self.placeholder_quality, method=6)
+        lqip = "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+        # Доминирующий цвет — самый частый цвет палитры из 5 оттенков
+        sample = img.resize((64, 64), Image.Resampling.BOX).quantize(colors=5, method=Image.Quantize.MEDIANCUT)
+        _, index = max(sample.getcolors())
+        r, g, b = sample.getpalette()[index * 3:index * 3 + 3]
+        return {"lqip": lqip, "color": f"#{r:02x}{g:02x}{b:02x}"}
+
+    def encode_options(self, size_name, width=None):
+        """Параметры WebP для размера: method 0..6 — баланс скорости кодирования и веса файла."""
+        if size_name in self.encode:
+            return {**self.default_encode, **self.encode[size_name]}
+        if width is not None and width <= self.fast_encode_width:
+            return {**self.default_encode, 'method': 4}
+        return dict(self.default_encode)
+
+    def save_original(self, data: bytes, base_name):
+        """Сохраняет исходник загруженного фото (атомарно)."""
+        path = os.path.join(self.originals_folder, f"{base_name}.original")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def original_for(self, image_path):
+        """
+        Исходник для готового размера ('product-7-1-large.webp' → сохранённый оригинал
+        или файл из source_folder, записанный в манифест). None, если исходника нет.
+        """
+        filename = os.path.basename(image_path)
+        candidates = []
+        match = re.match(r"^(.+)-(small|large|w\d+)\.webp$", filename)
+        if match:
+            candidates.append(os.path.join(self.originals_folder, f"{match.group(1)}.original"))
+        # Имена выходных файлов очищены clean_filename — исходник берём из манифеста, а не из имени
+        source_name = self._manifest_sources().get(filename)
+        if source_name:
+            candidates.append(os.path.join(self.source_folder, source_name))
+        for path in candidates:
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _manifest_sources(self):
+        """Выходной файл → имя исходника; перечитывается, только если манифест изменился."""
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        if self._sources_mtime != mtime:
+            entries = self.load_manifest().get("files", {})
+            self._sources_by_output = {output: name for name, entry in entries.items()
+                                       for output in entry.get("outputs", {})}
+            self._sources_mtime = mtime
+        return self._sources_by_output
+
     def clean_filename(self, filename: str):
         """Очищает имя файла от недопустимых символов и пробелов."""
         cleaned = re.sub(r'[^\w\s-]', '', filename)
@@ -68,87 +280,303 @@ class ImageProcessor:
                 # Перемещаем указатель в начало
                 uploaded_file.file.seek(0)
 
-                with Image.open(uploaded_file.file) as img:
-                    img = self._ensure_rgb(img)
-                    
-                    result_paths = {}
-                    base_name = f"product-{product_id}-{i+1}"
+                base_name = f"product-{product_id}-{i+1}"
+                self.save_original(uploaded_file.file.read(), base_name)
+                uploaded_file.file.seek(0)
+                result_paths = self.render_sizes(uploaded_file.file, base_name)
+                observe_image_timings(result_paths)
 
-                    for size_name, dimensions in self.sizes.items():
-                        processed_img = self.resize_and_crop(img, dimensions)
-                        output_filename = f"{base_name}-{size_name}.webp"
-                        output_path = os.path.join(self.output_folder, output_filename)
+                # Добавляем пути этого изображения в общий список
+                image_paths.append(result_paths)
 
-                        processed_img.save(output_path, format='WEBP', quality=85, method=6)
-                        relative_path = f"/static/images/products/{output_filename}"
-                        result_paths[size_name] = relative_path
+            return image_paths
 
-                        print(f"✅ Обработано изображение {i+1}: {output_filename}")
+        except Exception as e:
+            log.error("Multiple images processing failed", exc_info=True)
+            return None
 
-                    # Добавляем пути этого изображения в общий список
-                    image_paths.append(result_paths)
+    async def process_multiple_images_async(self, uploaded_files, product_name, product_id, pool):
+        """
+        То же, что process_multiple_images, но без блокировки цикла событий:
+        каждое изображение обрабатывается отдельной задачей в пуле процессов
+        (все его размеры — за одно декодирование, см. render_sizes).
+        ImagePoolBusy пробрасывается наружу, остальные ошибки дают None.
+        """
+        try:
+            sources = []
+            for uploaded_file in uploaded_files:
+                await uploaded_file.seek(0)
+                sources.append(await uploaded_file.read())
 
-            return image_paths
+            tasks = [
+                self.render_bytes_async(data, f"product-{product_id}-{i+1}", pool)
+                for i, data in enumerate(sources)
+            ]
+            return list(await asyncio.gather(*tasks))
 
+        except ImagePoolBusy:
+            raise
         except Exception as e:
-            print(f"❌ Ошибка обработки нескольких изображений: {e}")
+            log.error("Multiple images processing failed", exc_info=True)
             return None
 
+    async def render_bytes_async(self, data: bytes, base_name, pool):
+        """Сохраняет исходник и делает все размеры одного фото в пуле процессов (см. render_sizes)."""
+        folders = (self.source_folder, self.output_folder, self.originals_folder)
+        result = await pool.submit(_render_sizes, folders, self.processing_settings(), data, base_name)
+        observe_image_timings(result)
+        return result
+
+    def remove_outputs(self, base_name):
+        """Удаляет все файлы одного фото (размеры, копии форматов, исходник) — откат неудачного импорта."""
+        paths = glob.glob(os.path.join(self.output_folder, glob.escape(base_name) + "-*"))
+        paths.append(os.path.join(self.originals_folder, f"{base_name}.original"))
+        for path in paths:
+            if os.path.isfile(path):
+                os.remove(path)
+
     def process_single_image(self, image_path, product_name, product_id=None):
         """Обрабатывает одно изображение с диска"""
         try:
-            with Image.open(image_path) as img:
-                img = self._ensure_rgb(img)
-                result_paths = {}
+            base_name = f"product-{product_id}" if product_id else self.clean_filename(product_name)
+            return self.render_sizes(image_path, base_name)
 
-                base_name = f"product-{product_id}" if product_id else self.clean_filename(product_name)
+        except Exception as e:
+            log.error("Image processing failed", extra={"path": image_path, "error": str(e)})
+            return None
 
-                for size_name, dimensions in self.sizes.items():
-                    processed_img = self.resize_and_crop(img, dimensions)
-                    output_filename = f"{base_name}-{size_name}.webp"
-                    output_path = os.path.join(self.output_folder, output_filename)
+    # ======== Пакетная обработка папки ========
 
-                    processed_img.save(output_path, format='WEBP', quality=85, method=6)
-                    relative_path = f"/static/images/products/{output_filename}"
-                    result_paths[size_name] = relative_path
+    def processing_settings(self):
+        """Настройки конвейера, от которых зависит результат (для манифеста и воркеров)."""
+        return json.loads(json.dumps({name: getattr(self, name) for name in SETTINGS_FIELDS}))
 
-                    print(f"✅ Создано: {output_filename}")
+    def apply_settings(self, settings):
+        for name, value in settings.items():
+            if name == 'sizes':
+                value = {size_name: tuple(dimensions) for size_name, dimensions in value.items()}
+            setattr(self, name, value)
 
-                return result_paths
+    def settings_fingerprint(self):
+        raw = json.dumps([PIPELINE_VERSION, self.processing_settings()], sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
 
-        except Exception as e:
-            print(f"❌ Ошибка обработки {image_path}: {e}")
-            return None
+    @property
+    def manifest_path(self):
+        return os.path.join(self.source_folder, MANIFEST_NAME)
 
-    def auto_process_folder(self):
-        """Автоматически обрабатывает все изображения в source_folder"""
-        extensions = ['*.jpg', '*.jpeg', '*.png', '*.webp', '*.JPG', '*.JPEG', '*.PNG']
-        all_images = []
-        for ext in extensions:
-            all_images.extend(glob.glob(os.path.join(self.source_folder, ext)))
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"files": {}}
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Манифест обработки повреждён, обработаю всё заново: {e}")
+            return {"files": {}}
 
-        if not all_images:
+    def save_manifest(self, manifest):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _source_images(self):
+        return sorted(
+            (entry.name, entry.path) for entry in os.scandir(self.source_folder)
+            if entry.is_file() and entry.name.lower().endswith(SOURCE_EXTENSIONS)
+        )
+
+    def _outputs_of(self, result):
+        """Имена и размеры всех файлов одного исходника: .webp каждого размера и их копии в других форматах."""
+        outputs = {}
+        for variant in result['variants']:
+            filename = os.path.basename(variant['url'])
+            outputs[filename] = variant['bytes']
+            stem = os.path.splitext(filename)[0]
+            for fmt in self.extra_formats:
+                sibling = stem + SIBLING_EXTENSIONS[fmt]
+                path = os.path.join(self.output_folder, sibling)
+                if os.path.exists(path):
+                    outputs[sibling] = os.path.getsize(path)
+        return outputs
+
+    def auto_process_folder(self, workers=None, verify=False, prune=False):
+        """
+        Обрабатывает изображения из source_folder инкрементально.
+        Манифест (original_images/.process-manifest.json) хранит хэш содержимого каждого
+        исходника и отпечаток настроек: заново обрабатываются только новые и изменённые
+        файлы (или все, если поменялись размеры/качество/форматы). Работа идёт в пуле процессов.
+        verify=True дополнительно проверяет, что выходные файлы на месте.
+        Устаревшие выходные файлы (исходник удалён или больше не даёт этот размер)
+        выводятся в отчёт, а с prune=True удаляются.
+        """
+        sources = self._source_images()
+        if not sources:
             print("📁 Не найдены изображения в папке 'original_images'")
-            return
+            return None
+
+        manifest = self.load_manifest()
+        entries = manifest.setdefault("files", {})
+        fingerprint = self.settings_fingerprint()
+        stale = []
+
+        # Исходник удалён — все его файлы устарели
+        present = {name for name, _ in sources}
+        for name in [name for name in entries if name not in present]:
+            stale.extend(entries.pop(name).get("outputs", {}))
 
-        print(f"🔄 Найдено {len(all_images)} изображений для обработки...")
+        todo, skipped = [], 0
+        for name, path in sources:
+            st = os.stat(path)
+            entry = entries.get(name)
+            fresh = entry is not None and entry.get("settings") == fingerprint and (
+                not verify or all(os.path.exists(os.path.join(self.output_folder, f)) for f in entry["outputs"]))
+            if fresh and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+                skipped += 1
+                continue
+            digest = file_hash(path)
+            if fresh and entry["hash"] == digest:
+                # Файл «тронули», но содержимое прежнее
+                entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+                skipped += 1
+                continue
+            todo.append((name, path, digest, st))
+
+        print(f"🔄 Изображений: {len(sources)}, без изменений: {skipped}, к обработке: {len(todo)}")
         success_count = 0
-        for image_path in all_images:
-            filename = os.path.basename(image_path)
-            product_name = os.path.splitext(filename)[0]
-            if self.process_single_image(image_path, product_name):
-                success_count += 1
-
-        print(f"\n🎉 Обработка завершена! Успешно: {success_count}/{len(all_images)}")
-        self.show_created_files()
-
-    def show_created_files(self):
-        webp_files = glob.glob(os.path.join(self.output_folder, "*.webp"))
-        if webp_files:
-            print("\n📁 Созданные файлы:")
-            for file in webp_files:
-                file_size = os.path.getsize(file) / 1024
-                print(f"   📄 {os.path.basename(file)} ({file_size:.1f} KB)")
-
-# Глобальный экземпляр
-image_processor = ImageProcessor()
\ No newline at end of file
+        if todo:
+            workers = max(1, min(workers or os.cpu_count() or 1, len(todo)))
+            folders = (self.source_folder, self.output_folder, self.originals_folder)
+            settings = self.processing_settings()
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            try:
+                futures = {
+                    executor.submit(_render_file, folders, settings, path,
+                                    self.clean_filename(os.path.splitext(name)[0])): (name, digest, st)
+                    for name, path, digest, st in todo
+                }
+                for done, future in enumerate(as_completed(futures), start=1):
+                    name, digest, st = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"❌ Ошибка обработки {name}: {e}")
+                        continue
+                    outputs = self._outputs_of(result)
+                    previous = entries.get(name, {}).get("outputs", {})
+                    stale.extend(f for f in previous if f not in outputs)
+                    entries[name] = {"hash": digest, "settings": fingerprint, "size": st.st_size,
+                                     "mtime_ns": st.st_mtime_ns, "outputs": outputs}
+                    success_count += 1
+                    print(f"✅ [{done}/{len(todo)}] {name}: {len(outputs)} файлов")
+                    if done % 20 == 0:
+                        self.save_manifest(manifest)
+            finally:
+                executor.shutdown(cancel_futures=True)
+                self.save_manifest(manifest)
+        else:
+            self.save_manifest(manifest)
+
+        if stale:
+            action = "Удалено" if prune else "Устаревшие файлы (удалить: prune=True)"
+            print(f"\n🧹 {action}: {len(stale)}")
+            for filename in sorted(stale):
+                print(f"   🗑 {filename}")
+                path = os.path.join(self.output_folder, filename)
+                if prune and os.path.isfile(path):
+                    os.remove(path)
+
+        print(f"\n🎉 Обработка завершена! Обработано: {success_count}/{len(todo)}, без изменений: {skipped}")
+        self.show_created_files(manifest)
+        return {"processed": success_count, "failed": len(todo) - success_count, "skipped": skipped,
+                "stale": sorted(stale)}
+
+    def show_created_files(self, manifest=None):
+        """Сводка по выходным файлам из манифеста — без обхода папки и stat каждого файла."""
+        manifest = manifest or self.load_manifest()
+        outputs = [item for entry in manifest.get("files", {}).values() for item in entry["outputs"].items()]
+        if outputs:
+            total = sum(size for _, size in outputs) / 1024
+            print(f"\n📁 Файлов: {len(outputs)}, всего {total:.1f} KB")
+            for filename, size in sorted(outputs):
+                print(f"   📄 {filename} ({size / 1024:.1f} KB)")
+
+# Экземпляры в процессах пула: по одному на набор папок
+_worker_processors = {}
+
+def _worker_processor(folders, settings):
+    """Процессор воркера с папками и настройками родителя (качество, лестница, форматы)."""
+    processor = _worker_processors.get(folders)
+    if processor is None:
+        source_folder, output_folder, originals_folder = folders
+        processor = ImageProcessor(source_folder, output_folder, originals_folder)
+        _worker_processors[folders] = processor
+    processor.apply_settings(settings)
+    return processor
+
+def _render_sizes(folders, settings, data, base_name):
+    """Загруженное фото в воркере: исходник на диск и все размеры (с настройками родителя)."""
+    processor = _worker_processor(folders, settings)
+    processor.save_original(data, base_name)
+    return processor.render_sizes(BytesIO(data), base_name)
+
+def _render_file(folders, settings, path, base_name):
+    """Обработка одного исходника с диска в воркере auto_process_folder (с настройками родителя)."""
+    return _worker_processor(folders, settings).render_sizes(path, base_name)
+
+def backfill_placeholders(storage, frontend_dir, processor):
+    """Досчитывает image_placeholders для товаров, загруженных до появления заглушек."""
+    products, _ = storage.read_products()
+    updated = 0
+    for product in products:
+        if product.get("image_placeholders"):
+            continue
+        placeholders = []
+        for url in product.get("images") or [product.get("image")]:
+            path = os.path.join(frontend_dir, url[len("/static/"):]) if str(url).startswith("/static/") else None
+            if path is None or not os.path.isfile(path):
+                placeholders.append(None)
+                continue
+            with Image.open(path) as img:
+                placeholders.append(processor.placeholder(img))
+        if any(placeholders):
+            storage.update_product({**product, "image_placeholders": placeholders})
+            updated += 1
+    return updated
+
+# Глобальный экземпляр создаётся при первом обращении (from image_processor import image_processor):
+# сам импорт модуля не создаёт папок относительно текущей директории
+_image_processor = None
+
+
+def __getattr__(name):
+    global _image_processor
+    if name == "image_processor":
+        if _image_processor is None:
+            _image_processor = ImageProcessor()
+        return _image_processor
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if __name__ == "__main__":
+    image_processor = ImageProcessor()
+
+    # python image_processor.py [process [--prune] [--verify] | placeholders]
+    import argparse
+    parser = argparse.ArgumentParser(description="Обработка фото товаров")
+    parser.add_argument("command", nargs="?", default="process", choices=["process", "placeholders"],
+                        help="process — инкрементальная обработка original_images, "
+                             "placeholders — LQIP для уже загруженных товаров")
+    parser.add_argument("--workers", type=int, help="число процессов (по умолчанию — все ядра)")
+    parser.add_argument("--verify", action="store_true", help="проверить, что выходные файлы на месте")
+    parser.add_argument("--prune", action="store_true", help="удалить устаревшие выходные файлы")
+    args = parser.parse_args()
+
+    if args.command == "placeholders":
+        from storage import create_storage
+        frontend_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "frontend")
+        storage = create_storage("products.json", os.path.join(os.path.dirname(os.path.abspath(__file__)), "promos.json"))
+        print(f"✅ Заглушки добавлены в {backfill_placeholders(storage, frontend_dir, image_processor)} товаров")
+    else:
+        image_processor.auto_process_folder(workers=args.workers, verify=args.verify, prune=args.prune)
@@ -0,0 +1,383 @@
+import os
+import math
+import bisect
+import time
+import asyncio
+import hashlib
+import threading
+import functools
+from collections import OrderedDict
+
+from http_cache import choose_image_format
+from logger import get_logger
+
+log = get_logger("image_variants")
+
+FITS = ("cover", "contain")
+# format -> (формат Pillow, Content-Type, параметры кодирования)
+FORMATS = {
+    "avif": ("AVIF", "image/avif", {"quality": 60, "speed": 8}),
+    "webp": ("WEBP", "image/webp", {"quality": 82, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True}),
+    "png": ("PNG", "image/png", {"optimize": True}),
+}
+FORMAT_ALIASES = {"jpg": "jpeg"}
+# Копии рядом с основным .webp, которые пишет конвейер (см. ImageProcessor.extra_formats)
+SIBLING_EXTENSIONS = {"avif": ".avif", "jpeg": ".jpg"}
+# Относительный вес форматов при одинаковом качестве — для вариантов, которых ещё нет на диске
+FORMAT_WEIGHTS = {"avif": 0.7, "webp": 1.0, "jpeg": 1.6, "png": 3.0}
+MAX_SIDE = 2400
+# Допустимые стороны вариантов: лестница ImageProcessor.ladder и несколько крупных.
+# Запрошенный размер округляется вверх до ступени, чтобы произвольные размеры
+# не запускали новое декодирование и не плодили файлы в кэше
+VARIANT_SIDES = (100, 150, 200, 300, 450, 600, 900, 1200, 1600, MAX_SIDE)
+# Недописанные .tmp старше этого считаются брошенными (см. ImageVariantCache._scan)
+STALE_TMP_SECONDS = 600
+
+
+@functools.lru_cache(maxsize=None)
+def avif_supported() -> bool:
+    """Умеет ли установленный Pillow кодировать AVIF (встроен начиная с Pillow 11.3)."""
+    try:
+        from PIL import features
+        return bool(features.check("avif"))
+    except Exception:
+        return False
+
+
+def extra_formats_from_env():
+    """
+    Дополнительные форматы конвейера из IMAGE_EXTRA_FORMATS, например 'avif,jpeg'.
+    По умолчанию пусто: каждая копия умножает время обработки и место на диске.
+    """
+    formats = []
+    for fmt in os.getenv("IMAGE_EXTRA_FORMATS", "").split(","):
+        fmt = fmt.strip().lower()
+        fmt = FORMAT_ALIASES.get(fmt, fmt)
+        if fmt not in SIBLING_EXTENSIONS:
+            continue
+        if fmt == "avif" and not avif_supported():
+            log.warning("Pillow built without AVIF, .avif copies are disabled")
+            continue
+        formats.append(fmt)
+    return formats
+
+
+def save_siblings(img, webp_path, formats):
+    """
+    Пишет копии изображения в дополнительных форматах рядом с webp_path (атомарно).
+    Копии в отключённых форматах удаляются, чтобы не отдавать устаревшую картинку.
+    """
+    base = os.path.splitext(webp_path)[0]
+    written = {}
+    for fmt, ext in SIBLING_EXTENSIONS.items():
+        path = base + ext
+        if fmt not in formats:
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+        pil_format, _, options = FORMATS[fmt]
+        image = img.convert("RGB") if fmt == "jpeg" and img.mode != "RGB" else img
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            image.save(tmp_path, format=pil_format, **options)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        written[fmt] = path
+    return written
+
+
+def negotiate_image(file_path, accept):
+    """
+    Выбирает копию изображения для клиента по заголовку Accept: рядом с .webp могут
+    лежать .avif и .jpg — отдаём самую лёгкую из допустимых. Возвращает (путь, формат).
+    """
+    base, ext = os.path.splitext(file_path)
+    fmt = format_for_path(file_path)
+    if ext.lower() != ".webp":
+        return file_path, fmt
+    paths = {"webp": file_path}
+    sizes = {"webp": os.path.getsize(file_path)}
+    for sibling_fmt, sibling_ext in SIBLING_EXTENSIONS.items():
+        path = base + sibling_ext
+        try:
+            sizes[sibling_fmt] = os.path.getsize(path)
+        except OSError:
+            continue
+        paths[sibling_fmt] = path
+    if len(paths) == 1:
+        return file_path, fmt
+    chosen = choose_image_format(accept, sizes)
+    return paths[chosen], chosen
+
+
+def negotiate_variant_format(accept, default_format):
+    """Формат варианта, если клиент не указал его явно: лучший из тех, что он принимает."""
+    candidates = {default_format: FORMAT_WEIGHTS.get(default_format, 1.0)}
+    for fmt in ("avif", "webp", "jpeg"):
+        if fmt == "avif" and not avif_supported():
+            continue
+        candidates.setdefault(fmt, FORMAT_WEIGHTS[fmt])
+    return choose_image_format(accept, candidates)
+
+
+def snap_side(value):
+    """Ближайшая ступень VARIANT_SIDES не меньше value."""
+    return VARIANT_SIDES[bisect.bisect_left(VARIANT_SIDES, value)]
+
+
+def variant_params(width=None, height=None, fit="cover", fmt=None, default_format="webp"):
+    """
+    Проверяет параметры варианта и возвращает кортеж (width, height, fit, format);
+    ширина и высота округляются вверх до ступеней VARIANT_SIDES.
+    """
+    for name, value in (("width", width), ("height", height)):
+        if value is not None and not 1 <= value <= MAX_SIDE:
+            raise ValueError(f"{name} должен быть от 1 до {MAX_SIDE}")
+    width = snap_side(width) if width is not None else None
+    height = snap_side(height) if height is not None else None
+    fit = (fit or "cover").lower()
+    if fit not in FITS:
+        raise ValueError(f"fit должен быть одним из: {', '.join(FITS)}")
+    fmt = (fmt or default_format).lower()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    if fmt not in FORMATS or (fmt == "avif" and not avif_supported()):
+        supported = [f for f in FORMATS if f != "avif" or avif_supported()]
+        raise ValueError(f"format должен быть одним из: {', '.join(supported)}")
+    return width, height, fit, fmt
+
+
+def format_for_path(path):
+    """Формат по расширению файла (для ответа без параметра format)."""
+    ext = os.path.splitext(path)[1].lstrip(".").lower()
+    ext = FORMAT_ALIASES.get(ext, ext)
+    return ext if ext in FORMATS else "webp"
+
+
+def media_type(fmt):
+    return FORMATS[fmt][1]
+
+
+def _fit_box(source_size, width, height, fit):
+    """
+    Итоговый размер и область исходника, из которой он строится.
+    Картинку не увеличиваем: запрошенный размер пропорционально ужимается до исходника.
+    """
+    sw, sh = source_size
+    if width is None and height is None:
+        return (sw, sh), None
+    if width is None:
+        width = round(sw * height / sh)
+    elif height is None:
+        height = round(sh * width / sw)
+
+    if fit == "contain":
+        scale = min(width / sw, height / sh, 1.0)
+        return (max(1, round(sw * scale)), max(1, round(sh * scale))), None
+
+    # cover: центрированная область исходника с пропорциями результата
+    scale = min(sw / width, sh / height, 1.0)
+    width, height = max(1, round(width * scale)), max(1, round(height * scale))
+    if sw * height > sh * width:
+        crop_w = sh * width / height
+        left = (sw - crop_w) / 2
+        box = (left, 0, left + crop_w, sh)
+    else:
+        crop_h = sw * height / width
+        top = (sh - crop_h) / 2
+        box = (0, top, sw, top + crop_h)
+    return (width, height), box
+
+
+def render_variant(source_path, output_path, width, height, fit, fmt):
+    """
+    Строит вариант изображения и атомарно пишет его в output_path.
+    Выполняется в пуле процессов (см. image_pool.py). Возвращает размер файла в байтах.
+    """
+    from PIL import Image
+
+    pil_format, _, options = FORMATS[fmt]
+    with Image.open(source_path) as img:
+        source_size = img.size
+        (tw, th), box = _fit_box(source_size, width, height, fit)
+        if img.format == "JPEG" and (tw, th) != source_size:
+            # Декодируем сразу в уменьшенном виде (1/2..1/8), с двукратным запасом для LANCZOS
+            bw, bh = (box[2] - box[0], box[3] - box[1]) if box else source_size
+            img.draft("RGB", (math.ceil(source_size[0] * 2 * tw / bw), math.ceil(source_size[1] * 2 * th / bh)))
+            if box is not None and img.size != source_size:
+                kx, ky = img.size[0] / source_size[0], img.size[1] / source_size[1]
+                box = (box[0] * kx, box[1] * ky, box[2] * kx, box[3] * ky)
+        img.load()
+
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        if fmt == "jpeg" or not has_alpha:
+            if has_alpha:
+                rgba = img.convert("RGBA")
+                flat = Image.new("RGB", rgba.size, (255, 255, 255))
+                flat.paste(rgba, mask=rgba.split()[3])
+                img = flat
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+        elif img.mode != "RGBA":
+            img = img.convert("RGBA")
+
+        if (tw, th) != img.size or box is not None:
+            img = img.resize((tw, th), Image.Resampling.LANCZOS, box=box, reducing_gap=3.0)
+
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        try:
+            img.save(tmp_path, format=pil_format, **options)
+            os.replace(tmp_path, output_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return os.path.getsize(output_path)
+
+
+def _consume_exception(task):
+    """Ошибку сборки забирают ожидающие; если все отключились — не шумим в лог."""
+    if not task.cancelled():
+        task.exception()
+
+
+class ImageVariantCache:
+    """
+    Дисковый кэш вариантов изображений с ограничением по размеру и вытеснением LRU.
+    Ключ — исходный файл (путь, mtime, size) и параметры варианта, поэтому новый
+    исходник автоматически даёт новые варианты. Порядок LRU переживает перезапуск:
+    при попадании обновляем mtime файла, а при старте сортируем по нему.
+    Одновременные запросы одного варианта ждут одну и ту же сборку.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # имя файла -> размер, от давно использованных к свежим
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight = {}             # имя файла -> asyncio.Future текущей сборки
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file():
+                continue
+            st = entry.stat()
+            if entry.name.endswith(".tmp"):
+                # Недописанный файл от упавшего процесса; свежие может прямо сейчас писать другой воркер
+                if time.time() - st.st_mtime > STALE_TMP_SECONDS:
+                    os.remove(entry.path)
+                continue
+            files.append((st.st_mtime_ns, entry.name, st.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._bytes += size
+        self._evict()
+
+    def key(self, source_path, params) -> str:
+        st = os.stat(source_path)
+        raw = f"{os.path.abspath(source_path)}|{st.st_mtime_ns}|{st.st_size}|{params}"
+        return f"{hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]}.{params[3]}"
+
+    async def get(self, source_path, params, pool):
+        """Путь к готовому варианту; при промахе строит его в пуле процессов."""
+        name = self.key(source_path, params)
+        path = os.path.join(self.cache_dir, name)
+
+        with self._lock:
+            cached = name in self._entries
+            if cached:
+                self._entries.move_to_end(name)
+        if cached:
+            try:
+                os.utime(path)
+                self.hits += 1
+                return path
+            except FileNotFoundError:
+                # Файл удалили в обход кэша — собираем заново
+                self._forget(name)
+        else:
+            try:
+                # Вариант мог собрать другой воркер с той же папкой кэша
+                size = os.stat(path).st_size
+            except FileNotFoundError:
+                pass
+            else:
+                with self._lock:
+                    if name not in self._entries:
+                        self._entries[name] = size
+                        self._bytes += size
+                        self._evict()
+                self.hits += 1
+                return path
+
+        pending = self._inflight.get(name)
+        if pending is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            # Сборка — отдельная задача: отключение первого клиента не отменяет её для остальных
+            pending = asyncio.ensure_future(self._build(name, path, source_path, params, pool))
+            pending.add_done_callback(_consume_exception)
+            self._inflight[name] = pending
+        return await asyncio.shield(pending)
+
+    async def _build(self, name, path, source_path, params, pool):
+        try:
+            size = await pool.submit(render_variant, source_path, path, *params)
+        finally:
+            self._inflight.pop(name, None)
+        with self._lock:
+            self._entries[name] = size
+            self._bytes += size
+            self._evict()
+        return path
+
+    def _forget(self, name):
+        with self._lock:
+            size = self._entries.pop(name, None)
+            if size is not None:
+                self._bytes -= size
+
+    def _evict(self):
+        """Удаляет давно не использованные варианты, пока кэш не влезет в лимит (под self._lock)."""
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "files": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            "building": len(self._inflight),
+        }
+
+
+def variant_cache_from_env():
+    """Кэш вариантов с настройками из окружения (IMAGE_CACHE_DIR, IMAGE_CACHE_MB)."""
+    return ImageVariantCache(
+        os.getenv("IMAGE_CACHE_DIR", "image_cache"),
+        max_bytes=int(os.getenv("IMAGE_CACHE_MB", "256")) * 1024 * 1024,
+    )
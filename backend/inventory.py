@@ -0,0 +1,181 @@
+import time
+import uuid
+import heapq
+import threading
+from contextlib import contextmanager
+
+from storage import InsufficientStock
+from logger import get_logger
+
+log = get_logger("inventory")
+
+
+class ReservationNotFound(KeyError):
+    """Резерв уже подтверждён, отменён или истёк."""
+
+
+class Reservation:
+    __slots__ = ("id", "items", "expires_at")
+
+    def __init__(self, items, expires_at):
+        self.id = uuid.uuid4().hex
+        self.items = items          # кортеж (product_id, size, qty)
+        self.expires_at = expires_at
+
+
+class InventoryEngine:
+    """
+    Резервирование остатков по размерам при оформлении заказа.
+
+    Доступно = остаток в снимке каталога − удержано активными резервами.
+    Счётчики одного SKU (товар + размер) сериализуются полосатыми замками:
+    конкурирующие покупки одного товара выстраиваются в очередь на своей полосе,
+    а заказы других товаров идут параллельно, без общего замка на весь каталог.
+    Подтверждение резерва списывает остаток в хранилище условной записью,
+    поэтому остаток не уходит в минус даже при нескольких процессах.
+    """
+
+    def __init__(self, catalog, ttl=900, stripes=256):
+        self.catalog = catalog
+        self.ttl = ttl
+        self._stripes = [threading.Lock() for _ in range(stripes)]
+        self._held = {}                 # (product_id, size) -> удержанное количество
+        self._reservations = {}         # id -> Reservation
+        self._expiry = []               # куча (expires_at, id)
+        self._meta_lock = threading.Lock()
+
+    # ======== Вспомогательные ========
+
+    @staticmethod
+    def _normalize(items):
+        """Сливает повторяющиеся позиции корзины и проверяет количества."""
+        merged = {}
+        for product_id, size, qty in items:
+            qty = int(qty)
+            if qty <= 0:
+                raise ValueError(f"Некорректное количество для товара {product_id}: {qty}")
+            sku = (int(product_id), str(size))
+            merged[sku] = merged.get(sku, 0) + qty
+        return tuple((pid, size, qty) for (pid, size), qty in merged.items())
+
+    @contextmanager
+    def _locked(self, skus):
+        """Берёт замки полос в фиксированном порядке, чтобы не было взаимоблокировок."""
+        indexes = sorted({hash(sku) % len(self._stripes) for sku in skus})
+        for i in indexes:
+            self._stripes[i].acquire()
+        try:
+            yield
+        finally:
+            for i in reversed(indexes):
+                self._stripes[i].release()
+
+    def _unhold(self, items):
+        for product_id, size, qty in items:
+            sku = (product_id, size)
+            left = self._held.get(sku, 0) - qty
+            if left > 0:
+                self._held[sku] = left
+            else:
+                self._held.pop(sku, None)
+
+    def _take(self, reservation_id):
+        with self._meta_lock:
+            reservation = self._reservations.pop(reservation_id, None)
+        if reservation is None:
+            raise ReservationNotFound(reservation_id)
+        return reservation
+
+    # ======== API ========
+
+    def available(self, product_id, size) -> int:
+        sku = (product_id, size)
+        with self._locked([sku]):
+            return self.catalog.snapshot().stock(product_id, size) - self._held.get(sku, 0)
+
+    def reserve(self, items, ttl=None) -> Reservation:
+        """
+        Атомарно удерживает все позиции корзины (product_id, size, qty).
+        Если хоть одной не хватает — ничего не удерживается и выбрасывается InsufficientStock.
+        """
+        self.expire()
+        items = self._normalize(items)
+        if not items:
+            raise ValueError("Пустой заказ")
+
+        with self._locked([(pid, size) for pid, size, _ in items]):
+            snapshot = self.catalog.snapshot()
+            for product_id, size, qty in items:
+                free = snapshot.stock(product_id, size) - self._held.get((product_id, size), 0)
+                if free < qty:
+                    raise InsufficientStock(product_id, size, qty, max(free, 0))
+            for product_id, size, qty in items:
+                sku = (product_id, size)
+                self._held[sku] = self._held.get(sku, 0) + qty
+            reservation = Reservation(items, time.monotonic() + (ttl or self.ttl))
+            with self._meta_lock:
+                self._reservations[reservation.id] = reservation
+                heapq.heappush(self._expiry, (reservation.expires_at, reservation.id))
+        return reservation
+
+    def commit(self, reservation_id):
+        """
+        Подтверждает резерв: списывает остатки в хранилище и снимает удержание.
+        Запись в хранилище идёт без замков полос; под ними только публикация
+        нового снимка вместе со снятием удержания, поэтому доступный остаток
+        никто не увидит ни завышенным, ни отрицательным.
+        """
+        reservation = self._take(reservation_id)
+        skus = [(pid, size) for pid, size, _ in reservation.items]
+        settled = False
+
+        @contextmanager
+        def publishing():
+            nonlocal settled
+            with self._locked(skus):
+                yield
+                self._unhold(reservation.items)
+                settled = True
+
+        try:
+            return self.catalog.adjust_stock(
+                [(pid, size, -qty) for pid, size, qty in reservation.items], publishing()
+            )
+        finally:
+            if not settled:
+                with self._locked(skus):
+                    self._unhold(reservation.items)
+
+    def release(self, reservation_id) -> bool:
+        """Отменяет резерв (например, если заказ не удалось отправить)."""
+        try:
+            reservation = self._take(reservation_id)
+        except ReservationNotFound:
+            return False
+        with self._locked([(pid, size) for pid, size, _ in reservation.items]):
+            self._unhold(reservation.items)
+        return True
+
+    def expire(self, now=None) -> int:
+        """Снимает просроченные резервы. Возвращает их количество."""
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self._meta_lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, reservation_id = heapq.heappop(self._expiry)
+                reservation = self._reservations.pop(reservation_id, None)
+                if reservation is not None:
+                    expired.append(reservation)
+        for reservation in expired:
+            with self._locked([(pid, size) for pid, size, _ in reservation.items]):
+                self._unhold(reservation.items)
+        if expired:
+            log.info("Expired reservations released", extra={"count": len(expired)})
+        return len(expired)
+
+    def stats(self):
+        with self._meta_lock:
+            return {
+                "active_reservations": len(self._reservations),
+                "held_units": sum(self._held.values()),
+            }
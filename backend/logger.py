@@ -0,0 +1,189 @@
+"""
+Структурированные логи: JSON-строка на запись, уровень из LOG_LEVEL, id запроса
+и запись в поток/файл в отдельном потоке через очередь.
+
+Запрос только кладёт запись в ограниченную очередь; форматирование и вывод делает
+фоновый QueueListener, поэтому медленный stdout или диск не влияют на задержку
+эндпоинтов. Если очередь переполнена, записи отбрасываются (см. dropped()).
+
+Переменные окружения:
+    LOG_LEVEL         DEBUG | INFO | WARNING | ERROR (по умолчанию INFO)
+    LOG_FORMAT        json | text (по умолчанию json)
+    LOG_DEBUG_SAMPLE  доля DEBUG-записей, которые попадут в лог, 0..1 (по умолчанию 1)
+    LOG_QUEUE_SIZE    размер очереди записей (по умолчанию 10000)
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+import contextvars
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+# Стандартные атрибуты LogRecord — всё остальное считаем полями из extra=
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+_listener = None
+_handler = None
+
+
+def get_logger(name):
+    return logging.getLogger(f"calistor.{name}")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name.removeprefix("calistor."),
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Для локальной разработки: [LEVEL] сообщение поля..."""
+
+    def format(self, record):
+        line = f"[{record.levelname}] {record.getMessage()}"
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            line += f" request_id={request_id}"
+        extras = {k: v for k, v in record.__dict__.items() if k not in _RECORD_FIELDS and not k.startswith("_")}
+        if extras:
+            line += " " + " ".join(f"{k}={v}" for k, v in extras.items())
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class DebugSampler(logging.Filter):
+    """Пропускает только долю DEBUG-записей — частые отладочные события не забивают лог."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который никогда не ждёт: в потоке запроса только подставляет
+    аргументы сообщения и id запроса, а форматирование JSON остаётся слушателю.
+    """
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.request_id = request_id_var.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Трейсбек нельзя передать в другой поток как объект — сохраняем текстом
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(stream=None):
+    """Настраивает корневой логгер приложения; повторный вызов ничего не делает."""
+    global _listener, _handler
+    if _listener is not None:
+        return
+
+    level = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+    sink = logging.StreamHandler(stream or sys.stdout)
+    sink.setFormatter(TextFormatter() if os.getenv("LOG_FORMAT", "json") == "text" else JsonFormatter())
+
+    _handler = NonBlockingQueueHandler(queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000"))))
+    _handler.addFilter(DebugSampler(float(os.getenv("LOG_DEBUG_SAMPLE", "1"))))
+    _listener = logging.handlers.QueueListener(_handler.queue, sink, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    root = logging.getLogger("calistor")
+    root.setLevel(level)
+    root.addHandler(_handler)
+    root.propagate = False
+
+
+def shutdown_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает фоновый поток."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped():
+    """Сколько записей отброшено из-за переполненной очереди."""
+    return _handler.dropped if _handler is not None else 0
+
+
+class RequestIdMiddleware:
+    """
+    ASGI-middleware: id запроса из X-Request-ID (или новый) попадает во все записи
+    лога, сделанные во время запроса, и возвращается клиенту в заголовке ответа.
+    На уровне DEBUG пишет строку на каждый запрос (частоту режет LOG_DEBUG_SAMPLE).
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.access_log = get_logger("access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if self.access_log.isEnabledFor(logging.DEBUG):
+                self.access_log.debug("Request handled", extra={
+                    "method": scope["method"], "path": scope["path"], "status": status,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                })
+            request_id_var.reset(token)
@@ -1,137 +1,251 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+"""
+Бэкенд Calistor. Приложение собирает create_app(); тяжёлая инициализация (каталог,
+статика, очереди, промокоды) выполняется в lifespan при старте сервера, а не при
+импорте модуля. PIL и httpx грузятся при первой обработке фото / вызове Telegram.
+
+Запуск: uvicorn main:app  (или uvicorn --factory main:create_app)
+"""
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from dotenv import load_dotenv
+from fastapi.responses import FileResponse, Response, StreamingResponse
 import os
 import json
-import requests
+import html
+import hashlib
 import datetime
+import threading
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+from pathlib import Path
+from catalog import ProductCatalog, new_product_record
+from storage import create_storage, InsufficientStock
+from inventory import InventoryEngine
+from telegram_client import TelegramClient
+from notify_queue import NotificationQueue, NotificationDispatcher
+from image_pool import image_pool, ImagePoolBusy
+from starlette.concurrency import run_in_threadpool
+from http_cache import etag_matches, matched_etag
+from assets import AssetManifest, IMMUTABLE_CACHE
+from image_variants import (variant_cache_from_env, variant_params, format_for_path, media_type,
+                            negotiate_image, negotiate_variant_format, save_siblings)
+from starlette.datastructures import Headers
+from bulk_import import BulkImporter, BulkImportError, PhotoSource, parse_manifest
+from order_analytics import OrderLog
+from promo_engine import PromoEngine, PromoRejected
+from pricing import cart_lines, price_cart, quote_cart
+from metrics import MetricsMiddleware, Gauge, registry
+from logger import get_logger, setup_logging, RequestIdMiddleware, dropped as log_records_dropped
 load_dotenv()
-
-# Пытаемся импортировать image_processor, но если его нет - создаем заглушку
-try:
-    from image_processor import image_processor
-except ImportError:
-    print("[WARN] image_processor not found, using stub")
-    class ImageProcessorStub:
-        def process_multiple_images(self, images, name, product_id):
-            # Заглушка для обработки изображений
-            return [{'small': '/static/images/placeholder.webp', 'large': '/static/images/placeholder.webp'}]
-    image_processor = ImageProcessorStub()
-
-load_dotenv()
-
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+log = get_logger("main")
+
+class ImageProcessorStub:
+    """Заглушка, если image_processor (PIL) недоступен"""
+    extra_formats = []
+    def process_multiple_images(self, images, name, product_id):
+        # Заглушка для обработки изображений
+        return [{'small': '/static/images/placeholder.webp', 'large': '/static/images/placeholder.webp'}]
+    async def process_multiple_images_async(self, images, name, product_id, pool):
+        return self.process_multiple_images(images, name, product_id)
+    def original_for(self, image_path):
+        return None
+
+_image_processor = None
+
+def get_image_processor():
+    """ImageProcessor создаётся при первой обработке фото — PIL не грузится при старте процесса"""
+    global _image_processor
+    if _image_processor is None:
+        try:
+            from image_processor import image_processor
+        except ImportError:
+            log.warning("image_processor not found, using stub")
+            image_processor = ImageProcessorStub()
+        _image_processor = image_processor
+    return _image_processor
+
+router = APIRouter()
+
+class NegotiatingStaticFiles(StaticFiles):
+    """/static, который вместо .webp отдаёт .avif/.jpg копию, если она легче и её принимает клиент."""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        chosen, fmt = negotiate_image(str(full_path), Headers(scope=scope).get("accept"))
+        if chosen != str(full_path):
+            stat_result = os.stat(chosen)
+        response = super().file_response(chosen, stat_result, scope, status_code)
+        if str(full_path).endswith(".webp"):
+            response.headers["Vary"] = "Accept"
+            if response.status_code != 304:
+                response.headers["Content-Type"] = media_type(fmt)
+        return response
 
 # ИСПРАВЛЕННЫЙ ПУТЬ К FRONTEND - поднимаемся на уровень выше
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(BASE_DIR)  # Поднимаемся на уровень выше backend
 FRONTEND_DIR = os.path.join(PROJECT_ROOT, "frontend")
 
-print(f"[INFO] Base directory: {BASE_DIR}")
-print(f"[INFO] Project root: {PROJECT_ROOT}")
-print(f"[INFO] Frontend directory: {FRONTEND_DIR}")
-print(f"[INFO] Frontend exists: {os.path.exists(FRONTEND_DIR)}")
-
-if os.path.exists(FRONTEND_DIR):
-    print(f"[INFO] Frontend contents: {os.listdir(FRONTEND_DIR)}")
-    # Монтируем статические файлы только если директория существует
-    app.mount("/static", StaticFiles(directory=FRONTEND_DIR), name="static")
-else:
-    print(f"[ERROR] Frontend directory not found at {FRONTEND_DIR}")
-    print(f"[INFO] Current working directory: {os.getcwd()}")
-    print(f"[INFO] Directory contents:")
-    for item in os.listdir(PROJECT_ROOT):
-        print(f"  - {item}")
-
 ADMIN_SECRET = os.getenv("ADMIN_SECRET", "calistorAdminToken")
 PRODUCTS_FILE = "products.json"
+PROMO_FILE = Path(os.getenv("PROMOS_FILE", Path(__file__).parent / "promos.json"))
+PRODUCTS_PAGE_SIZE = 20
+PRODUCTS_PAGE_MAX = 100
+SEARCH_QUERY_MAX = 200
+
+DEFAULT_PRODUCTS = [
+    {
+        "id": 1,
+        "name": "Футболка box-fit",
+        "price": 4000,
+        "color": "белый",
+        "available_sizes": {"one size": 10},
+        "composition": "95% хлопок, 5% лайкра",
+        "description": "Премиальная футболка идеального кроя. Удобная и стильная для повседневной носки.",
+        "image": "/static/images/placeholder.webp",
+        "image_large": "/static/images/placeholder.webp",
+        "images": ["/static/images/placeholder.webp"],
+        "images_large": ["/static/images/placeholder.webp"]
+    },
+    {
+        "id": 2,
+        "name": "Толстовка",
+        "price": 6000,
+        "color": "черный",
+        "available_sizes": {"S": 5, "M": 8, "L": 3},
+        "composition": "94% хлопок, 6% спандекс",
+        "description": "Теплая и уютная толстовка для прохладных дней.",
+        "image": "/static/images/placeholder.webp",
+        "image_large": "/static/images/placeholder.webp",
+        "images": ["/static/images/placeholder.webp"],
+        "images_large": ["/static/images/placeholder.webp"]
+    }
+]
+
+# ======== Компоненты приложения ========
+# Создаются в init_services() при старте (lifespan), маршруты обращаются к ним как к глобальным.
+# Хранилище выбирается через STORAGE_BACKEND (json | sqlite),
+# каталог живёт в памяти и перечитывает хранилище только при его изменении
+# Статика отдаётся по адресам с хэшем содержимого (см. assets.py)
+assets = None
+storage = None
+catalog = None
+inventory = None
+variant_cache = None
+notification_queue = None
+notifier = None
+order_log = None
+promo_engine = None
+
+def init_services():
+    """Открывает хранилища и очереди, загружает каталог и манифест статики."""
+    global assets, storage, catalog, inventory, variant_cache, notification_queue, notifier, order_log, promo_engine
+    assets = AssetManifest(FRONTEND_DIR)
+    storage = create_storage(PRODUCTS_FILE, PROMO_FILE)
+    catalog = ProductCatalog(storage, asset_url=assets.static_url)
+    inventory = InventoryEngine(catalog, ttl=int(os.getenv("RESERVATION_TTL", "900")))
+    variant_cache = variant_cache_from_env()
+
+    # Первый снимок каталога строится при старте, а не на первом запросе
+    if not load_products():
+        save_products(DEFAULT_PRODUCTS)
+
+    # ======== Очередь уведомлений ========
+    # Повторы делает очередь, поэтому у клиента воркеров собственных повторов нет
+    notification_queue = NotificationQueue(os.getenv("NOTIFY_QUEUE_PATH", "notifications.db"))
+    notifier = NotificationDispatcher(
+        notification_queue,
+        TelegramClient(max_retries=0),
+        workers=int(os.getenv("NOTIFY_WORKERS", "4")),
+    )
+
+    # ======== Журнал заказов и аналитика ========
+    order_log = OrderLog(os.getenv("ORDERS_DB_PATH", "orders.db"))
+
+    # ======== Промокоды ========
+    # Кэш в памяти; счётчики использований сбрасываются в хранилище пачками
+    # Несколько воркеров (WEB_CONCURRENCY > 1): погашения кодов с лимитом сразу пишутся в хранилище
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    promo_engine = PromoEngine(
+        storage,
+        flush_interval=float(os.getenv("PROMO_FLUSH_SECONDS", "5")),
+        write_through=os.getenv("PROMO_WRITE_THROUGH", "1" if workers > 1 else "0") == "1",
+    )
 
-# ======== Функции загрузки и сохранения ========
 def load_products():
-    try:
-        if os.path.exists(PRODUCTS_FILE):
-            with open(PRODUCTS_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                print(f"[INFO] Loaded {len(data)} products from {PRODUCTS_FILE}")
-                return data
-        print(f"[INFO] Products file not found, using default")
-        return []
-    except Exception as e:
-        print(f"[ERROR] load_products error: {e}")
-        return []
+    """Товары из текущего снимка каталога (словари только для чтения)"""
+    return list(catalog.snapshot().products)
 
 def save_products(products):
     try:
-        with open(PRODUCTS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(products, f, ensure_ascii=False, indent=2)
-        print(f"[INFO] Saved {len(products)} products to {PRODUCTS_FILE}")
+        catalog.save(products)
     except Exception as e:
-        print(f"[ERROR] save_products error: {e}")
-
-# Загружаем продукты
-products = load_products()
-
-if not products:
-    products = [
-        {
-            "id": 1,
-            "name": "Футболка box-fit",
-            "price": 4000,
-            "color": "белый",
-            "available_sizes": {"one size": 10},
-            "composition": "95% хлопок, 5% лайкра",
-            "description": "Премиальная футболка идеального кроя. Удобная и стильная для повседневной носки.",
-            "image": "/static/images/placeholder.webp",
-            "image_large": "/static/images/placeholder.webp",
-            "images": ["/static/images/placeholder.webp"],
-            "images_large": ["/static/images/placeholder.webp"]
-        },
-        {
-            "id": 2,
-            "name": "Толстовка",
-            "price": 6000,
-            "color": "черный",
-            "available_sizes": {"S": 5, "M": 8, "L": 3},
-            "composition": "94% хлопок, 6% спандекс",
-            "description": "Теплая и уютная толстовка для прохладных дней.",
-            "image": "/static/images/placeholder.webp",
-            "image_large": "/static/images/placeholder.webp",
-            "images": ["/static/images/placeholder.webp"],
-            "images_large": ["/static/images/placeholder.webp"]
-        }
-    ]
-    save_products(products)
+        log.error("save_products failed", exc_info=True)
+
+@asynccontextmanager
+async def lifespan(app):
+    await run_in_threadpool(init_services)
+    notifier.start()
+    promo_engine.start()
+    if os.getenv("SEARCH_WARMUP", "1") == "1":
+        # Поисковый индекс строится в фоне, чтобы первый поиск не ждал его построения
+        threading.Thread(target=catalog.search, args=("",), name="search-warmup", daemon=True).start()
+    try:
+        yield
+    finally:
+        await notifier.stop()
+        await notifier.client.aclose()
+        await promo_engine.stop()
+        image_pool.shutdown()
 
 # ======== Вспомогательные ========
 
 def verify_admin_token(token: str):
+    # Сам токен в лог не пишем
     is_valid = token == ADMIN_SECRET
-    print(f"[DEBUG] Token verification: {is_valid}")
+    if not is_valid:
+        log.warning("Admin token rejected")
     return is_valid
 
 # ======== Основные маршруты ========
 
-@app.get("/")
-def serve_frontend():
+# Файлы, адреса которых index.html передаёт скрипту через window.ASSETS
+ASSET_ENTRYPOINTS = ("app.js", "style.css", "images/banner.webp", "images/placeholder.webp")
+_index_cache = {"key": None, "body": None, "etag": None}
+
+def render_index(index_path):
+    """
+    index.html со ссылками на app.js/style.css по адресам с хэшем и картой
+    адресов для скрипта (window.ASSETS). Пересобирается, только если изменился
+    сам index.html или манифест статики.
+    """
+    urls = {rel: assets.url(rel, verify=True) for rel in ASSET_ENTRYPOINTS}
+    key = (os.stat(index_path).st_mtime_ns, assets.version)
+    if _index_cache["key"] != key:
+        with open(index_path, "r", encoding="utf-8") as f:
+            page = f.read()
+        page = page.replace('href="style.css"', f'href="{urls["style.css"] or "style.css"}"')
+        script = (f'<script>window.ASSETS = {json.dumps({k: v for k, v in urls.items() if v})};</script>\n'
+                  f'    <script src="{urls["app.js"] or "app.js"}"></script>')
+        page = page.replace('<script src="app.js"></script>', script)
+        body = page.encode("utf-8")
+        _index_cache.update(key=key, body=body, etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+    return _index_cache["body"], _index_cache["etag"]
+
+@router.get("/")
+def serve_frontend(request: Request):
     index_path = os.path.join(FRONTEND_DIR, "index.html")
     if os.path.exists(index_path):
-        return FileResponse(index_path)
+        # Сама страница всегда перепроверяется, всё остальное берётся из кэша браузера
+        body, etag = render_index(index_path)
+        headers = {"Cache-Control": "no-cache", "ETag": etag}
+        if etag_matches(request.headers.get("if-none-match"), [etag]):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="text/html; charset=utf-8", headers=headers)
     
     # Fallback - возвращаем простую страницу
     return {"message": "Frontend not found. Please check frontend directory."}
 
-@app.get("/admin")
+@router.get("/admin")
 def serve_admin():
     admin_path = os.path.join(FRONTEND_DIR, "admin.html")
     if os.path.exists(admin_path):
@@ -140,129 +254,218 @@ def serve_admin():
     # Fallback
     return {"message": "Admin page not found. Please check frontend directory."}
 
-@app.get("/api/products")
-def get_products():
-    """Возвращает товары для сайта и мини-аппа"""
-    print(f"[DEBUG] === ЗАПРОС /api/products ===")
-    
-    # Всегда загружаем свежие данные из файла
-    current_products = load_products()
-    print(f"[DEBUG] Загружено из файла: {len(current_products)} товаров")
-    
-    products_for_client = []
-    for product in current_products:
-        p = product.copy()
-        if "available_sizes" in p:
-            p["sizes"] = list(p["available_sizes"].keys())
-        else:
-            p["sizes"] = []
-        products_for_client.append(p)
-    
-    print(f"[DEBUG] Отправляем клиенту: {len(products_for_client)} товаров")
-    return products_for_client
+@router.get("/api/products")
+def get_products(
+    request: Request,
+    limit: int | None = None,
+    cursor: str | None = None,
+    color: str | None = None,
+    size: str | None = None,
+    min_price: int | None = None,
+    max_price: int | None = None,
+    sort: str = "id",
+):
+    """
+    Возвращает товары для сайта и мини-аппа.
+    Без параметров — весь каталог (кэшируемый ответ с ETag);
+    с limit/фильтрами — страница {"items", "next_cursor"} по курсору.
+    """
+    snapshot = catalog.snapshot()
+
+    paged = limit is not None or cursor or color or size or min_price is not None \
+        or max_price is not None or sort != "id"
+    if paged:
+        limit = max(1, min(limit or PRODUCTS_PAGE_SIZE, PRODUCTS_PAGE_MAX))
+        descending = sort.startswith("-")
+        try:
+            items, next_cursor = snapshot.index().query(
+                color=color, size=size, min_price=min_price, max_price=max_price,
+                sort=sort.lstrip("-"), descending=descending, cursor=cursor, limit=limit,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"items": items, "next_cursor": next_cursor, "version": snapshot.version}
+
+    # Тело уже сериализовано и сжато для текущей версии каталога
+    encoded = snapshot.encoded()
+    headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+    body, etag, encoding = encoded.select(request.headers.get("accept-encoding"))
+    # 304 несёт ETag того представления, которое клиент закэшировал (выбранное — в приоритете)
+    cached = matched_etag(request.headers.get("if-none-match"), [etag] + encoded.all_etags())
+    if cached:
+        headers["ETag"] = cached
+        return Response(status_code=304, headers=headers)
+
+    headers["ETag"] = etag
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    log.debug("Products sent", extra={"count": len(snapshot), "version": snapshot.version, "encoding": encoding})
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.get("/api/products/{product_id}")
+def get_product(product_id: int):
+    """Один товар по id (для открытия по ссылке, если его нет на загруженных страницах)"""
+    product = catalog.snapshot().by_id.get(product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Товар не найден")
+    return product
+
+@router.get("/api/search")
+def search_products(
+    q: str = "",
+    limit: int = Query(PRODUCTS_PAGE_SIZE, ge=1, le=PRODUCTS_PAGE_MAX),
+    prefix: bool = True,
+):
+    """
+    Поиск по названию, описанию, составу и цвету: {"items", "total", "suggestions"}.
+    Последнее слово ищется и как начало слова (поиск по мере ввода),
+    suggestions — его возможные продолжения для автодополнения.
+    """
+    items, total, suggestions = catalog.search(q[:SEARCH_QUERY_MAX], limit, prefix)
+    return {"items": items, "total": total, "suggestions": suggestions}
 
 # ======== Статические файлы ========
 
-@app.get("/style.css")
+# Адреса без хэша: браузер обязан перепроверять их при каждом использовании
+REVALIDATE_CACHE = "no-cache"
+
+async def image_response(file_path, cache_control, accept=None, width=None, height=None, fit=None, fmt=None):
+    """
+    Файл как есть либо его вариант (width/height/fit/format), собранный по запросу
+    из сохранённого оригинала и закэшированный на диске. Формат без явного format
+    выбирается по заголовку Accept (AVIF/WebP/JPEG).
+    """
+    headers = {"Cache-Control": cache_control, "Vary": "Accept"}
+    if width is None and height is None and fmt is None:
+        chosen, chosen_fmt = negotiate_image(file_path, accept)
+        return FileResponse(chosen, media_type=media_type(chosen_fmt), headers=headers)
+    try:
+        if fmt is None:
+            fmt = negotiate_variant_format(accept, format_for_path(file_path))
+        params = variant_params(width, height, fit, fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    source = await run_in_threadpool(get_image_processor().original_for, file_path) or file_path
+    try:
+        variant_path = await variant_cache.get(source, params, image_pool)
+    except ImagePoolBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except Exception as e:
+        log.error("Image variant failed", extra={"path": file_path, "error": str(e)})
+        raise HTTPException(status_code=422, detail="Не удалось обработать изображение")
+    return FileResponse(variant_path, media_type=media_type(params[3]), headers=headers)
+
+@router.get("/assets/{digest}/{path:path}")
+async def serve_asset(
+    request: Request,
+    digest: str,
+    path: str,
+    width: int | None = None,
+    height: int | None = None,
+    fit: str = "cover",
+    fmt: str | None = Query(None, alias="format"),
+):
+    """Статика по адресу с хэшем содержимого — кэшируется браузером навсегда."""
+    # resolve делает stat и может досчитать хэш файла — не в цикле событий
+    file_path, fresh = await run_in_threadpool(assets.resolve, digest, path)
+    if file_path is None:
+        raise HTTPException(status_code=404)
+    # Файл успели перезаписать: отдаём актуальное содержимое, но без вечного кэша
+    cache_control = IMMUTABLE_CACHE if fresh else REVALIDATE_CACHE
+    return await image_response(file_path, cache_control, request.headers.get("accept"),
+                                width, height, fit, fmt)
+
+@router.get("/style.css")
 def serve_css():
     css_path = os.path.join(FRONTEND_DIR, "style.css")
     if os.path.exists(css_path):
-        return FileResponse(css_path)
+        return FileResponse(css_path, headers={"Cache-Control": REVALIDATE_CACHE})
     raise HTTPException(status_code=404)
 
-@app.get("/app.js")
+@router.get("/app.js")
 def serve_js():
     js_path = os.path.join(FRONTEND_DIR, "app.js")
     if os.path.exists(js_path):
-        return FileResponse(js_path)
+        return FileResponse(js_path, headers={"Cache-Control": REVALIDATE_CACHE})
     raise HTTPException(status_code=404)
 
 # УНИФИЦИРОВАННЫЙ МАРШРУТ ДЛЯ ВСЕХ ИЗОБРАЖЕНИЙ
-@app.get("/images/{path:path}")
-def serve_images(path: str):
+# /images/products/product-7-1-large.webp?width=400&height=500&fit=cover&format=jpeg — вариант по запросу
+@router.get("/images/{path:path}")
+async def serve_images(
+    request: Request,
+    path: str,
+    width: int | None = None,
+    height: int | None = None,
+    fit: str = "cover",
+    fmt: str | None = Query(None, alias="format"),
+):
     if not os.path.exists(FRONTEND_DIR):
         raise HTTPException(status_code=404, detail="Frontend directory not found")
-    
-    file_path = os.path.join(FRONTEND_DIR, "images", path)
-    if os.path.exists(file_path):
-        return FileResponse(file_path)
+
+    images_dir = os.path.join(FRONTEND_DIR, "images")
+    file_path = os.path.normpath(os.path.join(images_dir, path))
+    if file_path.startswith(images_dir + os.sep) and os.path.isfile(file_path):
+        return await image_response(file_path, REVALIDATE_CACHE, request.headers.get("accept"),
+                                    width, height, fit, fmt)
     
     raise HTTPException(status_code=404, detail=f"Image not found: {path}")
 
 # ======== Админка API ========
 
-@app.post("/api/admin/verify-token")
+@router.post("/api/admin/verify-token")
 async def verify_token(data: dict):
     """Проверка валидности токена"""
     token = data.get('token')
-    print(f"[DEBUG] Verify token request: {token}")
-    
+
     if verify_admin_token(token):
         return {"status": "valid"}
     else:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-@app.post("/api/admin/login")
+@router.post("/api/admin/login")
 def admin_login(login_data: dict):
     token = login_data.get("token")
-    print(f"[DEBUG] Login attempt with token: {token}")
-    
+
     if verify_admin_token(token):
         return {"status": "success", "message": "Добро пожаловать в админку!"}
     raise HTTPException(status_code=401, detail="Неверный токен доступа")
 
-@app.get("/api/admin/products")
+@router.get("/api/admin/products")
 def get_admin_products(token: str):
-    print(f"[DEBUG] Get admin products with token: {token}")
-    
     if not verify_admin_token(token):
         raise HTTPException(status_code=401, detail="Доступ запрещен")
     
-    current_products = load_products()
-    enriched = []
-    for p in current_products:
-        x = p.copy()
-        x["sizes"] = list(p.get("available_sizes", {}).keys())
-        enriched.append(x)
-    
-    print(f"[DEBUG] Returning {len(enriched)} products to admin")
+    enriched = catalog.snapshot().client_products
+    log.debug("Admin products sent", extra={"count": len(enriched)})
     return enriched
 
-@app.get("/api/admin/statistics")
-def get_statistics(token: str):
-    print(f"[DEBUG] Get statistics with token: {token}")
-    
+@router.get("/api/admin/statistics")
+def get_statistics(token: str, date_from: str = None, date_to: str = None, granularity: str = "day"):
     if not verify_admin_token(token):
         raise HTTPException(status_code=401, detail="Доступ запрещен")
 
-    current_products = load_products()
-    total_products = len(current_products)
-    total_items = 0
-    size_breakdown = {}
-
-    for product in current_products:
-        for size, qty in product.get("available_sizes", {}).items():
-            total_items += qty
-            size_breakdown[size] = size_breakdown.get(size, 0) + qty
-
-    products_stats = []
-    for product in current_products:
-        total = sum(product.get("available_sizes", {}).values())
-        products_stats.append({
-            "id": product["id"],
-            "name": product["name"],
-            "total": total,
-            "sizes": product.get("available_sizes", {})
-        })
+    # Остатки — из сводки текущего снимка каталога, продажи — из готовых агрегатов журнала заказов
+    try:
+        sales = order_log.summary(date_from, date_to, granularity=granularity)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректный период: {e}")
 
-    return {
-        "total_products": total_products,
-        "total_items": total_items,
-        "size_breakdown": size_breakdown,
-        "products_stats": products_stats
-    }
+    return {**catalog.snapshot().stats().as_dict(), "sales": sales}
+
+@router.get("/api/admin/orders")
+def get_orders(token: str, date_from: str = None, date_to: str = None, limit: int = Query(100, ge=1, le=1000)):
+    if not verify_admin_token(token):
+        raise HTTPException(status_code=401, detail="Доступ запрещен")
+    try:
+        return order_log.orders(date_from, date_to, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректный период: {e}")
 
-@app.post("/api/admin/products")
+@router.post("/api/admin/products")
 async def create_product(
     token: str = Form(...),
     name: str = Form(...),
@@ -273,52 +476,77 @@ async def create_product(
     available_sizes: str = Form(...),
     images: list[UploadFile] = File(...)
 ):
-    print(f"[DEBUG] Create product: {name}")
-    
     if not verify_admin_token(token):
         raise HTTPException(status_code=401, detail="Доступ запрещен")
 
     try:
-        current_products = load_products()
-        new_id = max([p["id"] for p in current_products], default=0) + 1
+        # id выдаётся атомарно заранее: по нему называются файлы картинок
+        new_id = catalog.allocate_id()
         sizes_data = json.loads(available_sizes)
 
-        print(f"[DEBUG] Processing {len(images)} images for product {new_id}")
-        all_image_paths = image_processor.process_multiple_images(images, name, new_id)
-        small = [img['small'] for img in all_image_paths]
-        large = [img['large'] for img in all_image_paths]
-
-        new_product = {
-            "id": new_id,
-            "name": name,
-            "price": price,
-            "color": color,
-            "available_sizes": sizes_data,
-            "composition": composition,
-            "description": description,
-            "images": small,
-            "images_large": large,
-            "image": small[0] if small else "/static/images/placeholder.webp",
-            "image_large": large[0] if large else "/static/images/placeholder.webp"
-        }
-
-        current_products.append(new_product)
-        save_products(current_products)
+        log.info("Creating product", extra={"product_id": new_id, "images": len(images)})
+        # Ресайз и кодирование — в пуле процессов, витрина в это время продолжает работать
+        all_image_paths = await get_image_processor().process_multiple_images_async(images, name, new_id, image_pool)
+        if all_image_paths is None:
+            raise HTTPException(status_code=500, detail="Не удалось обработать изображения")
+        new_product = new_product_record(new_id, name, price, color, sizes_data, composition, description,
+                                         all_image_paths)
+
+        await run_in_threadpool(catalog.add, new_product)
         
-        print(f"[DEBUG] Product created successfully: {new_id}")
+        log.info("Product created", extra={"product_id": new_id})
         return {"status": "success", "product": new_product}
 
+    except ImagePoolBusy as e:
+        raise HTTPException(status_code=503, detail=f"Сервер занят обработкой изображений, повторите позже: {e}",
+                            headers={"Retry-After": "5"})
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"[ERROR] Create product error: {e}")
+        log.error("Create product failed", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при создании товара: {e}")
 
-@app.post("/api/admin/banner")
+@router.post("/api/admin/products/import")
+async def import_products(
+    token: str = Form(...),
+    manifest: UploadFile = File(...),
+    photos: UploadFile = File(...)
+):
+    """
+    Массовый импорт: манифест CSV/JSON + ZIP с фото (см. bulk_import.py).
+    Прогресс приходит построчно в NDJSON; товары добавляются все сразу или ни одного.
+    """
+    if not verify_admin_token(token):
+        raise HTTPException(status_code=401, detail="Доступ запрещен")
+
+    try:
+        rows = parse_manifest(await manifest.read(), manifest.filename or "")
+        # Архив читается прямо из временного файла загрузки, целиком в память не попадает
+        source = await run_in_threadpool(PhotoSource, photos.file)
+    except (BulkImportError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    importer = BulkImporter(catalog, get_image_processor(), image_pool)
+
+    async def events():
+        try:
+            async for event in importer.run(rows, source):
+                if event["event"] != "progress":
+                    log.info("Bulk import event", extra={"event": event["event"]})
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        finally:
+            source.close()
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@router.post("/api/admin/banner")
 async def upload_banner(
     token: str = Form(...),
     banner_image: UploadFile = File(...)
 ):
     """
     Принимает баннер, проверяет токен/тип/размер, сохраняет в frontend/images/banner.webp
+    (и копии .avif/.jpg для согласования формата по Accept).
     Возвращает публичный URL для клиента.
     """
     # 1) Токен
@@ -329,7 +557,7 @@ async def upload_banner(
     # BASE_DIR = backend/, PROJECT_ROOT = корень проекта, FRONTEND_DIR = <root>/frontend
     image_dir = os.path.join(FRONTEND_DIR, "images")
     os.makedirs(image_dir, exist_ok=True)
-    tmp_path = os.path.join(image_dir, "_banner_upload.tmp")
+    tmp_path = os.path.join(image_dir, f"_banner_upload.{os.getpid()}.tmp")
     output_path = os.path.join(image_dir, "banner.webp")  # итоговый
 
     # 3) Лимиты/форматы
@@ -363,6 +591,8 @@ async def upload_banner(
 
     # Пишем во временный файл, потом переименовываем (атомарная запись)
     try:
+        # Сначала копии AVIF/JPEG, затем сам .webp — адрес баннера меняется по его хэшу
+        save_siblings(img, output_path, get_image_processor().extra_formats)
         img.save(tmp_path, format="WEBP", quality=90, method=6)
         os.replace(tmp_path, output_path)
     except Exception as e:
@@ -371,38 +601,79 @@ async def upload_banner(
             os.remove(tmp_path)
         raise HTTPException(status_code=500, detail=f"Ошибка сохранения баннера: {e}")
 
-    # 6) Возвращаем ПУБЛИЧНЫЙ URL, чтобы фронт мог сразу подхватить
-    public_url = "/static/images/banner.webp"
+    # 6) Возвращаем ПУБЛИЧНЫЙ URL (с новым хэшем), чтобы фронт мог сразу подхватить
+    public_url = assets.refresh("images/banner.webp") or "/static/images/banner.webp"
     return {"status": "success", "message": "Баннер успешно обновлен!", "url": public_url}
 
     
-@app.delete("/api/admin/products/{product_id}")
+@router.delete("/api/admin/products/{product_id}")
 def delete_product(product_id: int, token: str):
-    print(f"[DEBUG] Delete product: {product_id}")
-    
     if not verify_admin_token(token):
         raise HTTPException(status_code=401, detail="Доступ запрещен")
 
     try:
-        current_products = load_products()
-        updated_products = [p for p in current_products if p["id"] != product_id]
-        
-        if len(updated_products) == len(current_products):
+        if not catalog.delete(product_id):
             raise HTTPException(status_code=404, detail="Товар не найден")
-            
-        save_products(updated_products)
-        print(f"[DEBUG] Product {product_id} deleted successfully")
+
+        log.info("Product deleted", extra={"product_id": product_id})
         return {"status": "success", "message": "Товар удален"}
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[ERROR] Delete product error: {e}")
+        log.error("Delete product failed", exc_info=True, extra={"product_id": product_id})
         raise HTTPException(status_code=500, detail=f"Ошибка при удалении товара: {e}")
 
+@router.get("/api/admin/notifications")
+def notification_stats(token: str):
+    """Глубина очереди уведомлений и задержка доставки"""
+    if not verify_admin_token(token):
+        raise HTTPException(status_code=401, detail="Доступ запрещен")
+    return notifier.stats()
+
+@router.post("/api/admin/notifications/retry")
+def retry_dead_notifications(data: dict):
+    """Повторная отправка сообщений из dead-letter"""
+    if not verify_admin_token(data.get("token")):
+        raise HTTPException(status_code=401, detail="Доступ запрещен")
+    requeued = notification_queue.requeue_dead()
+    notifier.wakeup()
+    return {"status": "ok", "requeued": requeued}
+
+@router.get("/api/admin/image-cache")
+def image_cache_stats(token: str):
+    """Попадания/промахи кэша вариантов изображений и загрузка пула обработки"""
+    if not verify_admin_token(token):
+        raise HTTPException(status_code=401, detail="Доступ запрещен")
+    return {"cache": variant_cache.stats(), "pool": image_pool.stats()}
+
+# ======== Метрики ========
+# Состояние компонентов считывается при сборе, а не обновляется на каждом запросе
+Gauge("catalog_products", "Товаров в текущем снимке каталога", function=lambda: len(catalog.snapshot()))
+Gauge("catalog_version", "Версия снимка каталога", function=lambda: catalog.snapshot().version)
+Gauge("inventory_active_reservations", "Активные резервы остатков",
+      function=lambda: inventory.stats()["active_reservations"])
+Gauge("image_pool_tasks", "Задачи пула обработки фото", ("state",),
+      function=lambda: {"inflight": image_pool.stats()["inflight"], "waiting": image_pool.stats()["waiting"]})
+Gauge("image_cache_bytes", "Объём кэша вариантов изображений", function=lambda: variant_cache.stats()["bytes"])
+Gauge("image_cache_lookups", "Обращения к кэшу вариантов изображений", ("result",),
+      function=lambda: {k: variant_cache.stats()[k] for k in ("hits", "misses", "coalesced")})
+Gauge("log_records_dropped", "Записи лога, отброшенные из-за переполненной очереди", function=log_records_dropped)
+Gauge("notification_queue_depth", "Уведомления в очереди", ("status",),
+      function=lambda: {k: v for k, v in notification_queue.stats().items() if k in ("pending", "inflight", "dead")})
+
+@router.get("/metrics")
+def metrics_endpoint(token: str = None):
+    """Метрики в текстовом формате Prometheus; METRICS_TOKEN (если задан) закрывает эндпоинт"""
+    required = os.getenv("METRICS_TOKEN")
+    if required and token != required:
+        raise HTTPException(status_code=401, detail="Доступ запрещен")
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8",
+                    headers={"Cache-Control": "no-store"})
+
 # ======== Отладочные маршруты ========
 
-@app.get("/api/debug/products")
+@router.get("/api/debug/products")
 def debug_products():
     """Отладочный эндпоинт для проверки товаров"""
     file_exists = os.path.exists(PRODUCTS_FILE)
@@ -415,7 +686,7 @@ def debug_products():
         "products": products_data
     }
 
-@app.get("/api/debug/paths")
+@router.get("/api/debug/paths")
 def debug_paths():
     """Отладочный эндпоинт для проверки путей"""
     return {
@@ -423,12 +694,13 @@ def debug_paths():
         "project_root": PROJECT_ROOT,
         "frontend_dir": FRONTEND_DIR,
         "frontend_exists": os.path.exists(FRONTEND_DIR),
+        "storage_backend": storage.name,
         "products_file": os.path.abspath(PRODUCTS_FILE),
         "products_file_exists": os.path.exists(PRODUCTS_FILE),
         "current_working_dir": os.getcwd()
     }
 
-@app.get("/api/test")
+@router.get("/api/test")
 def test_endpoint():
     return {
         "status": "ok", 
@@ -437,7 +709,7 @@ def test_endpoint():
     }
 # ======== Поделиться товаром ========
 
-@app.post("/api/share")
+@router.post("/api/share")
 async def share_product(data: dict):
     """
     Отправка карточки товара в Telegram другу
@@ -453,8 +725,7 @@ async def share_product(data: dict):
         if not chat_id or not product_id:
             raise HTTPException(status_code=400, detail="Missing chat_id or product_id")
 
-        products = load_products()
-        product = next((p for p in products if p["id"] == product_id), None)
+        product = catalog.snapshot().by_id.get(product_id)
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
 
@@ -470,27 +741,36 @@ async def share_product(data: dict):
 
         photo = product.get("image_large") or product.get("image")
 
-        url = f"https://api.telegram.org/bot{bot_token}/sendPhoto"
-        payload = {
-            "chat_id": chat_id,
-            "photo": photo,
-            "caption": text,
-            "parse_mode": "HTML",
-        }
-
-        r = requests.post(url, data=payload)
-        if r.status_code != 200:
-            raise HTTPException(status_code=500, detail=f"Telegram API error: {r.text}")
+        # Сообщение уходит через очередь: ответ клиенту не ждёт Telegram
+        payload = {"chat_id": chat_id, "photo": photo, "caption": text, "parse_mode": "HTML"}
+        job_id = await notifier.enqueue("sendPhoto", chat_id, payload)
 
-        return {"status": "success", "message": "Товар успешно отправлен!"}
+        return {"status": "success", "message": "Товар успешно отправлен!", "notification_id": job_id}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # ======== Заказы ========
 
-@app.post("/api/order")
+@router.post("/api/cart/quote")
+async def cart_quote(data: dict):
+    """Цены, наличие, промокод и итог корзины одним запросом"""
+    try:
+        lines = cart_lines(data.get("items", data.get("products", [])))
+    except (ValueError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Некорректная корзина: {e}")
+    promo = data.get("promo")
+    if promo is not None and not isinstance(promo, str):
+        raise HTTPException(status_code=400, detail="Промокод должен быть строкой")
+    # Проверка промокода может перечитать хранилище — не в цикле событий
+    return await run_in_threadpool(quote_cart, catalog.snapshot(), lines, promo_engine,
+                                   promo=promo, user_id=data.get("user_id"),
+                                   available=inventory.available)
+
+@router.post("/api/order")
 async def create_order(order_data: dict):
     try:
         bot_token = os.getenv("BOT_TOKEN")
@@ -498,77 +778,129 @@ async def create_order(order_data: dict):
         if not bot_token or not manager_chat_id:
             raise HTTPException(status_code=500, detail="Bot not configured")
 
-        message = format_order_message(order_data)
-        url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-        payload = {"chat_id": manager_chat_id, "text": message, "parse_mode": "HTML"}
-
-        response = requests.post(url, json=payload)
-        if response.status_code == 200:
-            return {"status": "success", "message": "Order sent to manager"}
-        raise HTTPException(status_code=500, detail="Failed to send message")
+        # Сначала удерживаем остатки, чтобы не продать больше, чем есть
+        try:
+            lines = order_items(order_data)
+            # Замки полос и возможное перечитывание каталога — не в цикле событий
+            reservation = await run_in_threadpool(inventory.reserve, lines)
+        except InsufficientStock as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            raise HTTPException(status_code=400, detail=f"Некорректный заказ: {e}")
+
+        # Промокод гасится атомарно: лимит не превысится даже при наплыве заказов
+        promo_code = order_data.get("promo")
+        user_id = (order_data.get("user") or {}).get("id")
+        discount = 0
+        if promo_code is not None and not isinstance(promo_code, str):
+            await run_in_threadpool(inventory.release, reservation.id)
+            raise HTTPException(status_code=400, detail="Промокод должен быть строкой")
+        if promo_code:
+            try:
+                discount = await run_in_threadpool(promo_engine.redeem, promo_code, user_id)
+            except PromoRejected as e:
+                await run_in_threadpool(inventory.release, reservation.id)
+                raise HTTPException(status_code=409, detail=str(e))
+
+        # Цены и итог считает сервер; total_price от клиента только для сверки
+        quote = price_cart(catalog.snapshot(), lines, discount)
+        client_total = order_data.get("total_price")
+        if client_total is not None and client_total != quote["total"]:
+            log.warning("Client total differs from server quote",
+                        extra={"client_total": client_total, "server_total": quote["total"]})
+
+        try:
+            message = format_order_message(order_data, quote)
+            payload = {"chat_id": manager_chat_id, "text": message, "parse_mode": "HTML"}
+        except Exception:
+            await run_in_threadpool(inventory.release, reservation.id)
+            if promo_code:
+                await run_in_threadpool(promo_engine.refund, promo_code, user_id)
+            raise
+
+        # Заказ принят, как только остатки списаны: резерв → списание → уведомление
+        try:
+            # Запись остатков в хранилище — в пуле потоков, чтобы не блокировать цикл событий
+            await run_in_threadpool(inventory.commit, reservation.id)
+        except InsufficientStock as e:
+            # commit снимает удержание сам; менеджер о несостоявшемся заказе не узнает
+            if promo_code:
+                await run_in_threadpool(promo_engine.refund, promo_code, user_id)
+            raise HTTPException(status_code=409, detail=str(e))
+        except Exception:
+            if promo_code:
+                await run_in_threadpool(promo_engine.refund, promo_code, user_id)
+            raise
+
+        # Товар уже продан: сбой очереди не отменяет заказ, остатки не возвращаются
+        job_id = None
+        try:
+            job_id = await notifier.enqueue("sendMessage", manager_chat_id, payload)
+        except Exception:
+            log.error("Order notification enqueue failed", exc_info=True)
+
+        try:
+            await run_in_threadpool(record_order, order_data, quote)
+        except Exception:
+            # Аналитика не должна ломать уже принятый заказ
+            log.error("Order analytics record failed", exc_info=True)
+        return {"status": "success", "message": "Order sent to manager", "notification_id": job_id,
+                "total": quote["total"]}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def format_order_message(order_data):
-    products_list = order_data.get("products", [])
+def order_items(order_data):
+    """Позиции корзины в виде (product_id, size, qty) для резервирования"""
+    return cart_lines(order_data.get("products", []))
+
+def record_order(order_data, quote):
+    """Дописывает заказ в журнал по серверной котировке"""
+    items = [
+        {"product_id": line["productId"], "name": line["name"], "size": line["size"],
+         "qty": line["quantity"], "price": line["price"]}
+        for line in quote["lines"]
+    ]
+    user = order_data.get("user") or {}
+    return order_log.record(items, total=quote["total"], user_id=user.get("id"), promo=order_data.get("promo"))
+
+def format_order_message(order_data, quote):
     user_info = order_data.get("user", {})
-    total_price = order_data.get("total_price", 0)
     promo_code = order_data.get("promo")
 
     msg = "🛍️ <b>НОВЫЙ ЗАКАЗ ИЗ MINI APP</b>\n\n"
     msg += "<b>Товары:</b>\n"
-    for i, p in enumerate(products_list, 1):
-        msg += f"{i}. {p['name']}\n"
-        msg += f"   • Размер: {p.get('size','-')}\n"
-        msg += f"   • Цвет: {p.get('color','-')}\n"
-        msg += f"   • Цена: {p.get('price','-')}₽\n\n"
+    for i, line in enumerate(quote["lines"], 1):
+        msg += f"{i}. {html.escape(line['name'])}\n"
+        msg += f"   • Размер: {html.escape(line['size'])}\n"
+        msg += f"   • Цвет: {html.escape(line.get('color') or '-')}\n"
+        if line["quantity"] > 1:
+            msg += f"   • Количество: {line['quantity']}\n"
+        msg += f"   • Цена: {line['price']}₽\n\n"
 
     # если применён промокод — показать скидку
     if promo_code:
-        msg += f"💸 <b>Промокод:</b> {promo_code}\n"
+        msg += f"💸 <b>Промокод:</b> {html.escape(str(promo_code))} (−{quote['discount_amount']}₽)\n"
 
-    msg += f"💰 <b>Итого со скидкой: {total_price}₽</b>\n\n"
+    msg += f"💰 <b>Итого со скидкой: {quote['total']}₽</b>\n\n"
     msg += "<b>Информация о покупателе:</b>\n"
-    msg += f"👤 ID: {user_info.get('id', 'Неизвестно')}\n"
-    msg += f"📛 Имя: {user_info.get('first_name', 'Неизвестно')}\n"
-    msg += f"📞 Username: @{user_info.get('username', 'Не указан')}\n"
+    msg += f"👤 ID: {html.escape(str(user_info.get('id', 'Неизвестно')))}\n"
+    msg += f"📛 Имя: {html.escape(str(user_info.get('first_name', 'Неизвестно')))}\n"
+    msg += f"📞 Username: @{html.escape(str(user_info.get('username', 'Не указан')))}\n"
     return msg
 
 
 
 
-import json
-from pathlib import Path
-
-PROMO_FILE = Path(__file__).parent / "promos.json"
-
-def load_promos():
-    """Загрузка промокодов из файла"""
-    if PROMO_FILE.exists():
-        with open(PROMO_FILE, "r", encoding="utf-8") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return {}
-    return {}
-
-def save_promos(data):
-    """Сохранение промокодов в файл"""
-    with open(PROMO_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-# === Загружаем промокоды при старте ===
-promo_db = load_promos()
-
 # === Эндпоинты управления промокодами ===
-@app.get("/api/admin/promocodes")
+@router.get("/api/admin/promocodes")
 async def get_promocodes(token: str):
     if token != ADMIN_SECRET:
         raise HTTPException(status_code=403, detail="Неверный токен")
-    promos = load_promos()
-    return [{"code": k, **v} for k, v in promos.items()]
+    return promo_engine.all()
 
-@app.post("/api/admin/promocodes")
+@router.post("/api/admin/promocodes")
 async def add_promocode(data: dict):
     if data.get("token") != ADMIN_SECRET:
         raise HTTPException(status_code=403, detail="Неверный токен")
@@ -580,40 +912,95 @@ async def add_promocode(data: dict):
     if not code or not isinstance(discount, (int, float)) or discount <= 0:
         raise HTTPException(status_code=400, detail="Некорректные данные")
 
-    promos = load_promos()
-    promos[code] = {"discount": discount, "description": description}
-    save_promos(promos)
+    promo = {"discount": discount, "description": description}
+    # Необязательные ограничения: срок действия и лимиты использований
+    for field in ("max_uses", "per_user_limit"):
+        value = data.get(field)
+        if value in (None, ""):
+            continue
+        if not isinstance(value, int) or value <= 0:
+            raise HTTPException(status_code=400, detail=f"Некорректное значение {field}")
+        promo[field] = value
+    if data.get("expires_at"):
+        promo["expires_at"] = data["expires_at"]
+
+    try:
+        await run_in_threadpool(promo_engine.upsert, code, promo)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректная дата expires_at")
 
     return {"status": "ok", "code": code, "discount": discount}
 
-@app.delete("/api/admin/promocodes/{code}")
+@router.delete("/api/admin/promocodes/{code}")
 async def delete_promocode(code: str, token: str):
     if token != ADMIN_SECRET:
         raise HTTPException(status_code=403, detail="Неверный токен")
 
-    promos = load_promos()
     code = code.lower()
-    if code not in promos:
+    if not await run_in_threadpool(promo_engine.delete, code):
         raise HTTPException(status_code=404, detail="Промокод не найден")
 
-    del promos[code]
-    save_promos(promos)
     return {"status": "deleted", "code": code}
 
-# === Проверка промокодов, используем тот же файл ===
-@app.post("/api/promo")
+# === Проверка промокода (без погашения — оно происходит при оформлении заказа) ===
+@router.post("/api/promo")
 async def check_promo(data: dict):
-    code = data.get("code", "").strip().lower()
-    promos = load_promos()
-    if code in promos:
-        return {"valid": True, "discount": promos[code]["discount"]}
-    return {"valid": False}
+    code = data.get("code", "")
+    if not isinstance(code, str):
+        raise HTTPException(status_code=400, detail="Промокод должен быть строкой")
+    try:
+        discount = await run_in_threadpool(promo_engine.check, code, data.get("user_id"))
+    except PromoRejected as e:
+        return {"valid": False, "reason": e.reason}
+    return {"valid": True, "discount": discount}
+
+
+
+# ======== Приложение ========
+
+def create_app():
+    """Собирает FastAPI-приложение: middleware, статика, маршруты. Данные загружаются в lifespan."""
+    setup_logging()
+    app = FastAPI(lifespan=lifespan)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    # Последним — значит внешним: меряет запрос целиком, включая CORS
+    app.add_middleware(MetricsMiddleware)
+    # id запроса нужен и в логах middleware выше, поэтому он самый внешний
+    app.add_middleware(RequestIdMiddleware)
+
+    if os.path.exists(FRONTEND_DIR):
+        log.info("Frontend directory found", extra={"frontend_dir": FRONTEND_DIR})
+        # Монтируем статические файлы только если директория существует
+        app.mount("/static", NegotiatingStaticFiles(directory=FRONTEND_DIR), name="static")
+    else:
+        log.error("Frontend directory not found", extra={
+            "frontend_dir": FRONTEND_DIR, "cwd": os.getcwd(), "project_root_contents": os.listdir(PROJECT_ROOT),
+        })
+
+    app.include_router(router)
+    return app
 
+_app = None
 
+def __getattr__(name):
+    # main.app собирается при первом обращении (uvicorn main:app), а не при импорте модуля
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(create_app(), host="0.0.0.0", port=8000)
 
 
     
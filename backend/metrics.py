@@ -0,0 +1,302 @@
+"""
+Метрики в формате Prometheus (text exposition 0.0.4) без внешних зависимостей.
+
+Счётчики, шкалы и гистограммы с метками; значения хранятся в памяти процесса,
+обновление — словарь + замок, поэтому метрики можно держать включёнными в проде.
+Отдаются через GET /metrics (см. main.py), запросы измеряет MetricsMiddleware.
+"""
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+from logger import get_logger
+
+log = get_logger("metrics")
+
+# Границы по умолчанию — как в prometheus_client
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), registry=registry):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._new_child()
+            self._children[()] = self._default
+        registry.register(self)
+
+    def labels(self, *values):
+        """Ряд метрики для значений меток (в порядке labelnames)."""
+        key = tuple(map(str, values))
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидались метки {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+    _new_child = _CounterChild
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def samples(self):
+        for values, child in self._items():
+            yield f"{self.name}_total{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        self.value = value
+
+
+class Gauge(_Metric):
+    """Текущее значение; можно задать функцию, которая вычисляется при каждом сборе."""
+
+    kind = "gauge"
+    _new_child = _GaugeChild
+
+    def __init__(self, *args, function=None, **kwargs):
+        self.function = function
+        super().__init__(*args, **kwargs)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def set(self, value):
+        self._default.set(value)
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                values = self.function()
+            except Exception as e:
+                log.warning("Metric collection failed", extra={"metric": self.name, "error": str(e)})
+                return
+            # Функция возвращает число или {значения меток: число}
+            items = values.items() if isinstance(values, dict) else [((), values)]
+            for labels, value in items:
+                labels = labels if isinstance(labels, tuple) else (labels,)
+                yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(float(value))}"
+            return
+        for values, child in self._items():
+            yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)      # последняя корзина — +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=registry):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def samples(self):
+        for values, child in self._items():
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+# ======== Метрики приложения ========
+
+HTTP_REQUESTS = Counter("http_requests", "HTTP-запросы", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "Время обработки запроса", ("method", "route"))
+HTTP_RESPONSE_SIZE = Histogram("http_response_size_bytes", "Размер тела ответа", ("method", "route"),
+                               buckets=SIZE_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Запросы в обработке")
+
+CATALOG_SECONDS = Histogram("catalog_operation_seconds", "Загрузка и сериализация каталога", ("operation",))
+IMAGE_SECONDS = Histogram("image_processing_seconds", "Обработка фото по размерам и этапам", ("size", "stage"))
+TELEGRAM_SECONDS = Histogram("telegram_api_seconds", "Вызовы Telegram Bot API", ("method", "outcome"))
+STORAGE_WRITE_SECONDS = Histogram("storage_write_seconds", "Запись в хранилище", ("backend", "target"))
+
+
+def observe_image_timings(rendered):
+    """Переносит тайминги из результата render_sizes (посчитаны в воркере пула) в метрики процесса."""
+    for size_name, stages in (rendered or {}).get("timings", {}).items():
+        for stage, seconds in stages.items():
+            IMAGE_SECONDS.labels(size_name, stage).observe(seconds)
+
+
+# ======== ASGI middleware ========
+
+class MetricsMiddleware:
+    """
+    Чистое ASGI-middleware (без BaseHTTPMiddleware — оно дорогое): задержка, код ответа,
+    размер тела и число запросов в обработке. Метка route — шаблон пути маршрута
+    (/api/products/{product_id}), а не сам путь, чтобы число рядов не росло.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths = None
+
+    def _route_label(self, scope):
+        if self._route_paths is None:
+            router = scope.get("router") or getattr(scope.get("app"), "router", None)
+            routes = getattr(router, "routes", [])
+            self._route_paths = {
+                getattr(route, "endpoint", None) or getattr(route, "app", None): getattr(route, "path", "")
+                for route in routes
+            }
+        endpoint = scope.get("endpoint")
+        if endpoint is not None:
+            return self._route_paths.get(endpoint, "other")
+        # Смонтированные приложения (StaticFiles) — по точке монтирования
+        root_path = scope.get("root_path")
+        if root_path:
+            return f"{root_path}/*"
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        size = 0
+        declared = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size, declared
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                for name, value in message.get("headers", ()):
+                    if name == b"content-length":
+                        declared = int(value)
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            method = scope["method"]
+            route = self._route_label(scope)
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+            HTTP_LATENCY.labels(method, route).observe(elapsed)
+            # Файлы через http.response.pathsend тела не передают — берём Content-Length
+            HTTP_RESPONSE_SIZE.labels(method, route).observe(size or declared)
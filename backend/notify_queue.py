@@ -0,0 +1,305 @@
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import threading
+
+from logger import get_logger
+
+log = get_logger("notify")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notifications (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    method          TEXT NOT NULL,
+    chat_id         TEXT NOT NULL,
+    payload         TEXT NOT NULL,
+    status          TEXT NOT NULL DEFAULT 'pending',   -- pending | inflight | done | dead
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    created_at      REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    lease_until     REAL,
+    delivered_at    REAL,
+    last_error      TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_notifications_due ON notifications(status, next_attempt_at);
+-- Когда в чат снова можно писать: общий лимит для всех процессов с этой очередью
+CREATE TABLE IF NOT EXISTS chat_limits (
+    chat_id TEXT PRIMARY KEY,
+    next_at REAL NOT NULL
+);
+"""
+
+
+class NotificationQueue:
+    """
+    Постоянная очередь исходящих сообщений в Telegram (SQLite, WAL).
+    Заказ считается принятым, как только сообщение записано в очередь;
+    доставка идёт в фоне. Взятые в работу задачи получают аренду (lease),
+    поэтому после падения процесса они снова станут доступны.
+    """
+
+    def __init__(self, db_path, lease_seconds=120):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, method, chat_id, payload) -> int:
+        now = time.time()
+        cur = self._connect().execute(
+            "INSERT INTO notifications (method, chat_id, payload, created_at, next_attempt_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (method, str(chat_id), json.dumps(payload, ensure_ascii=False), now, now),
+        )
+        return cur.lastrowid
+
+    def claim(self, limit=50, per_chat_interval=0.0):
+        """
+        Забирает готовые к отправке задачи (и задачи с истёкшей арендой).
+        При per_chat_interval > 0 — не больше одной задачи на чат, и чат закрывается
+        на этот интервал в chat_limits: лимит держится между всеми воркерами.
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if per_chat_interval > 0:
+                rows = conn.execute(
+                    "SELECT * FROM ("
+                    "  SELECT *, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY next_attempt_at, id) AS rn "
+                    "  FROM notifications "
+                    "  WHERE ((status = 'pending' AND next_attempt_at <= ?) "
+                    "      OR (status = 'inflight' AND lease_until < ?)) "
+                    "    AND chat_id NOT IN (SELECT chat_id FROM chat_limits WHERE next_at > ?)"
+                    ") WHERE rn = 1 ORDER BY next_attempt_at, id LIMIT ?",
+                    (now, now, now, limit),
+                ).fetchall()
+                conn.execute("DELETE FROM chat_limits WHERE next_at <= ?", (now,))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO chat_limits (chat_id, next_at) VALUES (?, ?)",
+                    [(r["chat_id"], now + per_chat_interval) for r in rows],
+                )
+            else:
+                rows = conn.execute(
+                    "SELECT * FROM notifications "
+                    "WHERE (status = 'pending' AND next_attempt_at <= ?) "
+                    "   OR (status = 'inflight' AND lease_until < ?) "
+                    "ORDER BY next_attempt_at, id LIMIT ?",
+                    (now, now, limit),
+                ).fetchall()
+            conn.executemany(
+                "UPDATE notifications SET status = 'inflight', lease_until = ? WHERE id = ?",
+                [(now + self.lease_seconds, r["id"]) for r in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        jobs = [dict(r, payload=json.loads(r["payload"])) for r in rows]
+        for job in jobs:
+            job.pop("rn", None)
+        return jobs
+
+    def ack(self, job_id):
+        self._connect().execute(
+            "UPDATE notifications SET status = 'done', delivered_at = ?, attempts = attempts + 1, "
+            "lease_until = NULL, last_error = NULL WHERE id = ?",
+            (time.time(), job_id),
+        )
+
+    def retry(self, job_id, delay, error):
+        self._connect().execute(
+            "UPDATE notifications SET status = 'pending', attempts = attempts + 1, "
+            "next_attempt_at = ?, lease_until = NULL, last_error = ? WHERE id = ?",
+            (time.time() + delay, str(error), job_id),
+        )
+
+    def dead_letter(self, job_id, error):
+        self._connect().execute(
+            "UPDATE notifications SET status = 'dead', attempts = attempts + 1, "
+            "lease_until = NULL, last_error = ? WHERE id = ?",
+            (str(error), job_id),
+        )
+
+    def requeue_dead(self):
+        """Возвращает задачи из dead-letter обратно в очередь (ручной повтор из админки)."""
+        cur = self._connect().execute(
+            "UPDATE notifications SET status = 'pending', attempts = 0, next_attempt_at = ? "
+            "WHERE status = 'dead'",
+            (time.time(),),
+        )
+        return cur.rowcount
+
+    def stats(self):
+        conn = self._connect()
+        counts = {r["status"]: r["n"] for r in conn.execute(
+            "SELECT status, COUNT(*) AS n FROM notifications GROUP BY status"
+        )}
+        oldest = conn.execute(
+            "SELECT MIN(created_at) FROM notifications WHERE status IN ('pending', 'inflight')"
+        ).fetchone()[0]
+        return {
+            "depth": counts.get("pending", 0) + counts.get("inflight", 0),
+            "pending": counts.get("pending", 0),
+            "inflight": counts.get("inflight", 0),
+            "delivered": counts.get("done", 0),
+            "dead": counts.get("dead", 0),
+            "oldest_pending_age": round(time.time() - oldest, 3) if oldest else 0.0,
+        }
+
+
+class NotificationDispatcher:
+    """
+    Фоновые воркеры доставки: опрашивают очередь, отправляют сообщения
+    с учётом лимитов Telegram (не чаще одного сообщения в секунду в чат
+    и общего лимита в секунду), повторяют с задержкой и складывают
+    безнадёжные задачи в dead-letter.
+    Лимит на чат общий для всех процессов (chat_limits в очереди), общий
+    лимит global_rate действует на процесс — при нескольких воркерах uvicorn
+    его стоит делить на их число.
+    """
+
+    def __init__(self, queue, client, workers=4, per_chat_interval=1.0, global_rate=25,
+                 max_attempts=8, backoff=2.0, poll_interval=1.0):
+        self.queue = queue
+        self.client = client
+        self.workers = workers
+        self.per_chat_interval = per_chat_interval
+        self.global_interval = 1.0 / global_rate
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self._jobs = None
+        self._wakeup = None
+        self._tasks = []
+        self._chat_locks = {}
+        self._chat_next = {}
+        self._global_lock = None
+        self._global_next = 0.0
+        self._loop = None
+        self.last_delivery_lag = 0.0
+
+    # ======== Жизненный цикл ========
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._jobs = asyncio.Queue(maxsize=self.workers * 4)
+        self._wakeup = asyncio.Event()
+        self._global_lock = asyncio.Lock()
+        self._tasks = [asyncio.create_task(self._poller())]
+        self._tasks += [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        log.info("Notification dispatcher started", extra={"workers": self.workers})
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wakeup(self):
+        """Будит опрос очереди сразу после постановки новой задачи (из любого потока)."""
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def enqueue(self, method, chat_id, payload) -> int:
+        job_id = await asyncio.to_thread(self.queue.enqueue, method, chat_id, payload)
+        self.wakeup()
+        return job_id
+
+    def stats(self):
+        stats = self.queue.stats()
+        stats["workers"] = len(self._tasks) - 1 if self._tasks else 0
+        stats["last_delivery_lag"] = round(self.last_delivery_lag, 3)
+        return stats
+
+    # ======== Воркеры ========
+
+    async def _poller(self):
+        while True:
+            try:
+                jobs = await asyncio.to_thread(self.queue.claim, self.workers * 4, self.per_chat_interval)
+            except Exception as e:
+                log.error("Notification queue claim failed", extra={"error": str(e)})
+                jobs = []
+            for job in jobs:
+                await self._jobs.put(job)
+            if not jobs:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _throttle(self, chat_id):
+        """Ждёт, пока лимиты Telegram позволят отправить сообщение в этот чат."""
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        await lock.acquire()
+        try:
+            delay = self._chat_next.get(chat_id, 0.0) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with self._global_lock:
+                delay = self._global_next - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self._global_next = time.monotonic() + self.global_interval
+        except BaseException:
+            # Отмена во время ожидания (stop()) не должна оставить чат запертым
+            lock.release()
+            raise
+        return lock
+
+    async def _worker(self):
+        while True:
+            job = await self._jobs.get()
+            chat_id = job["chat_id"]
+            lock = await self._throttle(chat_id)
+            try:
+                await self.client.call(job["method"], job["payload"])
+            except Exception as e:
+                await asyncio.to_thread(self._handle_failure, job, e)
+            else:
+                self.last_delivery_lag = time.time() - job["created_at"]
+                await asyncio.to_thread(self.queue.ack, job["id"])
+            finally:
+                self._chat_next[chat_id] = time.monotonic() + self.per_chat_interval
+                lock.release()
+                if len(self._chat_next) > 1000:
+                    self._prune_chats()
+                self._jobs.task_done()
+
+    def _prune_chats(self):
+        """Забывает чаты, для которых лимит уже не действует."""
+        now = time.monotonic()
+        for chat_id, next_at in list(self._chat_next.items()):
+            lock = self._chat_locks.get(chat_id)
+            if next_at < now and (lock is None or not lock.locked()):
+                self._chat_next.pop(chat_id, None)
+                self._chat_locks.pop(chat_id, None)
+
+    def _handle_failure(self, job, error):
+        attempts = job["attempts"] + 1
+        status = getattr(error, "status_code", None)
+        permanent = status is not None and status < 500 and status != 429
+        if permanent or attempts >= self.max_attempts:
+            log.error("Notification dead-lettered",
+                      extra={"job_id": job["id"], "attempts": attempts, "error": str(error)})
+            self.queue.dead_letter(job["id"], error)
+            return
+        retry_after = getattr(error, "retry_after", None)
+        delay = float(retry_after) if retry_after else self.backoff * (2 ** job["attempts"]) * (1 + random.random() * 0.25)
+        log.warning("Notification failed, will retry",
+                    extra={"job_id": job["id"], "error": str(error), "retry_in": round(delay, 1)})
+        self.queue.retry(job["id"], delay, error)
@@ -0,0 +1,236 @@
+import json
+import time
+import sqlite3
+import datetime
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at  REAL NOT NULL,
+    day         TEXT NOT NULL,
+    user_id     TEXT,
+    promo       TEXT,
+    total       INTEGER NOT NULL,
+    units       INTEGER NOT NULL,
+    items       TEXT NOT NULL               -- [{product_id, name, size, qty, price}]
+);
+CREATE INDEX IF NOT EXISTS idx_orders_day ON orders(day);
+
+-- Агрегаты обновляются в той же транзакции, что и запись заказа
+CREATE TABLE IF NOT EXISTS agg_buckets (
+    granularity TEXT NOT NULL,              -- day | hour
+    bucket      TEXT NOT NULL,              -- 2025-01-31 | 2025-01-31T14
+    orders      INTEGER NOT NULL DEFAULT 0,
+    revenue     INTEGER NOT NULL DEFAULT 0,
+    units       INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularity, bucket)
+);
+CREATE TABLE IF NOT EXISTS agg_products (
+    day         TEXT NOT NULL,              -- '*' — за всё время
+    product_id  INTEGER NOT NULL,
+    name        TEXT NOT NULL,
+    units       INTEGER NOT NULL DEFAULT 0,
+    revenue     INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, product_id)
+);
+CREATE TABLE IF NOT EXISTS agg_sizes (
+    day         TEXT NOT NULL,
+    size        TEXT NOT NULL,
+    units       INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, size)
+);
+CREATE TABLE IF NOT EXISTS agg_promos (
+    day         TEXT NOT NULL,
+    promo       TEXT NOT NULL,
+    uses        INTEGER NOT NULL DEFAULT 0,
+    revenue     INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, promo)
+);
+"""
+
+ALL_TIME = "*"
+# Без периода ряд по дням/часам отдаётся только за последние дни, а не за всю историю
+DEFAULT_SERIES_DAYS = 30
+
+
+def _parse_day(value):
+    """'YYYY-MM-DD' → та же строка; ValueError, если формат другой."""
+    if value is None:
+        return None
+    return datetime.date.fromisoformat(str(value)).isoformat()
+
+
+class OrderLog:
+    """
+    Журнал заказов (только добавление) и агрегаты по нему в SQLite.
+    Каждый заказ в одной транзакции дописывается в журнал и прибавляется к
+    счётчикам: выручка, штуки по размерам, товары, промокоды, корзины по дням и часам.
+    Статистика читает готовые счётчики: за всё время — O(1), за период — O(дней).
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ======== Запись ========
+
+    def record(self, items, total, user_id=None, promo=None, created_at=None) -> int:
+        """
+        Записывает заказ. items — [{product_id, name, size, qty, price}],
+        total — итоговая сумма заказа (со скидкой). Возвращает id заказа.
+        """
+        created_at = created_at or time.time()
+        moment = datetime.datetime.fromtimestamp(created_at)
+        day = moment.date().isoformat()
+        hour = moment.strftime("%Y-%m-%dT%H")
+        units = sum(item["qty"] for item in items)
+        # Коды в нижнем регистре — как в PromoEngine и админке
+        promo = (promo or "").strip().lower() or None
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute(
+                "INSERT INTO orders (created_at, day, user_id, promo, total, units, items) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (created_at, day, None if user_id is None else str(user_id), promo, total, units,
+                 json.dumps(items, ensure_ascii=False)),
+            )
+            self._apply(conn, day, hour, items, total, units, promo)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cur.lastrowid
+
+    def _apply(self, conn, day, hour, items, total, units, promo):
+        """Прибавляет один заказ ко всем агрегатам (и за день, и за всё время)."""
+        conn.executemany(
+            "INSERT INTO agg_buckets (granularity, bucket, orders, revenue, units) VALUES (?, ?, 1, ?, ?) "
+            "ON CONFLICT (granularity, bucket) DO UPDATE SET orders = orders + 1, "
+            "revenue = revenue + excluded.revenue, units = units + excluded.units",
+            [("day", day, total, units), ("hour", hour, total, units), ("all", ALL_TIME, total, units)],
+        )
+        for key in (day, ALL_TIME):
+            conn.executemany(
+                "INSERT INTO agg_products (day, product_id, name, units, revenue) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (day, product_id) DO UPDATE SET name = excluded.name, "
+                "units = units + excluded.units, revenue = revenue + excluded.revenue",
+                [(key, item["product_id"], item.get("name") or "", item["qty"], item["price"] * item["qty"])
+                 for item in items],
+            )
+            conn.executemany(
+                "INSERT INTO agg_sizes (day, size, units) VALUES (?, ?, ?) "
+                "ON CONFLICT (day, size) DO UPDATE SET units = units + excluded.units",
+                [(key, item.get("size") or "-", item["qty"]) for item in items],
+            )
+            if promo:
+                conn.execute(
+                    "INSERT INTO agg_promos (day, promo, uses, revenue) VALUES (?, ?, 1, ?) "
+                    "ON CONFLICT (day, promo) DO UPDATE SET uses = uses + 1, revenue = revenue + excluded.revenue",
+                    (key, promo, total),
+                )
+
+    def rebuild(self):
+        """Пересчитывает все агрегаты из журнала (после ручной правки или смены формата)."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for table in ("agg_buckets", "agg_products", "agg_sizes", "agg_promos"):
+                conn.execute(f"DELETE FROM {table}")
+            count = 0
+            for row in conn.execute("SELECT * FROM orders ORDER BY id").fetchall():
+                moment = datetime.datetime.fromtimestamp(row["created_at"])
+                self._apply(conn, row["day"], moment.strftime("%Y-%m-%dT%H"), json.loads(row["items"]),
+                            row["total"], row["units"], row["promo"])
+                count += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return count
+
+    # ======== Чтение ========
+
+    def summary(self, date_from=None, date_to=None, top=10, granularity="day"):
+        """
+        Продажи за период [date_from, date_to] (даты 'YYYY-MM-DD', включительно).
+        Без дат — за всё время, из готовых итоговых счётчиков; ряд buckets тогда
+        ограничен последними DEFAULT_SERIES_DAYS днями.
+        """
+        date_from, date_to = _parse_day(date_from), _parse_day(date_to)
+        if granularity not in ("day", "hour"):
+            raise ValueError("granularity должен быть day или hour")
+        conn = self._connect()
+        ranged = date_from is not None or date_to is not None
+        # Условие по дню; для часов сравниваем префикс 'YYYY-MM-DD'
+        low, high = date_from or "0000-00-00", date_to or "9999-99-99"
+
+        if ranged:
+            where, args = "day BETWEEN ? AND ? AND day != ?", (low, high, ALL_TIME)
+            totals = conn.execute(
+                "SELECT COALESCE(SUM(orders), 0) AS orders, COALESCE(SUM(revenue), 0) AS revenue, "
+                "COALESCE(SUM(units), 0) AS units FROM agg_buckets "
+                "WHERE granularity = 'day' AND bucket BETWEEN ? AND ?", (low, high),
+            ).fetchone()
+        else:
+            where, args = "day = ?", (ALL_TIME,)
+            totals = conn.execute(
+                "SELECT orders, revenue, units FROM agg_buckets WHERE granularity = 'all'"
+            ).fetchone()
+
+        sizes = conn.execute(
+            f"SELECT size, SUM(units) AS units FROM agg_sizes WHERE {where} GROUP BY size ORDER BY units DESC", args,
+        ).fetchall()
+        products = conn.execute(
+            f"SELECT product_id, MAX(name) AS name, SUM(units) AS units, SUM(revenue) AS revenue "
+            f"FROM agg_products WHERE {where} GROUP BY product_id ORDER BY units DESC, revenue DESC LIMIT ?",
+            (*args, top),
+        ).fetchall()
+        promos = conn.execute(
+            f"SELECT promo, SUM(uses) AS uses, SUM(revenue) AS revenue FROM agg_promos WHERE {where} "
+            f"GROUP BY promo ORDER BY uses DESC", args,
+        ).fetchall()
+        if not ranged:
+            low = (datetime.date.today() - datetime.timedelta(days=DEFAULT_SERIES_DAYS - 1)).isoformat()
+        buckets = conn.execute(
+            "SELECT bucket, orders, revenue, units FROM agg_buckets "
+            "WHERE granularity = ? AND substr(bucket, 1, 10) BETWEEN ? AND ? ORDER BY bucket",
+            (granularity, low, high),
+        ).fetchall()
+
+        orders = totals["orders"] if totals else 0
+        revenue = totals["revenue"] if totals else 0
+        return {
+            "from": date_from,
+            "to": date_to,
+            "orders": orders,
+            "revenue": revenue,
+            "units": totals["units"] if totals else 0,
+            "average_order": round(revenue / orders) if orders else 0,
+            "units_per_size": {r["size"]: r["units"] for r in sizes},
+            "top_products": [dict(r) for r in products],
+            "promo_usage": {r["promo"]: {"uses": r["uses"], "revenue": r["revenue"]} for r in promos},
+            "buckets": {"granularity": granularity, "items": [dict(r) for r in buckets]},
+        }
+
+    def orders(self, date_from=None, date_to=None, limit=100):
+        """Последние заказы из журнала за период."""
+        low = _parse_day(date_from) or "0000-00-00"
+        high = _parse_day(date_to) or "9999-99-99"
+        rows = self._connect().execute(
+            "SELECT * FROM orders WHERE day BETWEEN ? AND ? ORDER BY id DESC LIMIT ?", (low, high, limit),
+        ).fetchall()
+        return [dict(r, items=json.loads(r["items"])) for r in rows]
@@ -0,0 +1,88 @@
+"""
+Расчёт корзины на сервере: цены строк, наличие, промокод и итог за один проход
+по снимку каталога. Клиентским ценам и итогам не доверяем — источник истины здесь.
+"""
+from promo_engine import PromoRejected
+
+MAX_LINES = 100
+
+
+def cart_lines(raw_items):
+    """
+    Позиции корзины (product_id, size, qty) из запроса.
+    Принимает и формат корзины фронтенда (productId/quantity), и короткий (product_id/qty).
+    """
+    if not isinstance(raw_items, list):
+        raise ValueError("items должен быть списком")
+    if len(raw_items) > MAX_LINES:
+        raise ValueError(f"Слишком много позиций: {len(raw_items)}")
+    lines = []
+    for item in raw_items:
+        product_id = int(item.get("productId", item.get("product_id")))
+        qty = int(item.get("quantity", item.get("qty", 1)))
+        if qty <= 0:
+            raise ValueError(f"Некорректное количество для товара {product_id}: {qty}")
+        lines.append((product_id, str(item.get("size")), qty))
+    return lines
+
+
+def apply_discount(subtotal, discount):
+    """Итог со скидкой в процентах; округление как было на фронтенде (Math.round)."""
+    return int(subtotal * (1 - discount / 100) + 0.5)
+
+
+def price_cart(snapshot, lines, discount=0, available=None):
+    """
+    Цены строк и итог по снимку каталога.
+    available(product_id, size) — свободный остаток; без него наличие берётся из снимка.
+    """
+    result_lines = []
+    subtotal = 0
+    all_available = True
+    for product_id, size, qty in lines:
+        product = snapshot.by_id.get(product_id)
+        if product is None:
+            result_lines.append({"productId": product_id, "size": size, "quantity": qty,
+                                 "found": False, "available": 0, "in_stock": False})
+            all_available = False
+            continue
+        free = available(product_id, size) if available else snapshot.stock(product_id, size)
+        in_stock = free >= qty
+        all_available = all_available and in_stock
+        price = int(product["price"])
+        subtotal += price * qty
+        result_lines.append({
+            "productId": product_id,
+            "name": product["name"],
+            "color": product.get("color", ""),
+            "size": size,
+            "quantity": qty,
+            "price": price,
+            "line_total": price * qty,
+            "found": True,
+            "available": max(free, 0),
+            "in_stock": in_stock,
+        })
+    total = apply_discount(subtotal, discount) if discount else subtotal
+    return {
+        "lines": result_lines,
+        "subtotal": subtotal,
+        "discount_amount": subtotal - total,
+        "total": total,
+        "available": all_available,
+    }
+
+
+def quote_cart(snapshot, lines, promo_engine, promo=None, user_id=None, available=None):
+    """Полная котировка для /api/cart/quote: строки, наличие, промокод и итог."""
+    promo_info = None
+    discount = 0
+    if promo:
+        try:
+            discount = promo_engine.check(promo, user_id)
+            promo_info = {"code": promo.strip().lower(), "valid": True, "discount": discount}
+        except PromoRejected as e:
+            promo_info = {"code": e.code, "valid": False, "reason": e.reason}
+    quote = price_cart(snapshot, lines, discount, available)
+    quote["promo"] = promo_info
+    return quote
@@ -0,0 +1,278 @@
+import time
+import asyncio
+import datetime
+import threading
+
+from logger import get_logger
+
+log = get_logger("promo")
+
+# Поля промокода, которые ведёт сам движок, а не админка
+COUNTER_FIELDS = ("uses", "user_uses")
+
+
+class PromoRejected(Exception):
+    """Промокод не существует, истёк или исчерпан."""
+
+    def __init__(self, code, reason):
+        self.code = code
+        self.reason = reason
+        super().__init__(f"Промокод {code}: {reason}")
+
+
+def _parse_expiry(value):
+    """expires_at: 'YYYY-MM-DD' (действует весь день) или ISO-дата со временем."""
+    if not value:
+        return None
+    if len(str(value)) == 10:
+        day = datetime.date.fromisoformat(str(value))
+        return datetime.datetime.combine(day, datetime.time.max).timestamp()
+    return datetime.datetime.fromisoformat(str(value)).timestamp()
+
+
+class PromoEngine:
+    """
+    Промокоды в памяти поверх хранилища (storage.load_promos).
+
+    Хранилище читается один раз и перечитывается, только когда его поменяли
+    (счётчик storage.generation("promos") — в том числе правки из других воркеров).
+    Поддерживаются срок действия (expires_at), общий лимит использований (max_uses)
+    и лимит на пользователя (per_user_limit). Проверка лимита и увеличение счётчика
+    выполняются под одним замком, поэтому при наплыве заказов код не погашается
+    больше max_uses раз. Счётчики пишутся в хранилище пачками: раз в flush_interval
+    секунд или после flush_batch погашений.
+
+    В хранилище пишутся приращения к тому, что там лежит сейчас (под межпроцессным
+    замком), поэтому сбросы разных процессов не затирают друг друга. С write_through
+    (несколько воркеров) погашение кода с лимитом сразу сохраняется — тогда лимит
+    соблюдается по всем процессам вместе, а не в каждом по отдельности.
+    """
+
+    def __init__(self, storage, flush_interval=5.0, flush_batch=100, write_through=False):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.write_through = write_through
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._promos = None             # code -> запись из хранилища + несохранённые приращения
+        self._expiry = {}               # code -> timestamp | None
+        self._generation = None         # storage.generation("promos") на момент чтения
+        self._deltas = {}               # code -> {"uses": n, "user_uses": {user: n}} — ещё не в хранилище
+        self._pending = 0
+        self._task = None
+
+    # ======== Кэш ========
+
+    def _loaded(self):
+        generation = self.storage.generation("promos")
+        if self._promos is None or generation != self._generation:
+            promos = {code.lower(): self._normalize(data) for code, data in self.storage.load_promos().items()}
+            # Свои ещё не сохранённые погашения — поверх прочитанного
+            for code, delta in self._deltas.items():
+                if code in promos:
+                    self._apply(promos[code], delta)
+            self._expiry = {code: self._expiry_of(code, data) for code, data in promos.items()}
+            self._promos = promos
+            self._generation = generation
+        return self._promos
+
+    @staticmethod
+    def _normalize(data):
+        data = dict(data)
+        data["uses"] = int(data.get("uses", 0))
+        data["user_uses"] = dict(data.get("user_uses") or {})
+        return data
+
+    @staticmethod
+    def _apply(record, delta):
+        """Прибавляет приращение счётчиков к записи промокода."""
+        record["uses"] = max(0, record["uses"] + delta["uses"])
+        for user, n in delta["user_uses"].items():
+            left = record["user_uses"].get(user, 0) + n
+            if left > 0:
+                record["user_uses"][user] = left
+            else:
+                record["user_uses"].pop(user, None)
+
+    @staticmethod
+    def _subtract(delta, flushed):
+        """Убирает из накопленного приращения уже сохранённую часть (приращения бывают и отрицательными)."""
+        delta["uses"] -= flushed["uses"]
+        for user, n in flushed["user_uses"].items():
+            left = delta["user_uses"].get(user, 0) - n
+            if left:
+                delta["user_uses"][user] = left
+            else:
+                delta["user_uses"].pop(user, None)
+
+    @staticmethod
+    def _expiry_of(code, data):
+        try:
+            return _parse_expiry(data.get("expires_at"))
+        except ValueError:
+            log.warning("Bad promo expires_at ignored", extra={"code": code, "expires_at": data.get("expires_at")})
+            return None
+
+    def invalidate(self):
+        """Сбрасывает кэш (после записи в хранилище в обход движка); счётчики сначала сохраняются."""
+        self.flush()
+        with self._lock:
+            self._promos = None
+
+    # ======== Админка ========
+
+    def all(self):
+        with self._lock:
+            return [{"code": code, **data} for code, data in self._loaded().items()]
+
+    def upsert(self, code, data):
+        """Создаёт или меняет промокод; накопленные счётчики использований сохраняются."""
+        code = code.lower()
+        with self._flush_lock, self.storage.lock(), self._lock:
+            current = self._loaded().get(code, {})
+            record = self._normalize({**data, **{f: current[f] for f in COUNTER_FIELDS if f in current}})
+            _parse_expiry(record.get("expires_at"))
+            self.storage.upsert_promo(code, record)
+            # Свои приращения вошли в запись; чужие воркеры допишут свои поверх
+            self._deltas.pop(code, None)
+        return record
+
+    def delete(self, code) -> bool:
+        code = code.lower()
+        with self._flush_lock, self.storage.lock(), self._lock:
+            deleted = self.storage.delete_promo(code)
+            self._deltas.pop(code, None)
+            self._promos = None
+        return deleted
+
+    # ======== Проверка и погашение ========
+
+    def _validate(self, code, user_id, now):
+        """Возвращает запись промокода или выбрасывает PromoRejected. Вызывать под замком."""
+        promo = self._loaded().get(code)
+        if promo is None:
+            raise PromoRejected(code, "не найден")
+        expiry = self._expiry.get(code)
+        if expiry is not None and now > expiry:
+            raise PromoRejected(code, "срок действия истёк")
+        max_uses = promo.get("max_uses")
+        if max_uses is not None and promo["uses"] >= int(max_uses):
+            raise PromoRejected(code, "лимит использований исчерпан")
+        per_user = promo.get("per_user_limit")
+        if per_user is not None and user_id is not None:
+            if promo["user_uses"].get(str(user_id), 0) >= int(per_user):
+                raise PromoRejected(code, "вы уже использовали этот промокод")
+        return promo
+
+    def _count(self, code, promo, user_id, step):
+        """Меняет счётчики в кэше и запоминает приращение для сохранения. Вызывать под замком."""
+        change = {"uses": step, "user_uses": {} if user_id is None else {str(user_id): step}}
+        self._apply(promo, change)
+        delta = self._deltas.setdefault(code, {"uses": 0, "user_uses": {}})
+        self._subtract(delta, {"uses": -step, "user_uses": {u: -n for u, n in change["user_uses"].items()}})
+        self._pending += 1
+        return promo.get("max_uses") is not None or promo.get("per_user_limit") is not None
+
+    def check(self, code, user_id=None, now=None):
+        """Скидка по промокоду без погашения (для кнопки «Применить»)."""
+        code = (code or "").strip().lower()
+        with self._lock:
+            return self._validate(code, user_id, now or time.time())["discount"]
+
+    def redeem(self, code, user_id=None, now=None):
+        """Атомарно проверяет лимиты и гасит одно использование. Возвращает скидку."""
+        code = (code or "").strip().lower()
+        if self.write_through:
+            # Проверка по свежим счётчикам всех процессов и запись — под одним межпроцессным замком
+            with self._flush_lock, self.storage.lock():
+                with self._lock:
+                    promo = self._validate(code, user_id, now or time.time())
+                    limited = self._count(code, promo, user_id, 1)
+                if limited:
+                    self._flush()
+            return promo["discount"]
+
+        with self._lock:
+            promo = self._validate(code, user_id, now or time.time())
+            self._count(code, promo, user_id, 1)
+            flush_now = self._pending >= self.flush_batch
+        if flush_now:
+            self.flush()
+        return promo["discount"]
+
+    def refund(self, code, user_id=None):
+        """Возвращает использование, если заказ с промокодом не состоялся."""
+        code = (code or "").strip().lower()
+        if self.write_through:
+            with self._flush_lock, self.storage.lock():
+                if self._refund(code, user_id):
+                    self._flush()
+            return
+        self._refund(code, user_id)
+
+    def _refund(self, code, user_id):
+        with self._lock:
+            promo = self._loaded().get(code)
+            if promo is None or promo["uses"] <= 0:
+                return False
+            return self._count(code, promo, user_id, -1)
+
+    # ======== Сохранение счётчиков ========
+
+    def flush(self) -> int:
+        """Дописывает накопленные приращения счётчиков в хранилище одной записью. Возвращает число промокодов."""
+        with self._flush_lock, self.storage.lock():
+            return self._flush()
+
+    def _flush(self):
+        """Вызывать под _flush_lock и storage.lock()."""
+        with self._lock:
+            if not self._deltas:
+                return 0
+            flushed = {code: {"uses": d["uses"], "user_uses": dict(d["user_uses"])}
+                       for code, d in self._deltas.items()}
+        # Прибавляем к тому, что лежит в хранилище сейчас: там могут быть погашения других процессов
+        current = {code.lower(): data for code, data in self.storage.load_promos().items()}
+        batch = {}
+        for code, delta in flushed.items():
+            if code in current:
+                record = self._normalize(current[code])
+                self._apply(record, delta)
+                batch[code] = record
+        with self._lock:
+            # Под замком до вычета приращений: перечитавший кэш не посчитает их дважды.
+            # При ошибке записи приращения остаются и уйдут со следующим сбросом
+            if batch:
+                self.storage.update_promos(batch)
+            for code, delta in flushed.items():
+                left = self._deltas.get(code)
+                if left is None:
+                    continue
+                self._subtract(left, delta)
+                if not left["uses"] and not left["user_uses"]:
+                    del self._deltas[code]
+            self._pending = 0
+        return len(batch)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                log.error("Promo counters flush failed", extra={"error": str(e)})
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
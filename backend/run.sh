@@ -17,6 +17,14 @@ source .venv/bin/activate
 pip install --upgrade pip > /dev/null
 pip install -r requirements.txt > /dev/null
 
-# Запускаем сервер
-echo "🚀 Запускаю Uvicorn сервер..."
-uvicorn main:app --reload --port 8000
+# Запускаем сервер: WEB_CONCURRENCY > 1 — несколько воркеров без --reload
+# (uvicorn сам читает WEB_CONCURRENCY, записи синхронизирует shared_state.py)
+WEB_CONCURRENCY=${WEB_CONCURRENCY:-1}
+export WEB_CONCURRENCY
+if [ "$WEB_CONCURRENCY" -gt 1 ]; then
+    echo "🚀 Запускаю Uvicorn сервер ($WEB_CONCURRENCY воркеров)..."
+    uvicorn main:app --workers "$WEB_CONCURRENCY" --port 8000
+else
+    echo "🚀 Запускаю Uvicorn сервер..."
+    uvicorn main:app --reload --port 8000
+fi
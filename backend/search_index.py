@@ -0,0 +1,343 @@
+"""
+Полнотекстовый поиск по каталогу: инвертированный индекс по основам слов и
+префиксное дерево (trie) словоформ для автодополнения.
+
+Текст нормализуется под русский язык: регистр, ё → е, лёгкий стемминг
+(отрезаются типичные окончания — "платья", "платьев" и "платье" дают одну основу).
+Последнее слово запроса ищется и как префикс: пока покупатель печатает "хлоп",
+находятся товары со словом "хлопок".
+
+Индекс меняется по одному товару (add/remove), поэтому создание или удаление
+товара не требует перестройки; sync() сверяет индекс со снимком каталога и
+применяет только разницу. Сам индекс не потокобезопасен — см. ProductCatalog.search.
+"""
+import re
+import math
+import heapq
+import bisect
+import itertools
+
+# Поля товара и их вес в ранжировании: совпадение в названии важнее, чем в описании
+FIELD_WEIGHTS = {"name": 3, "color": 2, "composition": 1, "description": 1}
+
+# Слова, найденные только по префиксу, весят меньше точного совпадения
+PREFIX_WEIGHT = 0.5
+# Сколько самых частых словоформ хранит узел trie (подсказки и раскрытие префикса)
+TRIE_TOP = 16
+
+_WORD_RE = re.compile(r"[0-9a-zа-я]+")
+_CYRILLIC_RE = re.compile(r"[а-я]")
+
+# Окончания для стемминга, от длинных к коротким
+_ENDINGS = sorted((
+    "иями", "ями", "ами", "иях", "ого", "его", "ому", "ему", "ыми", "ими", "ией",
+    "ая", "яя", "ое", "ее", "ые", "ие", "ой", "ей", "ий", "ый", "ом", "ем",
+    "ам", "ям", "ах", "ях", "ую", "юю", "ов", "ев", "ия", "ии", "ию",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+), key=len, reverse=True)
+_MIN_STEM = 3
+
+
+def normalize_text(text):
+    """Нижний регистр и ё → е."""
+    return str(text).lower().replace("ё", "е")
+
+
+def tokenize(text):
+    """Слова нормализованного текста (буквы и цифры)."""
+    return _WORD_RE.findall(normalize_text(text))
+
+
+def stem(word):
+    """Лёгкий стемминг русских слов: отрезает окончание, если остаётся основа от 3 букв."""
+    if not _CYRILLIC_RE.search(word):
+        return word
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def _fingerprint(product):
+    """Значения индексируемых полей: по ним sync() узнаёт, изменился ли товар."""
+    return tuple(map(product.get, FIELD_WEIGHTS))
+
+
+class _TrieNode:
+    __slots__ = ("children", "count", "top")
+
+    def __init__(self):
+        self.children = {}
+        self.count = 0          # в скольких товарах встречается словоформа, оканчивающаяся в узле
+        self.top = []           # самые частые словоформы поддерева: [(-count, слово)]
+
+
+class PrefixTrie:
+    """
+    Словоформы с числом товаров, где они встречаются. В каждом узле хранится
+    список самых частых словоформ поддерева, поэтому подсказки по префиксу
+    отдаются за длину префикса, без обхода поддерева.
+    """
+
+    def __init__(self):
+        self.root = _TrieNode()
+
+    def _path(self, word, create=False):
+        node = self.root
+        path = [node]
+        for ch in word:
+            child = node.children.get(ch)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[ch] = _TrieNode()
+            node = child
+            path.append(node)
+        return path
+
+    def add(self, word, delta=1):
+        """Меняет число товаров со словоформой; при нуле словоформа удаляется."""
+        path = self._path(word, create=delta > 0)
+        if path is None:
+            return
+        path[-1].count = max(0, path[-1].count + delta)
+        # Снизу вверх: список узла собирается из списков детей, которые уже обновлены
+        for depth in range(len(word), -1, -1):
+            node = path[depth]
+            if delta > 0:
+                if not self._promote(node, word, path[-1].count):
+                    # Не вошла в список узла — не войдёт и в списки предков
+                    break
+            else:
+                if any(w == word for _, w in node.top):
+                    self._rebuild(node, word[:depth])
+                if depth and not node.count and not node.children:
+                    del path[depth - 1].children[word[depth - 1]]
+
+    def _promote(self, node, word, count):
+        """Поднимает словоформу в списке узла; False, если она туда не попадает."""
+        top = node.top
+        entry = (-count, word)
+        if len(top) == TRIE_TOP and entry > top[-1]:
+            return False
+        for i, (_, w) in enumerate(top):
+            if w == word:
+                del top[i]
+                break
+        bisect.insort(top, entry)
+        del top[TRIE_TOP:]
+        return True
+
+    def _rebuild(self, node, word):
+        """Пересобирает список узла word из его словоформы и списков детей."""
+        candidates = [entry for child in node.children.values() for entry in child.top]
+        if node.count:
+            candidates.append((-node.count, word))
+        node.top = heapq.nsmallest(TRIE_TOP, candidates)
+
+    def count(self, word):
+        path = self._path(word)
+        return path[-1].count if path else 0
+
+    def complete(self, prefix, limit=TRIE_TOP):
+        """Самые частые словоформы, начинающиеся с prefix."""
+        path = self._path(prefix)
+        if path is None:
+            return []
+        return [word for _, word in path[-1].top[:limit]]
+
+
+class SearchIndex:
+    """
+    Инвертированный индекс: основа слова → {вес: множество товаров с этим весом}.
+    Вес — сумма весов полей, в которых встречается основа; при поиске умножается
+    на idf основы. Товаров с одинаковой оценкой немного групп, поэтому первые N
+    результатов берутся обходом групп по убыванию оценки без сортировки всех
+    совпадений, а запросы из нескольких слов считаются пересечениями множеств.
+    При равной оценке товары идут в порядке хранения в множестве.
+    """
+
+    def __init__(self):
+        self._postings = {}     # основа -> {вес: {id}}
+        self._sizes = {}        # основа -> в скольких товарах встречается
+        self._docs = {}         # id -> отпечаток индексируемых полей
+        self._stems = {}        # словоформа -> основа
+        self.trie = PrefixTrie()
+
+    def __len__(self):
+        return len(self._docs)
+
+    # ======== Изменение ========
+
+    @staticmethod
+    def _analyze(fingerprint):
+        """(веса основ, словоформы) для отпечатка полей товара."""
+        weights = {}
+        words = set()
+        for weight, text in zip(FIELD_WEIGHTS.values(), fingerprint):
+            field_words = set(tokenize(text)) if text else set()
+            words |= field_words
+            for s in {stem(word) for word in field_words}:
+                weights[s] = weights.get(s, 0) + weight
+        return weights, words
+
+    def _index(self, product_id, fingerprint, sign, word_counts):
+        """Добавляет (sign=1) или убирает (sign=-1) товар; изменения словоформ копит в word_counts."""
+        weights, words = self._analyze(fingerprint)
+        for s, weight in weights.items():
+            if sign > 0:
+                self._postings.setdefault(s, {}).setdefault(weight, set()).add(product_id)
+                self._sizes[s] = self._sizes.get(s, 0) + 1
+                continue
+            tiers = self._postings[s]
+            tiers[weight].discard(product_id)
+            if not tiers[weight]:
+                del tiers[weight]
+            self._sizes[s] -= 1
+            if not tiers:
+                del self._postings[s], self._sizes[s]
+        for word in words:
+            word_counts[word] = word_counts.get(word, 0) + sign
+
+    def _apply_words(self, word_counts):
+        """Переносит накопленные изменения словоформ в trie — по одному проходу на словоформу."""
+        for word, delta in word_counts.items():
+            if not delta:
+                continue
+            self.trie.add(word, delta)
+            if delta > 0:
+                self._stems.setdefault(word, stem(word))
+            elif not self.trie.count(word):
+                self._stems.pop(word, None)
+
+    def _update(self, product, word_counts):
+        product_id = product["id"]
+        fingerprint = _fingerprint(product)
+        old = self._docs.get(product_id)
+        if old == fingerprint:
+            return
+        if old is not None:
+            self._index(product_id, old, -1, word_counts)
+        self._index(product_id, fingerprint, 1, word_counts)
+        self._docs[product_id] = fingerprint
+
+    def add(self, product):
+        """Добавляет товар или заменяет его прежнюю версию."""
+        word_counts = {}
+        self._update(product, word_counts)
+        self._apply_words(word_counts)
+
+    def remove(self, product_id):
+        fingerprint = self._docs.pop(product_id, None)
+        if fingerprint is None:
+            return
+        word_counts = {}
+        self._index(product_id, fingerprint, -1, word_counts)
+        self._apply_words(word_counts)
+
+    def sync(self, products):
+        """Приводит индекс к списку товаров; пересчитываются только изменившиеся."""
+        word_counts = {}
+        seen = set()
+        for product in products:
+            seen.add(product["id"])
+            self._update(product, word_counts)
+        for product_id in [pid for pid in self._docs if pid not in seen]:
+            self._index(product_id, self._docs.pop(product_id), -1, word_counts)
+        self._apply_words(word_counts)
+
+    # ======== Поиск ========
+
+    def _groups(self, query, prefix):
+        """
+        На каждое слово запроса — [(основа, множитель веса)]; пустая группа значит
+        "ничего не найдено". Множитель — idf основы, для префиксных совпадений меньше.
+        """
+        words = tokenize(query)
+        groups = []
+        for i, word in enumerate(words):
+            factors = {}
+            s = stem(word)
+            if s in self._postings:
+                factors[s] = 1.0
+            if prefix and i == len(words) - 1:
+                for completion in self.trie.complete(word):
+                    factors.setdefault(self._stems[completion], PREFIX_WEIGHT)
+            groups.append([(s, factor * math.log(1 + len(self._docs) / self._sizes[s]))
+                           for s, factor in factors.items()])
+        return groups
+
+    def _tiers(self, group):
+        """[(оценка, товары)] группы по убыванию оценки."""
+        tiers = [(weight * factor, tier) for s, factor in group for weight, tier in self._postings[s].items()]
+        tiers.sort(key=lambda st: -st[0])
+        return tiers
+
+    @staticmethod
+    def _matches(tiers):
+        """Множество id товаров, подходящих под одну группу."""
+        if len(tiers) == 1:
+            return tiers[0][1]
+        return set().union(*(tier for _, tier in tiers))
+
+    def query(self, query, limit=20, prefix=True):
+        """
+        Возвращает (id товаров по убыванию релевантности, сколько всего найдено).
+        Товар должен содержать все слова запроса; последнее слово при prefix=True
+        может быть началом слова.
+        """
+        groups = self._groups(query, prefix)
+        if not groups or not all(groups):
+            return [], 0
+        groups = [self._tiers(group) for group in groups]
+
+        if len(groups) == 1:
+            # Одно слово: товар берётся из лучшей по оценке группы, где он встретился
+            tiers = groups[0]
+            found = {}
+            for _, tier in tiers:
+                for pid in tier:
+                    found.setdefault(pid)
+                    if len(found) == limit:
+                        break
+                if len(found) == limit:
+                    break
+            total = len(tiers[0][1]) if len(tiers) == 1 else len(self._matches(tiers))
+            return list(found), total
+
+        # Несколько слов: пересечение множеств (в C), начиная с самой маленькой группы
+        matches = sorted((self._matches(tiers) for tiers in groups), key=len)
+        candidates = matches[0] & matches[1]
+        for keys in matches[2:]:
+            candidates &= keys
+        total = len(candidates)
+
+        # Товары раскладываются по сумме оценок за каждое слово; для слова берётся
+        # лучшее совпадение (группы отсортированы по убыванию, найденные вычитаются).
+        # candidates и все множества ниже — новые, поэтому вычитание на месте безопасно
+        scored = {0.0: candidates}
+        for tiers in groups:
+            next_scored = {}
+            for score, pids in scored.items():
+                for tier_score, tier in tiers:
+                    hit = pids & tier
+                    if hit:
+                        pids -= hit
+                        next_scored.setdefault(score + tier_score, set()).update(hit)
+                    if not pids:
+                        break
+            scored = next_scored
+
+        found = []
+        for score in sorted(scored, reverse=True):
+            found.extend(itertools.islice(scored[score], limit - len(found)))
+            if len(found) == limit:
+                break
+        return found, total
+
+    def suggest(self, query, limit=5):
+        """Варианты продолжения последнего слова запроса."""
+        words = tokenize(query)
+        if not words or not normalize_text(query)[-1:].isalnum():
+            return []
+        return [w for w in self.trie.complete(words[-1], limit + 1) if w != words[-1]][:limit]
@@ -0,0 +1,80 @@
+"""
+Общее состояние процессов, работающих с одним хранилищем (воркеры uvicorn,
+CLI-утилиты): межпроцессный замок записи и счётчики поколений в разделяемой памяти.
+
+Состояние — маленький файл рядом с данными (products.json.state, calistor.db.state),
+отображённый в память через mmap. Писатель после каждой записи увеличивает счётчик
+поколения ("products" / "promos"), а читатели на каждом запросе сравнивают его со
+своим: это одно чтение 8 байт, поэтому кэши в памяти обновляются сразу после
+правки в админке без опроса файла. Замок — flock на том же файле.
+
+На одном хосте счётчики видны мгновенно. Между хостами с общим томом mmap не
+синхронизируется — там изменения подхватит периодическая проверка сигнатуры
+хранилища (ProductCatalog.check_interval), а flock работает на NFSv4.
+"""
+import os
+import mmap
+import struct
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:          # Windows: замок действует только между потоками процесса
+    fcntl = None
+
+MAGIC = b"CALSTAT1"
+# Ячейки по 8 байт после заголовка; новые добавлять только в конец
+SLOTS = ("products", "promos", "last_product_id")
+SIZE = len(MAGIC) + 8 * len(SLOTS)
+_OFFSETS = {name: len(MAGIC) + 8 * i for i, name in enumerate(SLOTS)}
+
+
+class SharedState:
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        with self.lock():
+            if os.fstat(self._fd).st_size < SIZE:
+                os.ftruncate(self._fd, SIZE)
+            self._mm = mmap.mmap(self._fd, SIZE)
+            if self._mm[:len(MAGIC)] != MAGIC:
+                self._mm[:] = MAGIC + bytes(SIZE - len(MAGIC))
+
+    @contextmanager
+    def lock(self):
+        """Эксклюзивный замок для всех процессов и потоков; повторный вход в том же потоке допустим."""
+        with self._thread_lock:
+            # flock принадлежит открытому файлу, а не потоку, поэтому потоки разводит RLock,
+            # а flock берётся только на внешнем уровне вложенности
+            self._depth += 1
+            try:
+                if self._depth == 1 and fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0 and fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def get(self, name) -> int:
+        return struct.unpack_from("<Q", self._mm, _OFFSETS[name])[0]
+
+    def set(self, name, value):
+        """Записывает значение ячейки; вызывать под lock()."""
+        struct.pack_into("<Q", self._mm, _OFFSETS[name], value)
+
+    def bump(self, name) -> int:
+        """Увеличивает счётчик поколения; вызывать после того, как данные записаны."""
+        with self.lock():
+            value = self.get(name) + 1
+            self.set(name, value)
+        return value
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        os.close(self._fd)
@@ -0,0 +1,587 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from metrics import STORAGE_WRITE_SECONDS
+from shared_state import SharedState
+from logger import get_logger
+
+log = get_logger("storage")
+
+
+class StorageError(Exception):
+    """Ошибка чтения/записи хранилища."""
+
+
+class InsufficientStock(StorageError):
+    """Остатка размера не хватает для списания."""
+
+    def __init__(self, product_id, size, requested, available):
+        self.product_id = product_id
+        self.size = size
+        self.requested = requested
+        self.available = available
+        super().__init__(f"Недостаточно товара {product_id} ({size}): нужно {requested}, есть {available}")
+
+
+class BaseStorage:
+    """
+    Интерфейс хранилища товаров и промокодов.
+    Каталог читает данные через read_products()/signature(), а админские
+    эндпоинты меняют отдельные записи, не переписывая всё хранилище.
+
+    Хранилище может использоваться несколькими процессами сразу: записи идут
+    под межпроцессным замком lock(), а после каждой записи растёт счётчик
+    generation("products" | "promos") в общей памяти (см. shared_state.py).
+    """
+
+    name = "base"
+    shared = None
+
+    # ---- общее состояние процессов ----
+    def lock(self):
+        """Межпроцессный замок записи (повторный вход в том же потоке допустим)."""
+        return self.shared.lock()
+
+    def generation(self, name="products") -> int:
+        """Счётчик изменений товаров или промокодов; чтение стоит как обращение к памяти."""
+        return self.shared.get(name)
+
+    # ---- товары ----
+    def signature(self):
+        """Дешёвый признак версии данных: меняется при любой записи (первым идёт generation())."""
+        raise NotImplementedError
+
+    def read_products(self):
+        """Возвращает (список товаров, дайджест содержимого)."""
+        raise NotImplementedError
+
+    def allocate_product_id(self) -> int:
+        """Атомарно выдаёт id для нового товара (до обработки его картинок)."""
+        raise NotImplementedError
+
+    def allocate_product_ids(self, count: int) -> list:
+        """Выдаёт подряд count id одним действием (для массового импорта)."""
+        raise NotImplementedError
+
+    def insert_product(self, product: dict):
+        raise NotImplementedError
+
+    def insert_products(self, products):
+        """Добавляет пачку товаров одной транзакцией: либо все, либо ни одного."""
+        raise NotImplementedError
+
+    def update_product(self, product: dict) -> bool:
+        raise NotImplementedError
+
+    def delete_product(self, product_id: int) -> bool:
+        raise NotImplementedError
+
+    def replace_products(self, products):
+        """Полная замена каталога (совместимость со старым save_products)."""
+        raise NotImplementedError
+
+    def adjust_stock(self, changes):
+        """
+        Атомарно меняет остатки: changes — список (product_id, size, delta).
+        Либо применяются все изменения, либо ни одного (InsufficientStock),
+        остаток никогда не уходит в минус.
+        Возвращает ({product_id: новые available_sizes}, дайджест содержимого).
+        """
+        raise NotImplementedError
+
+    # ---- промокоды ----
+    def load_promos(self) -> dict:
+        raise NotImplementedError
+
+    def upsert_promo(self, code: str, data: dict):
+        raise NotImplementedError
+
+    def delete_promo(self, code: str) -> bool:
+        raise NotImplementedError
+
+    def replace_promos(self, promos: dict):
+        raise NotImplementedError
+
+    def update_promos(self, promos: dict):
+        """Одной записью обновляет несколько существующих промокодов (удалённые не воскрешает)."""
+        raise NotImplementedError
+
+
+# ======== JSON-файлы ========
+
+def _atomic_write_json(path, data):
+    """Пишет JSON во временный файл и атомарно подменяет им целевой."""
+    started = time.perf_counter()
+    raw = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    STORAGE_WRITE_SECONDS.labels("json", os.path.basename(path)).observe(time.perf_counter() - started)
+    return raw
+
+
+class JsonStorage(BaseStorage):
+    """
+    Прежний формат: products.json и promos.json.
+    Каждая запись — чтение-изменение-запись под межпроцессным замком с атомарной
+    подменой файла, поэтому параллельные админские запросы (в том числе из разных
+    воркеров) не теряют изменения друг друга.
+    """
+
+    name = "json"
+
+    def __init__(self, products_file, promos_file, state_path=None):
+        self.products_file = products_file
+        self.promos_file = promos_file
+        self.shared = SharedState(state_path or f"{products_file}.state")
+
+    def signature(self):
+        # Счётчик — первым: запись после его чтения увеличит его и не потеряется.
+        # mtime сам по себе грубый (тики ядра), две записи подряд одного размера он не различит
+        generation = self.generation("products")
+        try:
+            st = os.stat(self.products_file)
+        except FileNotFoundError:
+            return (generation, None)
+        return (generation, st.st_mtime_ns, st.st_size)
+
+    def _read_json(self, path, default):
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return default, None
+        except OSError as e:
+            raise StorageError(f"{path}: {e}")
+        try:
+            return json.loads(raw), hashlib.sha256(raw).hexdigest()
+        except ValueError as e:
+            raise StorageError(f"{path}: {e}")
+
+    def read_products(self):
+        return self._read_json(self.products_file, [])
+
+    def _write(self, path, data, target):
+        """Запись файла под замком; другие процессы узнают о ней по счётчику поколения."""
+        raw = _atomic_write_json(path, data)
+        self.shared.bump(target)
+        return raw
+
+    def _modify_products(self, change):
+        with self.lock():
+            products, _ = self.read_products()
+            result = change(products)
+            self._write(self.products_file, products, "products")
+            return result
+
+    def allocate_product_id(self):
+        return self.allocate_product_ids(1)[0]
+
+    def allocate_product_ids(self, count):
+        # Последний выданный id хранится в общей памяти: товар с ним появится в файле
+        # только после обработки фото, а другой воркер не должен выдать тот же id
+        with self.lock():
+            products, _ = self.read_products()
+            first = max([p["id"] for p in products] + [self.shared.get("last_product_id")]) + 1
+            self.shared.set("last_product_id", first + count - 1)
+            return list(range(first, first + count))
+
+    def insert_product(self, product):
+        self._modify_products(lambda products: products.append(product))
+
+    def insert_products(self, products):
+        # Один атомарный rename файла — частично записанной пачки не бывает
+        self._modify_products(lambda current: current.extend(products))
+
+    def update_product(self, product):
+        def change(products):
+            for i, p in enumerate(products):
+                if p["id"] == product["id"]:
+                    products[i] = product
+                    return True
+            return False
+        return self._modify_products(change)
+
+    def delete_product(self, product_id):
+        def change(products):
+            before = len(products)
+            products[:] = [p for p in products if p["id"] != product_id]
+            return len(products) != before
+        return self._modify_products(change)
+
+    def replace_products(self, products):
+        with self.lock():
+            self._write(self.products_file, list(products), "products")
+
+    def adjust_stock(self, changes):
+        with self.lock():
+            products, _ = self.read_products()
+            by_id = {p["id"]: p for p in products}
+            updated = {}
+            for product_id, size, delta in changes:
+                product = by_id.get(product_id)
+                sizes = updated.get(product_id)
+                if sizes is None:
+                    sizes = dict(product.get("available_sizes", {})) if product else {}
+                qty = sizes.get(size)
+                if qty is None or qty + delta < 0:
+                    raise InsufficientStock(product_id, size, -delta, qty or 0)
+                sizes[size] = qty + delta
+                updated[product_id] = sizes
+            for product_id, sizes in updated.items():
+                by_id[product_id]["available_sizes"] = sizes
+            raw = self._write(self.products_file, products, "products")
+            return updated, hashlib.sha256(raw).hexdigest()
+
+    def load_promos(self):
+        try:
+            promos, _ = self._read_json(self.promos_file, {})
+        except StorageError:
+            return {}
+        return promos
+
+    def _modify_promos(self, change):
+        with self.lock():
+            promos = self.load_promos()
+            result = change(promos)
+            self._write(self.promos_file, promos, "promos")
+            return result
+
+    def upsert_promo(self, code, data):
+        self._modify_promos(lambda promos: promos.__setitem__(code, data))
+
+    def delete_promo(self, code):
+        return self._modify_promos(lambda promos: promos.pop(code, None) is not None)
+
+    def replace_promos(self, promos):
+        with self.lock():
+            self._write(self.promos_file, promos, "promos")
+
+    def update_promos(self, promos):
+        def change(current):
+            current.update({code: data for code, data in promos.items() if code in current})
+        self._modify_promos(change)
+
+
+# ======== SQLite (WAL) ========
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    name        TEXT NOT NULL,
+    price       INTEGER NOT NULL,
+    color       TEXT NOT NULL DEFAULT '',
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_products_color ON products(color);
+CREATE INDEX IF NOT EXISTS idx_products_price ON products(price);
+
+CREATE TABLE IF NOT EXISTS product_sizes (
+    product_id  INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    size        TEXT NOT NULL,
+    position    INTEGER NOT NULL,
+    qty         INTEGER NOT NULL,
+    PRIMARY KEY (product_id, size)
+);
+
+CREATE TABLE IF NOT EXISTS promos (
+    code        TEXT PRIMARY KEY,
+    data        TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key         TEXT PRIMARY KEY,
+    value       INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('next_product_id', 1);
+"""
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище в SQLite в режиме WAL.
+    Товар — строка products (поля для индексов + JSON остальных полей) и строки
+    product_sizes с остатками; запись стоит O(изменённых строк), читатели видят
+    только закоммиченные транзакции. Писателей разных процессов разводит сама
+    SQLite, а счётчик поколений в общей памяти растёт после каждого COMMIT.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, db_path, products_file=None, promos_file=None, state_path=None):
+        self.db_path = db_path
+        self.shared = SharedState(state_path or f"{db_path}.state")
+        self._local = threading.local()
+        # executescript сам управляет транзакцией
+        self._connect().executescript(SCHEMA)
+        self.migrate_from_json(products_file, promos_file)
+
+    # ---- соединения и транзакции ----
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    class _Transaction:
+        def __init__(self, conn, target, shared=None):
+            self.conn = conn
+            self.target = target
+            self.shared = shared
+
+        def __enter__(self):
+            self.started = time.perf_counter()
+            self.conn.execute("BEGIN IMMEDIATE")
+            return self.conn
+
+        def __exit__(self, exc_type, exc, tb):
+            if exc_type is None:
+                self.conn.execute("COMMIT")
+                STORAGE_WRITE_SECONDS.labels("sqlite", self.target).observe(time.perf_counter() - self.started)
+                # Только после COMMIT: прочитавший новый счётчик должен увидеть и новые данные
+                if self.shared is not None:
+                    self.shared.bump(self.target)
+            else:
+                self.conn.execute("ROLLBACK")
+            return False
+
+    def _transaction(self, target="products", notify=True):
+        return self._Transaction(self._connect(), target, self.shared if notify else None)
+
+    def _bump_generation(self, conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+
+    # ---- товары ----
+
+    def signature(self):
+        generation = self.generation("products")
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return (generation, row[0] if row else None)
+
+    def read_products(self):
+        conn = self._connect()
+        try:
+            # Один снимок для обеих таблиц
+            conn.execute("BEGIN")
+            generation = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+            rows = conn.execute("SELECT id, name, price, color, data FROM products ORDER BY id").fetchall()
+            sizes = conn.execute(
+                "SELECT product_id, size, qty FROM product_sizes ORDER BY product_id, position"
+            ).fetchall()
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise StorageError(str(e))
+
+        stock = {}
+        for r in sizes:
+            stock.setdefault(r["product_id"], {})[r["size"]] = r["qty"]
+
+        products = []
+        for r in rows:
+            product = {"id": r["id"], "name": r["name"], "price": r["price"], "color": r["color"]}
+            product["available_sizes"] = stock.get(r["id"], {})
+            product.update(json.loads(r["data"]))
+            products.append(product)
+        return products, f"sqlite:{generation}"
+
+    @staticmethod
+    def _split(product):
+        extra = {k: v for k, v in product.items()
+                 if k not in ("id", "name", "price", "color", "available_sizes", "sizes")}
+        return extra, product.get("available_sizes", {})
+
+    def _write_sizes(self, conn, product_id, sizes):
+        conn.execute("DELETE FROM product_sizes WHERE product_id = ?", (product_id,))
+        conn.executemany(
+            "INSERT INTO product_sizes (product_id, size, position, qty) VALUES (?, ?, ?, ?)",
+            [(product_id, size, i, int(qty)) for i, (size, qty) in enumerate(sizes.items())],
+        )
+
+    def _insert(self, conn, product):
+        extra, sizes = self._split(product)
+        conn.execute(
+            "INSERT INTO products (id, name, price, color, data) VALUES (?, ?, ?, ?, ?)",
+            (product["id"], product["name"], product["price"], product.get("color", ""),
+             json.dumps(extra, ensure_ascii=False)),
+        )
+        self._write_sizes(conn, product["id"], sizes)
+        conn.execute(
+            "UPDATE meta SET value = max(value, ?) WHERE key = 'next_product_id'", (product["id"] + 1,)
+        )
+
+    def allocate_product_id(self):
+        with self._transaction(notify=False) as conn:
+            product_id = conn.execute("SELECT value FROM meta WHERE key = 'next_product_id'").fetchone()[0]
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'next_product_id'")
+        return product_id
+
+    def allocate_product_ids(self, count):
+        with self._transaction(notify=False) as conn:
+            first = conn.execute("SELECT value FROM meta WHERE key = 'next_product_id'").fetchone()[0]
+            conn.execute("UPDATE meta SET value = value + ? WHERE key = 'next_product_id'", (count,))
+        return list(range(first, first + count))
+
+    def insert_product(self, product):
+        with self._transaction() as conn:
+            self._insert(conn, product)
+            self._bump_generation(conn)
+
+    def insert_products(self, products):
+        with self._transaction() as conn:
+            for product in products:
+                self._insert(conn, product)
+            self._bump_generation(conn)
+
+    def update_product(self, product):
+        extra, sizes = self._split(product)
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "UPDATE products SET name = ?, price = ?, color = ?, data = ? WHERE id = ?",
+                (product["name"], product["price"], product.get("color", ""),
+                 json.dumps(extra, ensure_ascii=False), product["id"]),
+            )
+            if cur.rowcount == 0:
+                return False
+            self._write_sizes(conn, product["id"], sizes)
+            self._bump_generation(conn)
+        return True
+
+    def delete_product(self, product_id):
+        with self._transaction() as conn:
+            cur = conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
+            if cur.rowcount:
+                self._bump_generation(conn)
+        return cur.rowcount > 0
+
+    def replace_products(self, products):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM products")
+            for product in products:
+                self._insert(conn, product)
+            self._bump_generation(conn)
+
+    def adjust_stock(self, changes):
+        with self._transaction() as conn:
+            for product_id, size, delta in changes:
+                # Условный UPDATE: строка меняется только если остаток не уйдёт в минус
+                cur = conn.execute(
+                    "UPDATE product_sizes SET qty = qty + ? "
+                    "WHERE product_id = ? AND size = ? AND qty + ? >= 0",
+                    (delta, product_id, size, delta),
+                )
+                if cur.rowcount == 0:
+                    row = conn.execute(
+                        "SELECT qty FROM product_sizes WHERE product_id = ? AND size = ?", (product_id, size)
+                    ).fetchone()
+                    raise InsufficientStock(product_id, size, -delta, row[0] if row else 0)
+
+            updated = {}
+            for product_id in {c[0] for c in changes}:
+                rows = conn.execute(
+                    "SELECT size, qty FROM product_sizes WHERE product_id = ? ORDER BY position", (product_id,)
+                ).fetchall()
+                updated[product_id] = {r["size"]: r["qty"] for r in rows}
+            self._bump_generation(conn)
+            generation = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+        return updated, f"sqlite:{generation}"
+
+    # ---- промокоды ----
+
+    def load_promos(self):
+        rows = self._connect().execute("SELECT code, data FROM promos ORDER BY rowid").fetchall()
+        return {r["code"]: json.loads(r["data"]) for r in rows}
+
+    def upsert_promo(self, code, data):
+        with self._transaction("promos") as conn:
+            conn.execute(
+                "INSERT INTO promos (code, data) VALUES (?, ?) "
+                "ON CONFLICT(code) DO UPDATE SET data = excluded.data",
+                (code, json.dumps(data, ensure_ascii=False)),
+            )
+
+    def delete_promo(self, code):
+        with self._transaction("promos") as conn:
+            cur = conn.execute("DELETE FROM promos WHERE code = ?", (code,))
+        return cur.rowcount > 0
+
+    def replace_promos(self, promos):
+        with self._transaction("promos") as conn:
+            conn.execute("DELETE FROM promos")
+            conn.executemany(
+                "INSERT INTO promos (code, data) VALUES (?, ?)",
+                [(code, json.dumps(data, ensure_ascii=False)) for code, data in promos.items()],
+            )
+
+    def update_promos(self, promos):
+        with self._transaction("promos") as conn:
+            conn.executemany(
+                "UPDATE promos SET data = ? WHERE code = ?",
+                [(json.dumps(data, ensure_ascii=False), code) for code, data in promos.items()],
+            )
+
+    # ---- миграция ----
+
+    def migrate_from_json(self, products_file, promos_file):
+        """
+        Однократный перенос products.json/promos.json в пустую базу.
+        Выполняется в одной транзакции; повторный запуск ничего не делает.
+        """
+        with self._transaction() as conn:
+            done = conn.execute("SELECT value FROM meta WHERE key = 'migrated'").fetchone()
+            if done:
+                return False
+            source = JsonStorage(products_file, promos_file) if products_file else None
+            products, _ = source.read_products() if source else ([], None)
+            promos = source.load_promos() if source and promos_file else {}
+
+            for product in products:
+                self._insert(conn, product)
+            conn.executemany(
+                "INSERT OR REPLACE INTO promos (code, data) VALUES (?, ?)",
+                [(code, json.dumps(data, ensure_ascii=False)) for code, data in promos.items()],
+            )
+            conn.execute("INSERT INTO meta (key, value) VALUES ('migrated', 1)")
+            self._bump_generation(conn)
+        log.info("Migrated JSON storage to SQLite",
+                 extra={"products": len(products), "promos": len(promos), "db_path": self.db_path})
+        return True
+
+
+def create_storage(products_file, promos_file):
+    """Выбирает хранилище по переменной окружения STORAGE_BACKEND (json | sqlite)."""
+    backend = os.getenv("STORAGE_BACKEND", "json").lower()
+    if backend == "sqlite":
+        db_path = os.getenv("SQLITE_PATH", "calistor.db")
+        return SQLiteStorage(db_path, products_file, promos_file)
+    if backend != "json":
+        log.warning("Unknown STORAGE_BACKEND, using json", extra={"backend": backend})
+    return JsonStorage(products_file, promos_file)
+
+
+if __name__ == "__main__":
+    # Ручной запуск миграции: python storage.py [путь к базе]
+    import sys
+    target = sys.argv[1] if len(sys.argv) > 1 else os.getenv("SQLITE_PATH", "calistor.db")
+    storage = SQLiteStorage(target, "products.json", os.path.join(os.path.dirname(os.path.abspath(__file__)), "promos.json"))
+    products, _ = storage.read_products()
+    print(f"✅ {target}: {len(products)} товаров, {len(storage.load_promos())} промокодов")
@@ -0,0 +1,84 @@
+"""
+Нагрузочная проверка резервирования: сотни параллельных покупок одного товара.
+Запуск: python stress_inventory.py
+Проверяет, что остаток ни разу не уходит в минус и сходится с числом подтверждённых заказов.
+"""
+import os
+import json
+import random
+import tempfile
+import threading
+
+from catalog import ProductCatalog
+from inventory import InventoryEngine
+from storage import JsonStorage, SQLiteStorage, InsufficientStock
+
+INITIAL_STOCK = 50
+BUYERS = 400
+
+
+def make_products():
+    return [
+        {"id": 1, "name": "Худи", "price": 5000, "color": "черный",
+         "available_sizes": {"S": INITIAL_STOCK, "M": INITIAL_STOCK}},
+        {"id": 2, "name": "Футболка", "price": 2500, "color": "белый",
+         "available_sizes": {"M": INITIAL_STOCK}},
+    ]
+
+
+def run(storage):
+    catalog = ProductCatalog(storage)
+    inventory = InventoryEngine(catalog, ttl=60)
+    committed = {("1", "S"): 0, ("1", "M"): 0, ("2", "M"): 0}
+    counter_lock = threading.Lock()
+    start = threading.Barrier(BUYERS)
+    negative = []
+
+    def buyer():
+        # Корзина из одного-двух SKU, часть заказов «не доходит» до менеджера
+        cart = random.sample([(1, "S", 1), (1, "M", 1), (2, "M", 1)], k=random.choice([1, 2]))
+        start.wait()
+        try:
+            reservation = inventory.reserve(cart)
+        except InsufficientStock:
+            return
+        for product_id, size, _ in cart:
+            if inventory.available(product_id, size) < 0:
+                negative.append((product_id, size))
+        if random.random() < 0.2:
+            inventory.release(reservation.id)
+            return
+        inventory.commit(reservation.id)
+        with counter_lock:
+            for product_id, size, qty in cart:
+                committed[(str(product_id), size)] += qty
+
+    threads = [threading.Thread(target=buyer) for _ in range(BUYERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    products, _ = storage.read_products()
+    stock = {(str(p["id"]), s): q for p in products for s, q in p["available_sizes"].items()}
+    for sku, sold in committed.items():
+        assert stock[sku] >= 0, f"{sku}: отрицательный остаток {stock[sku]}"
+        assert stock[sku] == INITIAL_STOCK - sold, f"{sku}: остаток {stock[sku]}, продано {sold}"
+        assert catalog.snapshot().stock(int(sku[0]), sku[1]) == stock[sku], f"{sku}: снимок разошёлся с хранилищем"
+    assert not negative, f"Доступный остаток уходил в минус: {negative[:5]}"
+    assert inventory.stats()["held_units"] == 0
+    return committed
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        products_file = os.path.join(tmp, "products.json")
+        with open(products_file, "w", encoding="utf-8") as f:
+            json.dump(make_products(), f, ensure_ascii=False)
+
+        for storage in (
+            JsonStorage(products_file, os.path.join(tmp, "promos.json")),
+            SQLiteStorage(os.path.join(tmp, "stress.db"), products_file),
+        ):
+            sold = run(storage)
+            print(f"✅ {storage.name}: {BUYERS} покупателей, продано {sold}, остаток не ушёл в минус")
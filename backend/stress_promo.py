@@ -0,0 +1,116 @@
+"""
+Нагрузочная проверка промокодов: флеш-распродажа, сотни одновременных заказов
+с ограниченным кодом.
+Запуск: python stress_promo.py
+Проверяет, что код не погашается больше max_uses раз, лимит на покупателя
+соблюдается, а сохранённые пачками счётчики сходятся с числом погашений —
+в одном процессе и в нескольких процессах (воркерах) над общим хранилищем.
+"""
+import os
+import json
+import random
+import tempfile
+import threading
+import multiprocessing
+
+from promo_engine import PromoEngine, PromoRejected
+from storage import JsonStorage, SQLiteStorage
+
+MAX_USES = 50
+PER_USER = 1
+BUYERS = 500
+USERS = 300             # часть покупателей пытается применить код дважды
+PROCESSES = 4
+
+
+def buy(engine, numbers):
+    """Покупатели numbers одновременно гасят код; возвращает user_id успешных заказов."""
+    redeemed = []
+    lock = threading.Lock()
+    start = threading.Barrier(len(numbers))
+
+    def buyer(n):
+        user_id = n % USERS
+        start.wait()
+        try:
+            engine.check("FLASH", user_id)
+            engine.redeem("FLASH", user_id)
+        except PromoRejected:
+            return
+        # Часть заказов срывается, использование возвращается
+        if random.random() < 0.1:
+            engine.refund("flash", user_id)
+            return
+        with lock:
+            redeemed.append(user_id)
+
+    threads = [threading.Thread(target=buyer, args=(n,)) for n in numbers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    engine.flush()
+    return redeemed
+
+
+def open_storage(kind, tmp):
+    if kind == "json":
+        return JsonStorage(os.path.join(tmp, "products.json"), os.path.join(tmp, "promos.json"))
+    return SQLiteStorage(os.path.join(tmp, "stress.db"))
+
+
+def worker(kind, tmp, numbers):
+    """Отдельный процесс — как воркер uvicorn со своим движком над тем же хранилищем."""
+    # Маленькая пачка, чтобы сбросы счётчиков шли параллельно с погашениями
+    engine = PromoEngine(open_storage(kind, tmp), flush_batch=7, write_through=True)
+    return buy(engine, numbers)
+
+
+def check_stored(storage, redeemed):
+    assert len(redeemed) <= MAX_USES, f"Код погашен {len(redeemed)} раз при лимите {MAX_USES}"
+    assert len(redeemed) == len(set(redeemed)), "Покупатель использовал код больше одного раза"
+    stored = storage.load_promos()["flash"]
+    assert stored["uses"] == len(redeemed), f"В хранилище {stored['uses']}, погашено {len(redeemed)}"
+    assert sum(stored["user_uses"].values()) == len(redeemed)
+
+    # Новый движок поверх того же хранилища видит сохранённые счётчики
+    fresh = PromoEngine(storage)
+    if len(redeemed) == MAX_USES:
+        try:
+            fresh.redeem("flash", "new-user")
+            raise AssertionError("Исчерпанный код погашен после перезапуска")
+        except PromoRejected:
+            pass
+    try:
+        fresh.check("expired")
+        raise AssertionError("Истёкший код принят")
+    except PromoRejected:
+        pass
+
+
+def run(kind, tmp, processes=1):
+    storage = open_storage(kind, tmp)
+    engine = PromoEngine(storage, flush_batch=7)
+    engine.upsert("flash", {"discount": 30, "max_uses": MAX_USES, "per_user_limit": PER_USER})
+    engine.upsert("expired", {"discount": 10, "expires_at": "2000-01-01"})
+
+    if processes == 1:
+        redeemed = buy(engine, range(BUYERS))
+    else:
+        chunks = [range(i, BUYERS, processes) for i in range(processes)]
+        with multiprocessing.get_context("spawn").Pool(processes) as pool:
+            results = pool.starmap(worker, [(kind, tmp, chunk) for chunk in chunks])
+        redeemed = [user_id for chunk in results for user_id in chunk]
+    check_stored(storage, redeemed)
+    return len(redeemed)
+
+
+if __name__ == "__main__":
+    for processes in (1, PROCESSES):
+        for kind in ("json", "sqlite"):
+            with tempfile.TemporaryDirectory() as tmp:
+                with open(os.path.join(tmp, "products.json"), "w", encoding="utf-8") as f:
+                    json.dump([], f)
+                used = run(kind, tmp, processes)
+            print(f"✅ {kind}, процессов {processes}: {BUYERS} заказов, код погашен {used} раз "
+                  f"(лимит {MAX_USES}), перерасхода нет")
@@ -0,0 +1,124 @@
+import os
+import time
+import random
+import asyncio
+
+from metrics import TELEGRAM_SECONDS
+from logger import get_logger
+
+log = get_logger("telegram")
+
+
+class TelegramAPIError(Exception):
+    """Bot API вернул ошибку или не ответил после всех попыток."""
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class TelegramClient:
+    """
+    Асинхронный клиент Telegram Bot API.
+    Держит пул соединений (keep-alive), ограничивает время запросов и повторяет
+    неудачные вызовы с экспоненциальной задержкой; на 429 ждёт ровно retry_after.
+    Базовый URL настраивается (TELEGRAM_API_URL), чтобы тесты ходили в локальную заглушку.
+    """
+
+    def __init__(self, token=None, base_url=None, timeout=10.0, max_retries=3,
+                 backoff=0.5, max_connections=20):
+        self._token = token
+        self._base_url = base_url
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._client = None
+        self._loop = None
+
+    # Токен и адрес читаются при вызове: .env может загрузиться после импорта модуля
+    @property
+    def token(self):
+        return self._token or os.getenv("BOT_TOKEN")
+
+    @property
+    def base_url(self):
+        return (self._base_url or os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")).rstrip("/")
+
+    def _http(self):
+        # httpx импортируется при первом вызове — это заметная часть времени старта процесса.
+        # Клиент привязан к циклу событий, в котором создан
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+            self._loop = loop
+        return self._client
+
+    async def call(self, method: str, payload: dict):
+        """Вызывает метод Bot API и возвращает поле result."""
+        import httpx
+
+        token = self.token
+        if not token:
+            raise TelegramAPIError("BOT_TOKEN not configured")
+        url = f"{self.base_url}/bot{token}/{method}"
+
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                response = await self._http().post(url, json=payload)
+            except httpx.HTTPError as e:
+                TELEGRAM_SECONDS.labels(method, "network_error").observe(time.perf_counter() - started)
+                error = TelegramAPIError(f"{method}: {type(e).__name__}: {e}")
+            else:
+                TELEGRAM_SECONDS.labels(method, str(response.status_code)).observe(time.perf_counter() - started)
+                try:
+                    data = response.json()
+                except ValueError:
+                    data = {}
+                if response.status_code == 200 and data.get("ok"):
+                    return data.get("result")
+
+                retry_after = (data.get("parameters") or {}).get("retry_after")
+                error = TelegramAPIError(
+                    f"{method}: {response.status_code} {data.get('description') or response.text}",
+                    status_code=response.status_code,
+                    retry_after=retry_after,
+                )
+                # Ошибки клиента (кроме 429) повторять бессмысленно
+                if response.status_code < 500 and response.status_code != 429:
+                    raise error
+
+            if attempt >= self.max_retries:
+                raise error
+            if error.retry_after:
+                delay = float(error.retry_after)
+            else:
+                delay = self.backoff * (2 ** attempt) * (1 + random.random() * 0.25)
+            attempt += 1
+            log.warning("Telegram call failed, will retry",
+                        extra={"method": method, "error": str(error), "attempt": attempt, "retry_in": round(delay, 1)})
+            await asyncio.sleep(delay)
+
+    async def send_message(self, chat_id, text, parse_mode="HTML"):
+        return await self.call("sendMessage", {"chat_id": chat_id, "text": text, "parse_mode": parse_mode})
+
+    async def send_photo(self, chat_id, photo, caption=None, parse_mode="HTML"):
+        payload = {"chat_id": chat_id, "photo": photo, "parse_mode": parse_mode}
+        if caption:
+            payload["caption"] = caption
+        return await self.call("sendPhoto", payload)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
@@ -2,31 +2,6 @@ const tg = window.Telegram.WebApp;
 tg.expand();
 tg.ready();
 
-// === Автообновление Mini App при новой версии ===
-(async () => {
-    try {
-        // Загружаем текущую версию с сервера
-        const res = await fetch('/version.txt', { cache: 'no-store' });
-        if (!res.ok) return;
-        const serverVersion = (await res.text()).trim();
-
-        // Проверяем, что у нас в localStorage
-        const localVersion = localStorage.getItem('frontend_version');
-
-        // Если версия изменилась → обновляем страницу
-        if (localVersion && localVersion !== serverVersion) {
-            console.log('🔄 Новая версия фронтенда. Перезагружаем Mini App...');
-            localStorage.setItem('frontend_version', serverVersion);
-            location.reload(true);
-        } else {
-            localStorage.setItem('frontend_version', serverVersion);
-        }
-    } catch (err) {
-        console.warn('⚠️ Ошибка проверки версии:', err);
-    }
-})();
-
-
 let currentProduct = null;
 let selectedSize = null;
 let cart = [];
@@ -74,20 +49,12 @@ const initialProductId = query.product_id ? parseInt(query.product_id) : null;
 document.addEventListener("DOMContentLoaded", () => {
     loadCart();
     loadMainBanner();
+    initProductsPager();
+    loadProductsPage();
+    initSearch();
 
-    fetch("/api/products")
-        .then(res => res.json())
-        .then(products => {
-            allProducts = products;
-            renderProducts(products);
-
-            // 🟢 Если пришёл параметр product_id — сразу открываем этот товар
-            if (initialProductId) {
-                const product = allProducts.find(p => p.id === initialProductId);
-                if (product) showProductDetail(product);
-            }
-        })
-        .catch(err => console.error(err));
+    // 🟢 Если пришёл параметр product_id — сразу открываем этот товар
+    if (initialProductId) openProduct(initialProductId);
 });
 
 
@@ -120,36 +87,131 @@ function goBack() {
 }
 
 // ========== ЗАГРУЗКА ТОВАРОВ ==========
-document.addEventListener('DOMContentLoaded', function () {
-    function loadMainBanner() {
-        const bannerImg = document.getElementById('main-banner');
-        if (bannerImg) {
-            const timestamp = new Date().getTime();
-            bannerImg.src = `/static/images/banner.webp?t=${timestamp}`;
-            console.log("Баннер загружен с обходом кэша.");
+const PRODUCTS_PAGE_SIZE = 20;
+let nextProductsCursor = null;
+let productsLoading = false;
+let productsExhausted = false;
+
+// Адрес статики с хэшем содержимого (карту window.ASSETS вставляет сервер в index.html)
+function assetUrl(path) {
+    return (window.ASSETS && window.ASSETS[path]) || `/static/${path}`;
+}
+
+function loadMainBanner() {
+    const bannerImg = document.getElementById('main-banner');
+    if (bannerImg) {
+        // Адрес с хэшем содержимого приходит из index.html: новый баннер = новый адрес
+        bannerImg.src = assetUrl('images/banner.webp');
+    }
+}
+
+// Подгружает следующую страницу каталога по курсору
+async function loadProductsPage() {
+    if (productsLoading || productsExhausted || searchActive) return;
+    productsLoading = true;
+
+    const params = new URLSearchParams({ limit: PRODUCTS_PAGE_SIZE });
+    if (nextProductsCursor) params.set('cursor', nextProductsCursor);
+
+    try {
+        const res = await fetch(`/api/products?${params}`);
+        if (!res.ok) throw new Error('Ошибка загрузки товаров');
+        const page = await res.json();
+
+        const isFirstPage = !nextProductsCursor;
+        allProducts = allProducts.concat(page.items);
+        renderProducts(page.items, !isFirstPage);
+
+        nextProductsCursor = page.next_cursor;
+        productsExhausted = !page.next_cursor;
+    } catch (error) {
+        console.error('Error:', error);
+        const productList = document.getElementById("product-list");
+        if (productList && allProducts.length === 0) {
+            productList.innerHTML = '<p>Ошибка загрузки товаров</p>';
         }
+    } finally {
+        productsLoading = false;
     }
+}
 
-    loadCart();
-    loadMainBanner();
+// Бесконечная прокрутка: следующая страница грузится, когда низ списка виден
+function initProductsPager() {
+    const container = document.getElementById("product-list");
+    if (!container || !('IntersectionObserver' in window)) return;
 
-    fetch("/api/products")
-        .then(res => {
-            if (!res.ok) throw new Error('Ошибка загрузки товаров');
-            return res.json();
-        })
-        .then(products => {
-            allProducts = products;
-            renderProducts(products);
-        })
-        .catch(error => {
-            console.error('Error:', error);
-            const productList = document.getElementById("product-list");
-            if (productList) {
-                productList.innerHTML = '<p>Ошибка загрузки товаров</p>';
-            }
-        });
-});
+    const sentinel = document.createElement('div');
+    sentinel.id = 'product-list-sentinel';
+    container.after(sentinel);
+
+    new IntersectionObserver(entries => {
+        if (entries.some(e => e.isIntersecting)) loadProductsPage();
+    }, { rootMargin: '400px' }).observe(sentinel);
+}
+
+// ========== ПОИСК ==========
+const SEARCH_DELAY_MS = 250;
+const SEARCH_LIMIT = 50;
+let searchTimer = null;
+let searchRequest = 0;
+let searchActive = false;
+
+// Поиск по мере ввода: запрос уходит после паузы в наборе
+function initSearch() {
+    const input = document.getElementById('search-input');
+    if (!input) return;
+    input.addEventListener('input', () => {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(() => runSearch(input.value), SEARCH_DELAY_MS);
+    });
+}
+
+async function runSearch(q) {
+    const requestId = ++searchRequest;
+    if (!q.trim()) {
+        resetSearch();
+        return;
+    }
+
+    try {
+        const res = await fetch(`/api/search?${new URLSearchParams({ q, limit: SEARCH_LIMIT })}`);
+        if (!res.ok) throw new Error('Ошибка поиска');
+        const result = await res.json();
+        // Ответ на устаревший запрос (пользователь уже печатает дальше) не показываем
+        if (requestId !== searchRequest) return;
+
+        searchActive = true;
+        showSuggestions(q, result.suggestions);
+        const container = document.getElementById("product-list");
+        if (result.items.length === 0) {
+            container.innerHTML = '<p>Ничего не найдено</p>';
+        } else {
+            renderProducts(result.items);
+        }
+    } catch (error) {
+        console.error('Error:', error);
+    }
+}
+
+// Подсказки — запрос целиком, где последнее слово заменено продолжением
+function showSuggestions(q, suggestions) {
+    const list = document.getElementById('search-suggestions');
+    if (!list) return;
+    const head = q.replace(/\S*$/, '');
+    list.replaceChildren(...suggestions.map(word => {
+        const option = document.createElement('option');
+        option.value = head + word;
+        return option;
+    }));
+}
+
+// Пустой запрос — возвращаем уже загруженный каталог и бесконечную прокрутку
+function resetSearch() {
+    searchActive = false;
+    showSuggestions('', []);
+    renderProducts(allProducts);
+    if (allProducts.length === 0) loadProductsPage();
+}
 
 // ========== ОБРАБОТЧИК РАЗМЕРОВ ==========
 document.addEventListener('click', function (e) {
@@ -164,25 +226,57 @@ document.addEventListener('click', function (e) {
     }
 });
 
+// ========== АДАПТИВНЫЕ ИЗОБРАЖЕНИЯ ==========
+// Ширина карточки: одна колонка на узких экранах, иначе сетка от 160px
+const CARD_IMAGE_SIZES = '(max-width: 480px) calc(100vw - 40px), 220px';
+
+// srcset из лестницы размеров фото (image_variants), браузер сам выберет под экран и DPR
+function srcsetFor(variants) {
+    if (!variants || !variants.length) return '';
+    return variants.map(v => `${v.url} ${v.width}w`).join(', ');
+}
+
+function imageVariants(product, index) {
+    return (product.image_variants && product.image_variants[index]) || [];
+}
+
+// LQIP: доминирующий цвет и размытая микрокопия из данных товара — карточка рисуется сразу,
+// пока фото ещё грузится, без дополнительных запросов
+function placeholderStyle(product, index) {
+    const placeholder = product.image_placeholders && product.image_placeholders[index];
+    if (!placeholder) return '';
+    const lqip = placeholder.lqip ? `url('${placeholder.lqip}') center / cover no-repeat, ` : '';
+    return `style="background: ${lqip}${placeholder.color || 'transparent'};"`;
+}
+
 // ========== РЕНДЕР ТОВАРОВ ==========
-function renderProducts(products) {
+function renderProducts(products, append = false) {
     const container = document.getElementById("product-list");
     if (!container) return;
 
-    container.innerHTML = products.map(product => {
+    const html = products.map(product => {
         const mainImage = product.images && product.images.length > 0
             ? product.images[0]
             : product.image;
+        const srcset = srcsetFor(imageVariants(product, 0));
+        const responsive = srcset ? `srcset="${srcset}" sizes="${CARD_IMAGE_SIZES}"` : '';
+        // Квадратные фото из конвейера: резервируем место под картинку заранее
+        const dimensions = srcset ? 'width="300" height="300"' : '';
 
         return `
     <div class="product" onclick="openProduct(${product.id})">
-        <img src="${mainImage}" alt="${product.name}" onerror="this.src='/static/images/placeholder.webp'" />
+        <img src="${mainImage}" ${responsive} ${dimensions} ${placeholderStyle(product, 0)} loading="lazy" decoding="async" alt="${product.name}" onerror="this.removeAttribute('srcset'); this.src='${assetUrl('images/placeholder.webp')}'" />
         <h3>${product.name}</h3>
         <p>${product.price}₽</p>
     </div>
   `;
     }).join("");
 
+    if (append) {
+        container.insertAdjacentHTML('beforeend', html);
+    } else {
+        container.innerHTML = html;
+    }
 }
 
 // ========== СТРАНИЦА ТОВАРА ==========
@@ -190,7 +284,18 @@ function openProduct(productId) {
     const product = allProducts.find(p => p.id === productId);
     if (product) {
         showProductDetail(product);
+        return;
     }
+
+    // Товар ещё не попал в загруженные страницы — запрашиваем его отдельно
+    fetch(`/api/products/${productId}`)
+        .then(res => res.ok ? res.json() : null)
+        .then(p => {
+            if (!p) return;
+            allProducts.push(p);
+            showProductDetail(p);
+        })
+        .catch(err => console.error(err));
 }
 
 function showProductDetail(product) {
@@ -227,18 +332,18 @@ function showProductDetail(product) {
 
     // Безопасная проверка: чтобы не падал при пустых данных
     if (!galleryImages || galleryImages.length === 0) {
-        galleryImages = ["/static/images/placeholder.webp"];
+        galleryImages = [assetUrl('images/placeholder.webp')];
     }
 
-    // Передаём изображения в initGallery
-    initGallery(galleryImages);
+    // Передаём изображения (и их лестницы размеров) в initGallery
+    initGallery(galleryImages, product.image_variants || []);
 
     // --- Переход на страницу товара ---
     showPage('product');
 }
 
 // ========== ГАЛЕРЕЯ ==========
-function initGallery(images) {
+function initGallery(images, variants = []) {
     if (!images || !images.length) return;
 
     let idx = 0;
@@ -249,7 +354,9 @@ function initGallery(images) {
         thumbs.innerHTML = '';
         images.forEach((src, i) => {
             const t = document.createElement('img');
-            t.src = src;
+            // Для миниатюр хватает самой маленькой ступени лестницы
+            const smallest = variants[i] && variants[i][0];
+            t.src = smallest ? smallest.url : src;
             t.className = 'thumb' + (i === idx ? ' active' : '');
             t.addEventListener('click', () => { idx = i; update(); });
             thumbs.appendChild(t);
@@ -257,6 +364,13 @@ function initGallery(images) {
     }
 
     function update() {
+        const srcset = srcsetFor(variants[idx]);
+        if (srcset) {
+            main.srcset = srcset;
+            main.sizes = '100vw';
+        } else {
+            main.removeAttribute('srcset');
+        }
         main.src = images[idx];
         [...document.querySelectorAll('.thumb')].forEach((el, i) =>
             el.classList.toggle('active', i === idx)
@@ -382,16 +496,18 @@ function renderCart() {
     }
 
     emptyCart.style.display = 'none';
+    // Сразу показываем сумму по ценам из корзины, затем уточняем по котировке сервера
     const totalPrice = cart.reduce((total, item) => total + item.price * item.quantity, 0);
     totalPriceElement.textContent = totalPrice;
+    refreshQuote();
 
     cartContainer.innerHTML = cart.map(item => `
         <div class="cart-item">
-            <img src="${item.image}" alt="${item.name}" class="cart-item-image" onerror="this.src='/static/images/placeholder.webp'">
+            <img src="${item.image}" alt="${item.name}" class="cart-item-image" onerror="this.src='${assetUrl('images/placeholder.webp')}'">
             <div class="cart-item-info">
                 <div class="cart-item-name">${item.name}</div>
                 <div class="cart-item-details">Размер: ${item.size} | Цвет: ${item.color}</div>
-                <div class="cart-item-price">${item.price}₽</div>
+                <div class="cart-item-price" data-cart-id="${item.id}">${item.price}₽</div>
             </div>
             <button class="cart-item-remove" onclick="removeFromCart(${item.id})">🗑️</button>
         </div>
@@ -404,9 +520,10 @@ function removeFromCart(itemId) {
     renderCart();
 }
 
-// === ПРОМОКОД ===
+// === ПРОМОКОД И КОТИРОВКА КОРЗИНЫ ===
 
-let appliedDiscount = 0;
+let appliedPromo = null;
+let lastQuote = null;
 
 // Привязка кнопки
 document.addEventListener("click", (e) => {
@@ -415,11 +532,59 @@ document.addEventListener("click", (e) => {
   }
 });
 
+// Цены, наличие, скидка и итог считает сервер — одним запросом на всю корзину
+async function requestQuote(promo) {
+  const res = await fetch("/api/cart/quote", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({
+      items: cart.map(item => ({ productId: item.productId, size: item.size, quantity: item.quantity })),
+      promo: promo || null,
+      user_id: tg.initDataUnsafe.user?.id,
+    }),
+  });
+  if (!res.ok) throw new Error("quote failed");
+  return res.json();
+}
+
+function showQuote(quote) {
+  lastQuote = quote;
+  const oldTotalElem = document.getElementById("old-total-price");
+  const totalElem = document.getElementById("total-price");
+
+  quote.lines.forEach((line, i) => {
+    const item = cart[i];
+    const priceElem = item && document.querySelector(`.cart-item-price[data-cart-id="${item.id}"]`);
+    if (!priceElem) return;
+    priceElem.textContent = !line.found
+      ? "Товар больше не продаётся"
+      : line.in_stock ? `${line.price}₽` : `${line.price}₽ — нет в наличии`;
+  });
+
+  if (quote.discount_amount > 0) {
+    oldTotalElem.style.display = "inline";
+    oldTotalElem.textContent = `${quote.subtotal}₽`;
+  } else {
+    oldTotalElem.style.display = "none";
+  }
+  totalElem.textContent = quote.total;
+}
+
+async function refreshQuote() {
+  if (cart.length === 0) return;
+  try {
+    const quote = await requestQuote(appliedPromo);
+    // Промокод мог истечь или исчерпаться, пока корзина была открыта
+    if (appliedPromo && !quote.promo?.valid) appliedPromo = null;
+    showQuote(quote);
+  } catch (err) {
+    console.error("Ошибка расчёта корзины:", err);
+  }
+}
+
 async function applyPromo() {
   const code = document.getElementById("promo-input").value.trim();
   const msg = document.getElementById("promo-message");
-  const oldTotalElem = document.getElementById("old-total-price");
-  const totalElem = document.getElementById("total-price");
 
   if (!code) {
     msg.textContent = "Введите промокод";
@@ -428,27 +593,15 @@ async function applyPromo() {
   }
 
   try {
-    const res = await fetch("/api/promo", {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ code }),
-    });
-
-    const data = await res.json();
-
-    if (data.valid) {
-      const oldTotal = parseInt(totalElem.textContent);
-      const discount = data.discount;
-      const newTotal = Math.round(oldTotal * (1 - discount / 100));
-
-      oldTotalElem.style.display = "inline";
-      oldTotalElem.textContent = `${oldTotal}₽`;
-      totalElem.textContent = newTotal;
+    const quote = await requestQuote(code);
 
-      msg.textContent = `✅ Скидка ${discount}% применена`;
+    if (quote.promo?.valid) {
+      appliedPromo = code;
+      showQuote(quote);
+      msg.textContent = `✅ Скидка ${quote.promo.discount}% применена`;
       msg.style.color = "green";
     } else {
-      msg.textContent = "❌ Неверный промокод";
+      msg.textContent = `❌ ${quote.promo?.reason ? "Промокод " + quote.promo.reason : "Неверный промокод"}`;
       msg.style.color = "red";
     }
   } catch (err) {
@@ -466,13 +619,11 @@ function checkout() {
         return;
     }
 
-    // Берём итоговую сумму со скидкой из DOM (а не пересчитываем вручную)
-    const totalPriceElem = document.getElementById("total-price");
-    const totalPrice = parseInt(totalPriceElem?.textContent || 0);
+    // Итог считает сервер заново; отправляем последнюю котировку только для сверки
+    const totalPrice = lastQuote ? lastQuote.total : null;
 
-    // Берём промокод (если введён)
-    const promoInput = document.getElementById("promo-input");
-    const promoCode = promoInput ? promoInput.value.trim() : null;
+    // Промокод отправляем, только если он был применён (гасится на сервере при заказе)
+    const promoCode = appliedPromo;
 
     const user = tg.initDataUnsafe.user || {};
 
@@ -498,10 +649,12 @@ function checkout() {
                 tg.MainButton.hideProgress();
                 if (data.status === "success") {
                     cart = [];
+                    appliedPromo = null;
+                    lastQuote = null;
                     saveCart();
                     renderCart();
                     showPage('home');
-                    tg.showAlert("✅ Заказ отправлен!");
+                    tg.showAlert(`✅ Заказ отправлен! Сумма: ${data.total}₽`);
                 } else throw new Error(data.detail);
             })
             .catch(error => {